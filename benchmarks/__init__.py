@@ -0,0 +1,5 @@
+"""
+Headless benchmarks for the merge and deduplication engines.
+
+Run ``python -m benchmarks --help`` from the repository root.
+"""
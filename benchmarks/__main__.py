@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+from benchmarks.dataset import generate_dataset
+from benchmarks.runner import CASES, run_case
+from utils import parse_size
+
+def _git_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description="Benchmark the merge and deduplication engines on a synthetic dataset.")
+    parser.add_argument('--size', default='64M', help="Total dataset size, e.g. 512K, 64M, 2G (default: 64M)")
+    parser.add_argument('--files', type=int, default=1, help="Number of source files (default: 1)")
+    parser.add_argument('--min-length', type=int, default=20, help="Shortest line, without its newline (default: 20)")
+    parser.add_argument('--max-length', type=int, default=40, help="Longest line, without its newline (default: 40)")
+    parser.add_argument('--duplicate-ratio', type=float, default=0.2, help="Share of repeated lines (default: 0.2)")
+    parser.add_argument('--crlf-ratio', type=float, default=0.0, help="Share of lines ending in CRLF (default: 0)")
+    parser.add_argument('--seed', type=int, default=0, help="Dataset seed (default: 0)")
+    parser.add_argument('--cases', default=','.join(CASES), help=f"Comma-separated cases (default: {','.join(CASES)})")
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per case (default: 1)")
+    parser.add_argument('--workers', type=int, default=1, help="Run generation workers (default: 1)")
+    parser.add_argument('--chunk-size', default='64M', help="Sort chunk size for the 'sort' case (default: 64M)")
+    parser.add_argument('--memory-budget', default='512M', help="Memory budget for hash and auto deduplication (default: 512M)")
+    parser.add_argument('--run-codec', default=None, help="Compress temporary runs: zstd, lz4, zlib or auto")
+    parser.add_argument('--spill-dir', action='append', dest='spill_dirs', help="Temporary folder (repeatable)")
+    parser.add_argument('--work-dir', default=None, help="Where to put the dataset (default: a new temporary folder)")
+    parser.add_argument('--output', default=None, help="Write the JSON results here instead of to stdout")
+    args = parser.parse_args(argv)
+
+    cases = [case.strip() for case in args.cases.split(',') if case.strip()]
+    unknown = [case for case in cases if case not in CASES]
+    if unknown:
+        parser.error(f"unknown case(s): {', '.join(unknown)}")
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='file_merger_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        dataset = {
+            'total_size': parse_size(args.size),
+            'files': args.files,
+            'min_length': args.min_length,
+            'max_length': args.max_length,
+            'duplicate_ratio': args.duplicate_ratio,
+            'crlf_ratio': args.crlf_ratio,
+            'seed': args.seed,
+        }
+        print(f"Generating {args.size} dataset in {work_dir}...", file=sys.stderr)
+        sources, line_count = generate_dataset(work_dir, **dataset)
+        dataset['lines'] = line_count
+
+        options = {
+            'workers': args.workers,
+            'chunk_size': parse_size(args.chunk_size),
+            'memory_budget': parse_size(args.memory_budget),
+            'run_codec': args.run_codec,
+            'spill_dirs': args.spill_dirs,
+            'input_lines': line_count,
+        }
+
+        results = []
+        for case in cases:
+            for run in range(args.repeat):
+                print(f"Running {case} ({run + 1}/{args.repeat})...", file=sys.stderr)
+                result = run_case(case, sources, work_dir, options)
+                result['run'] = run + 1
+                results.append(result)
+                if 'error' in result:
+                    print(f"  failed: {result['error']}", file=sys.stderr)
+                else:
+                    print(f"  {result['wall_seconds']} s, {result['mb_per_s']} MB/s", file=sys.stderr)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'dataset': dataset,
+        'options': {key: value for key, value in options.items() if key != 'input_lines'},
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 1 if any('error' in result for result in results) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+import os
+import random
+
+# Record bytes are drawn from this alphabet, so generated lines never contain \r or \n
+_ALPHABET = b'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789:_-.@'
+_TRANSLATION = bytes(_ALPHABET[i % len(_ALPHABET)] for i in range(256))
+# Number of earlier lines kept around to draw duplicates from
+_DUPLICATE_POOL = 65536
+_WRITE_BLOCK_LINES = 65536
+
+def generate_dataset(directory, total_size, files=1, min_length=20, max_length=40, duplicate_ratio=0.2, crlf_ratio=0.0, seed=0):
+    """
+    Writes `files` text files totalling about total_size bytes into directory and returns their paths
+    and the number of lines written. The same arguments always produce the same bytes.
+    Line lengths are uniform in [min_length, max_length], about duplicate_ratio of the lines repeat an
+    earlier line (possibly from another file), and about crlf_ratio of them end with \r\n instead of \n.
+    """
+    if min_length < 0 or max_length < min_length:
+        raise ValueError("Line lengths must satisfy 0 <= min_length <= max_length.")
+
+    rng = random.Random(seed)
+    pool = []
+    paths = []
+    line_count = 0
+    per_file = total_size // files
+
+    for index in range(files):
+        path = os.path.join(directory, f'bench_{index:04d}.txt')
+        target = per_file if index < files - 1 else total_size - per_file * (files - 1)
+        written = 0
+
+        with open(path, 'wb') as f:
+            block = []
+            while written < target:
+                if pool and rng.random() < duplicate_ratio:
+                    line = pool[rng.randrange(len(pool))]
+                else:
+                    line = rng.randbytes(rng.randint(min_length, max_length)).translate(_TRANSLATION)
+                    if len(pool) < _DUPLICATE_POOL:
+                        pool.append(line)
+                    else:
+                        pool[rng.randrange(_DUPLICATE_POOL)] = line
+
+                line += b'\r\n' if crlf_ratio and rng.random() < crlf_ratio else b'\n'
+                block.append(line)
+                written += len(line)
+                line_count += 1
+
+                if len(block) >= _WRITE_BLOCK_LINES:
+                    f.write(b''.join(block))
+                    block = []
+            f.write(b''.join(block))
+
+        paths.append(path)
+
+    return paths, line_count
@@ -0,0 +1,167 @@
+import multiprocessing
+import os
+import shutil
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+CASES = ('sort', 'hash', 'memory', 'auto', 'merge', 'merge-dedup', 'dedup-thread')
+
+def _written_bytes():
+    """
+    Bytes this process and its reaped children passed to write(), or None where /proc is unavailable.
+    """
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1024 * 1024 if os.uname().sysname == 'Darwin' else 1024
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(peak / scale, 1)
+
+def _count_lines(paths):
+    count = 0
+    for path in paths:
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(1024 * 1024)
+                if not block:
+                    break
+                count += block.count(b'\n')
+    return count
+
+def _run_thread(thread, on_stats):
+    """
+    Runs a worker QThread's job synchronously in this thread; no Qt event loop is needed.
+    """
+    result = []
+    thread.finished.connect(lambda success, message: result.append((success, message)))
+    if hasattr(thread, 'stats'):
+        thread.stats.connect(on_stats)
+    thread.run()
+    success, message = result[0]
+    if not success:
+        raise RuntimeError(message)
+
+def _measure_case(case, sources, work_dir, options):
+    from utils import deduplicate_files, external_sort_deduplicate, hash_partition_deduplicate, memory_deduplicate
+
+    phases = {}
+    plans = []
+
+    def on_stats(stats):
+        if 'plan' in stats:
+            plans.append(stats['plan'])
+        if stats.get('done'):
+            phases[stats['stage']] = round(phases.get(stats['stage'], 0) + stats['seconds'], 3)
+
+    outputs = [os.path.join(work_dir, 'output.txt')]
+    if case == 'dedup-thread':
+        # Deduplication works in place, so it runs on copies made before the clock starts
+        outputs = []
+        for path in sources:
+            copy = os.path.join(work_dir, 'inplace_' + os.path.basename(path))
+            shutil.copyfile(path, copy)
+            outputs.append(copy)
+
+    written_before = _written_bytes()
+    started = time.monotonic()
+
+    if case == 'sort':
+        success = external_sort_deduplicate(sources, outputs[0], chunk_size=options['chunk_size'],
+                                            workers=options['workers'], run_codec=options['run_codec'],
+                                            stats_callback=on_stats, spill_dirs=options['spill_dirs'])
+        if not success:
+            raise RuntimeError("external_sort_deduplicate did not complete.")
+    elif case == 'hash':
+        success = hash_partition_deduplicate(sources, outputs[0], memory_budget=options['memory_budget'],
+                                             stats_callback=on_stats, spill_dirs=options['spill_dirs'])
+        if not success:
+            raise RuntimeError("hash_partition_deduplicate did not complete.")
+    elif case == 'memory':
+        if not memory_deduplicate(sources, outputs[0], stats_callback=on_stats):
+            raise RuntimeError("memory_deduplicate did not complete.")
+    elif case == 'auto':
+        success = deduplicate_files(sources, outputs[0], engine='auto', workers=options['workers'],
+                                    memory_budget=options['memory_budget'], run_codec=options['run_codec'],
+                                    stats_callback=on_stats, spill_dirs=options['spill_dirs'])
+        if not success:
+            raise RuntimeError("deduplicate_files did not complete.")
+    elif case in ('merge', 'merge-dedup'):
+        from merge_thread import MergeThread
+        started_copy = time.monotonic()
+        _run_thread(MergeThread(sources, outputs[0], deduplicate=case == 'merge-dedup', workers=options['workers'],
+                                memory_budget=options['memory_budget'], run_codec=options['run_codec'],
+                                spill_dirs=options['spill_dirs']), on_stats)
+        if case == 'merge':
+            phases['copy'] = round(time.monotonic() - started_copy, 3)
+    elif case == 'dedup-thread':
+        from deduplication_thread import DeduplicationThread
+        _run_thread(DeduplicationThread(outputs, workers=options['workers'], memory_budget=options['memory_budget'],
+                                        run_codec=options['run_codec'], spill_dirs=options['spill_dirs']), on_stats)
+    else:
+        raise ValueError(f"Unknown benchmark case: {case}")
+
+    wall = time.monotonic() - started
+    written_after = _written_bytes()
+
+    input_bytes = sum(os.path.getsize(path) for path in sources)
+    output_bytes = sum(os.path.getsize(path) for path in outputs)
+    result = {
+        'case': case,
+        'wall_seconds': round(wall, 3),
+        'phases': phases,
+        # The engine(s) 'auto' picked, in order
+        'plans': plans,
+        'input_bytes': input_bytes,
+        'input_lines': options['input_lines'],
+        'output_bytes': output_bytes,
+        'output_lines': _count_lines(outputs),
+        'mb_per_s': round(input_bytes / (1024 * 1024) / wall, 2) if wall > 0 else None,
+        'lines_per_s': round(options['input_lines'] / wall) if wall > 0 else None,
+        'peak_rss_mb': _peak_rss_mb(),
+        # Everything written besides the final output went to temporary files
+        'temp_bytes_written': (max(0, written_after - written_before - output_bytes)
+                               if written_before is not None else None),
+    }
+
+    for path in outputs:
+        os.remove(path)
+    return result
+
+def _case_process(connection, case, sources, work_dir, options):
+    try:
+        connection.send(_measure_case(case, sources, work_dir, options))
+    except Exception as e:
+        connection.send({'case': case, 'error': str(e)})
+    finally:
+        connection.close()
+
+def run_case(case, sources, work_dir, options):
+    """
+    Runs one benchmark case in a fresh process, so peak RSS and I/O counters belong to that case alone.
+    """
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_case_process, args=(sender, case, sources, work_dir, options))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {'case': case, 'error': f"Benchmark process exited with code {process.exitcode}."}
+    process.join()
+    return result
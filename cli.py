@@ -0,0 +1,341 @@
+import argparse
+import glob
+import json
+import os
+import signal
+import sys
+
+from engine import (combine_files, merge_files, deduplicate_many, failure_message, open_index, stats_log,
+                    watch_sources)
+from utils import (build_sparse_index, codec_for_path, describe_stage_stats, probe_file, read_shard_manifest,
+                   shard_manifest_path, KeySpec, ShardSpec, parse_size, COMPRESSED_EXTENSIONS, DEDUP_ENGINES, DEFAULT_INDEX_INTERVAL, OUTPUT_CODECS, SET_OPERATIONS)
+
+# Exit codes; argparse exits with 2 on usage errors
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_CANCELLED = 130
+
+class _Reporter:
+    """
+    Prints progress either as JSON lines on stdout or as a status line on stderr.
+    """
+    def __init__(self, as_json):
+        self.as_json = as_json
+        self.stage_stats = None
+
+    def emit(self, event, **fields):
+        if self.as_json:
+            print(json.dumps({'event': event, **fields}), flush=True)
+
+    def progress(self, value):
+        if self.as_json:
+            self.emit('progress', percent=value)
+        else:
+            detail = f" | {describe_stage_stats(self.stage_stats)}" if self.stage_stats else ""
+            # Padded so a shorter line fully overwrites the previous one
+            print(f"\rProgress: {value:3d}%{detail}".ljust(100), end='', file=sys.stderr, flush=True)
+
+    def stats(self, stats):
+        if 'plan' in stats and not self.as_json:
+            # The plan is printed on its own line, so it stays visible
+            source = f"{stats['file']}: " if 'file' in stats else ""
+            print(f"\r{source}{describe_stage_stats(stats)}".ljust(100), file=sys.stderr)
+        elif 'mb_per_s' in stats:
+            self.stage_stats = stats
+        self.emit('stats', **stats)
+
+    def file_finished(self, path, status, detail):
+        if self.as_json:
+            self.emit('file', path=path, status=status, detail=detail)
+        elif status != 'succeeded':
+            print(f"\n{path}: {status}{' - ' + detail if detail else ''}", file=sys.stderr)
+
+    def file_skipped(self, path, original):
+        if self.as_json:
+            self.emit('skipped', path=path, identical_to=original)
+        else:
+            print(f"\nSkipping {path}: identical to {original}", file=sys.stderr)
+
+    def finished(self, code, message=""):
+        if self.as_json:
+            self.emit('finished', success=code == EXIT_OK, exit_code=code, message=message)
+        else:
+            print(file=sys.stderr)
+            if message:
+                print(message, file=sys.stderr)
+        return code
+
+def expand_inputs(patterns, pattern='*.txt'):
+    """
+    Expands files, glob patterns and directories (searched for `pattern`, compressed or not) into a list
+    of files, keeping the given order and dropping repeats.
+    """
+    files = []
+    for entry in patterns:
+        if os.path.isdir(entry):
+            matches = sorted(match for suffix in ('',) + tuple(COMPRESSED_EXTENSIONS)
+                             for match in glob.glob(os.path.join(glob.escape(entry), pattern + suffix)))
+        elif glob.has_magic(entry):
+            matches = sorted(glob.glob(entry, recursive=True))
+        else:
+            matches = [entry]
+        files.extend(match for match in matches if not os.path.isdir(match))
+    return list(dict.fromkeys(files))
+
+def _add_engine_options(parser):
+    parser.add_argument('inputs', nargs='+', help="Files, glob patterns or directories")
+    parser.add_argument('--pattern', default='*.txt', help="Files picked from input directories (default: *.txt)")
+    parser.add_argument('--engine', choices=DEDUP_ENGINES, default='sort',
+                        help="'sort' writes sorted output, 'hash' and 'memory' keep the original line order, "
+                             "'auto' samples the inputs and picks one for the memory budget (default: sort)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Run generation workers (default: CPU count)")
+    parser.add_argument('--memory-budget', default='512M', help="Memory budget, e.g. 512M or 2G (default: 512M)")
+    parser.add_argument('--run-codec', default=None, help="Compress temporary runs: zstd, lz4, zlib or auto")
+    parser.add_argument('--spill-dir', action='append', dest='spill_dirs', help="Temporary folder (repeatable)")
+    parser.add_argument('--key-field', type=int, default=None,
+                        help="Deduplicate on this field (counted from 1) instead of the whole line")
+    parser.add_argument('--key-delimiter', default=':', help="Field delimiter for --key-field (default: ':')")
+    parser.add_argument('--ignore-case', action='store_true', help="Case-fold the key field")
+    parser.add_argument('--strip', action='store_true', help="Strip whitespace around the key field")
+    parser.add_argument('--keep', choices=('first', 'last'), default='first',
+                        help="Which record to keep among those sharing a key (default: first)")
+    parser.add_argument('--json', action='store_true', help="Print progress and results as JSON lines on stdout")
+    parser.add_argument('--stats-log', default=None,
+                        help="Append per-stage throughput stats to this JSON-lines file")
+
+def _run_index_command(parser, args):
+    if args.command == 'lookup':
+        if args.probe and (args.queries or args.prefix):
+            parser.error("--probe can't be combined with queries or --prefix")
+        if args.probe and not args.output:
+            parser.error("--probe needs --output")
+        if not args.probe and not args.queries:
+            parser.error("give queries or --probe")
+
+    reporter = _Reporter(args.json)
+    try:
+        if args.command == 'index':
+            for path in args.files:
+                build_sparse_index(path, args.interval)
+                reporter.emit('file', path=path, status='succeeded', detail="")
+            return reporter.finished(EXIT_OK)
+
+        if args.probe:
+            written, probed = probe_file(args.file, args.probe, args.output, missing=args.missing,
+                                         progress_callback=reporter.progress, workers=args.workers,
+                                         spill_dirs=args.spill_dirs)
+            label = "missing from" if args.missing else "found in"
+            return reporter.finished(EXIT_OK, f"{written} of {probed} distinct probe lines {label} {args.file}.")
+
+        with open_index(args.file) as index:
+            all_found = True
+            for query in args.queries:
+                if args.prefix:
+                    matches = [line.decode('utf-8', 'replace') for line in index.prefix(query)]
+                    all_found = all_found and bool(matches)
+                    if args.json:
+                        reporter.emit('lookup', query=query, matches=matches)
+                    else:
+                        print("\n".join(matches))
+                else:
+                    found = index.contains(query)
+                    all_found = all_found and found
+                    if args.json:
+                        reporter.emit('lookup', query=query, found=found)
+                    else:
+                        print(f"{'found' if found else 'missing'}\t{query}")
+        # Like grep, the exit code says whether everything asked for was found
+        if args.json:
+            return reporter.finished(EXIT_OK if all_found else EXIT_FAILED)
+        return EXIT_OK if all_found else EXIT_FAILED
+    except Exception as e:
+        return reporter.finished(EXIT_FAILED, str(e))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m cli',
+                                     description="Merge, deduplicate, compare and search text files without the GUI.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    merge = commands.add_parser('merge', help="Concatenate files into one, optionally deduplicated")
+    _add_engine_options(merge)
+    merge.add_argument('-o', '--output', required=True, help="Target file")
+    merge.add_argument('--dedup', action='store_true', help="Remove duplicate lines while merging")
+    merge.add_argument('--incremental', action='store_true',
+                       help="Merge into the existing deduplicated output instead of replacing it")
+    merge.add_argument('--cleanup', action='store_true', help="Delete the source files after a successful merge")
+    merge.add_argument('--index', action='store_true', help="Write a lookup index for sorted deduplicated output")
+    merge.add_argument('--compress', choices=OUTPUT_CODECS, default=None,
+                       help="Compress the output (default: from its extension, e.g. .gz)")
+    merge.add_argument('--no-prescan', action='store_true',
+                       help="Don't look for byte-identical sources to skip before a deduplicated merge")
+    merge.add_argument('--job-dir', default=None,
+                       help="Keep checkpoints in this folder; running the same merge again resumes it after an "
+                            "interruption")
+    sharding = merge.add_mutually_exclusive_group()
+    sharding.add_argument('--shard-size', default=None,
+                          help="Write the output as shards of at most this size, e.g. 1G, with a manifest next to it")
+    sharding.add_argument('--shard-lines', type=int, default=None, help="Write shards of at most this many lines")
+    sharding.add_argument('--shards', type=int, default=None,
+                          help="Write this many shards split by a hash of each line (or key), so no two share one")
+
+    dedup = commands.add_parser('dedup', help="Deduplicate files in place")
+    _add_engine_options(dedup)
+    dedup.add_argument('--file-workers', type=int, default=None,
+                       help="Files deduplicated at once (default: from CPU count and memory budget)")
+
+    watch = commands.add_parser('watch', help="Append new files to a rolling target as they arrive, "
+                                              "deduplicating it now and then")
+    _add_engine_options(watch)
+    watch.add_argument('-o', '--output', required=True, help="Rolling target file")
+    watch.add_argument('--interval', type=float, default=5.0, help="Seconds between scans (default: 5)")
+    watch.add_argument('--settle', type=float, default=10.0,
+                       help="Seconds a file must stay unchanged before it is appended (default: 10)")
+    watch.add_argument('--compact-size', default=None,
+                       help="Deduplicate the target once this much was appended since the last time, e.g. 1G")
+    watch.add_argument('--compact-every', type=float, default=None,
+                       help="Deduplicate the target every this many minutes while new data arrives")
+    watch.add_argument('--cleanup', action='store_true', help="Delete each source once it is appended")
+
+    combine = commands.add_parser('set', help="Set operation over the distinct lines of the inputs, written in sorted order")
+    combine.add_argument('operation', choices=SET_OPERATIONS,
+                         help="'difference' keeps lines of the first input found in no other")
+    _add_engine_options(combine)
+    combine.add_argument('-o', '--output', required=True, help="Target file")
+
+    index = commands.add_parser('index', help="Write the lookup index of sorted, deduplicated files")
+    index.add_argument('files', nargs='+', help="Files written by a sorted deduplication")
+    index.add_argument('--interval', type=int, default=DEFAULT_INDEX_INTERVAL,
+                       help=f"Index every Nth line (default: {DEFAULT_INDEX_INTERVAL})")
+    index.add_argument('--json', action='store_true', help="Print results as JSON lines on stdout")
+
+    lookup = commands.add_parser('lookup', help="Look up lines in a sorted, deduplicated file through its index")
+    lookup.add_argument('file', help="File written by a sorted deduplication; its index is built if needed")
+    lookup.add_argument('queries', nargs='*', help="Lines to look for")
+    lookup.add_argument('--prefix', action='store_true', help="List the lines starting with each query instead")
+    lookup.add_argument('--probe', default=None, help="Look up every line of this file instead of queries")
+    lookup.add_argument('-o', '--output', default=None, help="With --probe, where to write the lines found")
+    lookup.add_argument('--missing', action='store_true', help="With --probe, write the lines not found instead")
+    lookup.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Workers for sorting the probe file (default: CPU count)")
+    lookup.add_argument('--spill-dir', action='append', dest='spill_dirs', help="Temporary folder (repeatable)")
+    lookup.add_argument('--json', action='store_true', help="Print progress and results as JSON lines on stdout")
+
+    args = parser.parse_args(argv)
+    if args.command in ('index', 'lookup'):
+        return _run_index_command(parser, args)
+    try:
+        memory_budget = parse_size(args.memory_budget)
+    except ValueError:
+        parser.error(f"invalid memory budget: {args.memory_budget}")
+    key_spec = None
+    if args.command == 'set' and (args.key_field is not None or args.engine != 'sort'):
+        parser.error("set operations compare whole sorted lines and don't take --key-field or --engine")
+    if getattr(args, 'index', False) and args.engine in ('hash', 'memory'):
+        parser.error("--index needs sorted output: use --engine sort or auto")
+    if args.key_field is not None:
+        if args.key_field < 1:
+            parser.error("--key-field counts from 1")
+        key_spec = KeySpec(args.key_delimiter, args.key_field - 1, casefold=args.ignore_case,
+                           strip=args.strip, keep=args.keep)
+    elif args.ignore_case or args.strip or args.keep != 'first':
+        parser.error("--ignore-case, --strip and --keep need --key-field")
+    shards = None
+    try:
+        if getattr(args, 'shard_size', None) is not None:
+            try:
+                shard_size = parse_size(args.shard_size)
+            except ValueError:
+                parser.error(f"invalid shard size: {args.shard_size}")
+            shards = ShardSpec('size', shard_size)
+        elif getattr(args, 'shard_lines', None) is not None:
+            shards = ShardSpec('lines', args.shard_lines)
+        elif getattr(args, 'shards', None) is not None:
+            shards = ShardSpec('hash', args.shards)
+    except ValueError as e:
+        parser.error(str(e))
+    compact_size = None
+    if getattr(args, 'compact_size', None) is not None:
+        try:
+            compact_size = parse_size(args.compact_size)
+        except ValueError:
+            parser.error(f"invalid compaction size: {args.compact_size}")
+    sources = expand_inputs(args.inputs, args.pattern)
+    # A watched folder may well be empty to begin with
+    if not sources and args.command != 'watch':
+        parser.error("no input files found")
+
+    reporter = _Reporter(args.json)
+    cancelled = []
+
+    def interrupt(signum, frame):
+        # The first Ctrl+C cancels cleanly; a second one stops immediately
+        cancelled.append(signum)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGINT, interrupt)
+    if args.command == 'watch':
+        # Service managers stop a watch with SIGTERM; it finishes the file at hand like on Ctrl+C
+        signal.signal(signal.SIGTERM, interrupt)
+
+    options = {
+        'progress_callback': reporter.progress,
+        'active_check': lambda: not cancelled,
+        'workers': args.workers,
+        'engine': args.engine,
+        'memory_budget': memory_budget,
+        'run_codec': args.run_codec,
+        'spill_dirs': args.spill_dirs,
+        'key_spec': key_spec,
+    }
+
+    try:
+        with stats_log(args.stats_log, reporter.stats, args.command) as stats_callback:
+            options['stats_callback'] = stats_callback
+            if args.command == 'merge':
+                success = merge_files(sources, args.output, cleanup=args.cleanup, deduplicate=args.dedup,
+                                      incremental=args.incremental, skip_identical=not args.no_prescan,
+                                      output_codec=args.compress or codec_for_path(args.output),
+                                      skipped_callback=reporter.file_skipped, job_dir=args.job_dir,
+                                      index_interval=DEFAULT_INDEX_INTERVAL if args.index else None, shards=shards,
+                                      **options)
+                if not success:
+                    return reporter.finished(EXIT_CANCELLED, "Merging cancelled by user.")
+                if shards is not None:
+                    manifest = read_shard_manifest(args.output)
+                    return reporter.finished(EXIT_OK, f"Wrote {len(manifest['shards'])} shards, listed in "
+                                                      f"{shard_manifest_path(args.output)}.")
+                return reporter.finished(EXIT_OK)
+
+            if args.command == 'watch':
+                appended, compactions = watch_sources(
+                    lambda: expand_inputs(args.inputs, args.pattern), args.output, poll_interval=args.interval,
+                    settle_time=args.settle, compact_size=compact_size,
+                    compact_interval=args.compact_every * 60 if args.compact_every else None,
+                    cleanup=args.cleanup, file_callback=reporter.file_finished, **options)
+                # Stopping is how a watch ends, so it is not an error
+                return reporter.finished(EXIT_OK, f"Stopped watching after appending {appended} file(s) and "
+                                                  f"{compactions} compaction(s).")
+
+            if args.command == 'set':
+                if len(sources) < 2:
+                    return reporter.finished(EXIT_FAILED, "Set operations need at least two input files.")
+                success = combine_files(args.operation, sources, args.output, options['progress_callback'],
+                                        options['active_check'], workers=args.workers, run_codec=args.run_codec,
+                                        stats_callback=stats_callback, spill_dirs=args.spill_dirs)
+                if not success:
+                    return reporter.finished(EXIT_CANCELLED, "Set operation cancelled by user.")
+                return reporter.finished(EXIT_OK)
+
+            results = deduplicate_many(sources, file_callback=reporter.file_finished,
+                                       file_workers=args.file_workers, **options)
+        if cancelled:
+            return reporter.finished(EXIT_CANCELLED, "Deduplication cancelled by user.")
+        message = failure_message(results)
+        return reporter.finished(EXIT_FAILED if message else EXIT_OK, message)
+    except KeyboardInterrupt:
+        return reporter.finished(EXIT_CANCELLED, "Stopped by user.")
+    except Exception as e:
+        return reporter.finished(EXIT_FAILED, str(e))
+
+if __name__ == '__main__':
+    sys.exit(main())
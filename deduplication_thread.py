@@ -1,15 +1,22 @@
-
-import os
-import shutil
 from PyQt6.QtCore import QThread, pyqtSignal
 
 class DeduplicationThread(QThread):
     progress = pyqtSignal(int)
+    stats = pyqtSignal(dict)
+    file_finished = pyqtSignal(str, str, str)
     finished = pyqtSignal(bool, str)
 
-    def __init__(self, sources):
+    def __init__(self, sources, workers=1, engine='sort', memory_budget=None, run_codec=None, spill_dirs=None, file_workers=None, key_spec=None, stats_log=None):
         super().__init__()
         self.sources = sources
+        self.workers = workers
+        self.engine = engine
+        self.memory_budget = memory_budget
+        self.run_codec = run_codec
+        self.spill_dirs = spill_dirs
+        self.file_workers = file_workers
+        self.key_spec = key_spec
+        self.stats_log = stats_log
         self._active = True
 
     def stop(self):
@@ -17,39 +24,28 @@ class DeduplicationThread(QThread):
 
     def run(self):
         try:
-            from utils import external_sort_deduplicate
-            
-            for src in self.sources:
-                if not self._active:
-                    break
-                
-                # Use a hidden temp file in the same directory for safety
-                target = src + ".tmp"
-                
-                success = external_sort_deduplicate(
-                    [src], 
-                    target, 
+            from engine import deduplicate_many, failure_message, stats_log
+            with stats_log(self.stats_log, self.stats.emit, 'dedup') as stats_callback:
+                results = deduplicate_many(
+                    self.sources,
                     progress_callback=self.progress.emit,
-                    active_check=lambda: self._active
+                    active_check=lambda: self._active,
+                    file_callback=self.file_finished.emit,
+                    stats_callback=stats_callback,
+                    workers=self.workers,
+                    file_workers=self.file_workers,
+                    engine=self.engine,
+                    memory_budget=self.memory_budget,
+                    run_codec=self.run_codec,
+                    spill_dirs=self.spill_dirs,
+                    key_spec=self.key_spec
                 )
-                
-                if success and self._active:
-                    # Success: Swap temp file for original
-                    os.remove(src)
-                    os.rename(target, src)
-                else:
-                    # Cancelled or Error: Remove partial temp file
-                    if os.path.exists(target):
-                        os.remove(target)
-                    if not self._active:
-                        break
-                    else:
-                        raise Exception(f"An error occurred during deduplication of {src}.")
-            
-            if self._active:
-                self.finished.emit(True, "")
-            else:
+
+            if not self._active:
                 self.finished.emit(False, "Deduplication cancelled by user.")
-                
+                return
+            message = failure_message(results)
+            self.finished.emit(not message, message)
+
         except Exception as e:
             self.finished.emit(False, str(e))
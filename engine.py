@@ -0,0 +1,707 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from utils import (build_sparse_index, copy_input_chunks, deduplicate_files, deduplicate_in_place,
+                   detect_compression, discard_checkpoint, find_identical_sources, incremental_deduplicate,
+                   open_output, read_checkpoint, remove_shards, set_operation_files, KeySpec, ShardSpec,
+                   SortedFileIndex, SourceHashCache, StageTelemetry, _ignore_interrupts, DEFAULT_MEMORY_BUDGET)
+
+# Rough peak memory of one pipelined external sort job with the default 64 MB chunks
+_SORT_JOB_MEMORY = 256 * 1024 * 1024
+
+# What a resumable merge was asked to do, kept in its job directory next to the sort checkpoint
+JOB_FILE = 'job.json'
+
+# What a watch has appended to its rolling target, kept next to the target
+WATCH_STATE_SUFFIX = '.watch.json'
+
+# Set in each pool process by _init_job_process
+_cancel_event = None
+_job_events = None
+
+def _init_job_process(cancel_event, job_events):
+    global _cancel_event, _job_events
+    _ignore_interrupts()
+    _cancel_event = cancel_event
+    _job_events = job_events
+
+def _deduplicate_job(src, options):
+    """
+    Deduplicates one file inside a pool process, forwarding its progress and stats through a queue.
+    """
+    return deduplicate_in_place(
+        src,
+        progress_callback=lambda value: _job_events.put(('progress', src, value)),
+        active_check=lambda: not _cancel_event.is_set(),
+        stats_callback=lambda stats: _job_events.put(('stats', src, stats)),
+        **options
+    )
+
+@contextmanager
+def stats_log(path, stats_callback=None, job=None):
+    """
+    Yields a stats callback that appends each stats event to the JSON-lines file at path, stamped with
+    the time and the job name, and passes it on to stats_callback. Without a path, yields stats_callback.
+    """
+    if not path:
+        yield stats_callback
+        return
+
+    with open(path, 'a', encoding='utf-8') as log:
+        def log_stats(stats):
+            log.write(json.dumps({'time': time.time(), 'job': job, **stats}) + '\n')
+            log.flush()
+            if stats_callback:
+                stats_callback(stats)
+        yield log_stats
+
+def concatenate_files(sources, target, progress_callback=None, active_check=None, stats_callback=None, output_codec=None, shards=None):
+    """
+    Concatenates the sources into target as they are, decompressing compressed sources, and compressing
+    the target with output_codec if given, or splitting it into shards (a ShardSpec) next to target.
+    Progress is counted in source bytes as stored.
+    Returns False if cancelled, in which case the partial target is removed.
+    """
+    total_size = sum(os.path.getsize(f) for f in sources)
+    telemetry = StageTelemetry(stats_callback, 'concatenate', total_size)
+    processed_size = 0
+    last_progress = -1
+
+    with open_output(target, output_codec, shards=shards) as outfile:
+        for src in sources:
+            # Copies in the kernel where possible, chunk by chunk so we can still cancel
+            for copied in copy_input_chunks(src, outfile):
+                if active_check and not active_check():
+                    break
+                processed_size += copied
+                telemetry.update(bytes_read=copied)
+                progress = int((processed_size * 100) / total_size) if total_size > 0 else 100
+                if progress_callback and progress != last_progress:
+                    progress_callback(progress)
+                    last_progress = progress
+            if active_check and not active_check():
+                break
+        telemetry.update(bytes_written=outfile.tell())
+
+    if active_check and not active_check():
+        if shards is not None:
+            remove_shards(target)
+        else:
+            try:
+                os.remove(target)
+            except:
+                pass
+        return False
+    telemetry.done()
+    return True
+
+def skip_identical_sources(sources, target=None, active_check=None, stats_callback=None, skipped_callback=None, workers=None, keep='first', hash_cache=None):
+    """
+    Drops sources that are byte-identical to an earlier one (a later one with keep='last'), or to the
+    existing target when it is given (which needs keep='first'); they can't change a deduplicated merge.
+    skipped_callback(path, identical_path) is called for each dropped source. Hashes are cached in
+    hash_cache (a SourceHashCache at its default location if None). Returns the remaining sources,
+    or None if cancelled.
+    """
+    telemetry = StageTelemetry(stats_callback, 'prescan')
+    cache = hash_cache or SourceHashCache()
+    candidates = list(sources)
+    if target is not None and os.path.exists(target):
+        candidates.insert(0, target)
+    found = find_identical_sources(candidates, active_check, workers, cache, keep)
+    if found is None:
+        return None
+    kept, skipped = found
+    try:
+        cache.save()
+    except OSError:
+        # The cache only saves time; failing to write it is not an error
+        pass
+
+    for src in sources:
+        if src in skipped and skipped_callback:
+            skipped_callback(src, skipped[src])
+    telemetry.set(skipped=len(skipped))
+    telemetry.done()
+    kept = set(kept)
+    return [src for src in sources if src in kept]
+
+def default_job_root():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'file_merger', 'jobs')
+
+def new_job_dir(root=None):
+    """
+    Creates an empty job directory under root (default_job_root() by default) for a resumable merge.
+    """
+    root = root or default_job_root()
+    os.makedirs(root, exist_ok=True)
+    return tempfile.mkdtemp(prefix='merge-', dir=root)
+
+def _write_job(job_dir, sources, target, options):
+    os.makedirs(job_dir, exist_ok=True)
+    job = {
+        'version': 1,
+        'sources': [os.path.abspath(p) for p in sources],
+        'target': os.path.abspath(target),
+        'options': options,
+        'started': time.time(),
+    }
+    temp_path = os.path.join(job_dir, JOB_FILE + '.tmp')
+    with open(temp_path, 'w') as f:
+        json.dump(job, f)
+    os.replace(temp_path, os.path.join(job_dir, JOB_FILE))
+
+def read_job(job_dir):
+    """
+    Returns the merge recorded in job_dir by merge_files, or None if there is none.
+    """
+    try:
+        with open(os.path.join(job_dir, JOB_FILE)) as f:
+            job = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return job if isinstance(job, dict) and job.get('version') == 1 else None
+
+def job_arguments(job):
+    """
+    Turns a job from read_job into the (sources, target, options) to pass to merge_files or MergeThread.
+    """
+    options = dict(job['options'])
+    if options.get('key_spec') is not None:
+        options['key_spec'] = KeySpec(**options['key_spec'])
+    if options.get('shards') is not None:
+        options['shards'] = ShardSpec(**options['shards'])
+    return job['sources'], job['target'], options
+
+def describe_job(job_dir, job):
+    """
+    Summarizes an interrupted merge and how far it got, in one line.
+    """
+    count = len(job['sources'])
+    text = f"merge of {count} file{'s' if count != 1 else ''} into {job['target']}"
+    checkpoint = read_checkpoint(job_dir)
+    if checkpoint is None or not checkpoint['runs']:
+        return text + ", which will start over"
+    if checkpoint['phase'] == 'merge':
+        return text + f", sorted and merging {len(checkpoint['runs'])} runs"
+    total = sum(entry['size'] for entry in checkpoint['inputs'])
+    done = sum(run.get('size', 0) for run in checkpoint['runs'])
+    return text + f", {int(done * 100 / total) if total else 100}% sorted"
+
+def interrupted_jobs(root=None):
+    """
+    Lists the merges left in job directories under root (default_job_root() by default) by a cancel, a crash
+    or a reboot, oldest first, as (job_dir, job) pairs.
+    """
+    root = root or default_job_root()
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return []
+    jobs = []
+    for name in names:
+        job_dir = os.path.join(root, name)
+        job = read_job(job_dir)
+        if job is not None:
+            jobs.append((job_dir, job))
+    jobs.sort(key=lambda item: item[1].get('started', 0))
+    return jobs
+
+def discard_job(job_dir):
+    """
+    Removes a job directory's checkpoint, runs and job record, then the directory itself if nothing else is in it.
+    """
+    discard_checkpoint(job_dir)
+    try:
+        os.remove(os.path.join(job_dir, JOB_FILE))
+    except OSError:
+        pass
+    try:
+        os.rmdir(job_dir)
+    except OSError:
+        pass
+
+def resume_job(job_dir, progress_callback=None, active_check=None, stats_callback=None, skipped_callback=None):
+    """
+    Runs the merge recorded in job_dir again, picking up from its checkpoint. Returns like merge_files.
+    """
+    job = read_job(job_dir)
+    if job is None:
+        raise ValueError(f"{job_dir} holds no interrupted merge.")
+    sources, target, options = job_arguments(job)
+    return merge_files(sources, target, progress_callback=progress_callback, active_check=active_check,
+                       stats_callback=stats_callback, skipped_callback=skipped_callback, job_dir=job_dir, **options)
+
+def merge_files(sources, target, progress_callback=None, active_check=None, cleanup=False, deduplicate=False, incremental=False, workers=1, engine='sort', memory_budget=None, run_codec=None, stats_callback=None, spill_dirs=None, key_spec=None, index_interval=None, skip_identical=True, skipped_callback=None, output_codec=None, job_dir=None, shards=None):
+    """
+    Merges the sources into target: plain concatenation, or deduplicated with the chosen engine
+    ('auto' picks one from a sample of the sources, see plan_deduplication).
+    With incremental=True the target is an existing deduplicated master that the sources are merged into.
+    A key_spec deduplicates on a field instead of the whole line.
+    With index_interval, sorted deduplicated output also gets a sparse index for lookups.
+    Deduplicated merges first skip sources identical to another one (or to the incremental target)
+    unless skip_identical is False, calling skipped_callback(path, identical_path) for each.
+    Compressed sources are decompressed on the fly; output_codec ('gzip', 'bz2', 'xz' or 'zstd')
+    compresses the target, except in incremental merges, whose target must stay plain text.
+    With shards (a ShardSpec), the target is written as shard files with a manifest next to it (see ShardSpec),
+    which incremental merges can't do either.
+    With job_dir, the merge is recorded there (see resume_job) and the sort engine keeps checkpoints in it, so after
+    a cancel, crash or reboot the same merge picks up where it stopped; the job directory is removed on success.
+    Sources are deleted afterwards if cleanup is set. Returns False if cancelled; raises on errors.
+    """
+    target_abs = os.path.abspath(target)
+    sources_abs = [os.path.abspath(p) for p in sources]
+    if target_abs in sources_abs:
+        raise ValueError("Target file cannot be one of the source files.")
+    if incremental and (output_codec is not None or (os.path.exists(target) and detect_compression(target))):
+        raise ValueError("Incremental merging needs an uncompressed target.")
+    if incremental and shards is not None:
+        raise ValueError("Incremental merging needs a single target file.")
+    if deduplicate and index_interval and engine in ('hash', 'memory'):
+        raise ValueError("A lookup index needs sorted output, which the 'hash' and 'memory' engines don't write.")
+    if job_dir is not None:
+        _write_job(job_dir, sources, target, {
+            'cleanup': cleanup,
+            'deduplicate': deduplicate,
+            'incremental': incremental,
+            'workers': workers,
+            'engine': engine,
+            'memory_budget': memory_budget,
+            'run_codec': run_codec,
+            'spill_dirs': spill_dirs,
+            'key_spec': key_spec.to_dict() if key_spec is not None else None,
+            'index_interval': index_interval,
+            'skip_identical': skip_identical,
+            'output_codec': output_codec,
+            'shards': shards.to_dict() if shards is not None else None,
+        })
+
+    merged_sources = sources
+    if skip_identical and (deduplicate or incremental):
+        keep = key_spec.keep if key_spec is not None else 'first'
+        merged_sources = skip_identical_sources(sources, target if incremental else None, active_check,
+                                                stats_callback, skipped_callback, keep=keep)
+        if merged_sources is None:
+            return False
+
+    if incremental:
+        if engine not in ('sort', 'auto'):
+            raise ValueError("Incremental merging requires sorted deduplication.")
+        if key_spec is not None:
+            raise ValueError("Incremental merging deduplicates whole lines and cannot use a key.")
+        # The target is the existing master list: only the new sources get sorted
+        success = incremental_deduplicate(
+            target,
+            merged_sources,
+            progress_callback=progress_callback,
+            active_check=active_check,
+            workers=workers,
+            run_codec=run_codec,
+            stats_callback=stats_callback,
+            spill_dirs=spill_dirs,
+            index_interval=index_interval,
+            job_dir=job_dir
+        )
+    elif deduplicate:
+        success = deduplicate_files(
+            merged_sources,
+            target,
+            engine=engine,
+            progress_callback=progress_callback,
+            active_check=active_check,
+            workers=workers,
+            memory_budget=memory_budget or DEFAULT_MEMORY_BUDGET,
+            run_codec=run_codec,
+            stats_callback=stats_callback,
+            spill_dirs=spill_dirs,
+            mark_sorted=True,
+            key_spec=key_spec,
+            index_interval=index_interval,
+            output_codec=output_codec,
+            job_dir=job_dir,
+            shards=shards
+        )
+    else:
+        success = concatenate_files(sources, target, progress_callback, active_check, stats_callback, output_codec,
+                                    shards)
+
+    if active_check and not active_check():
+        # An incremental merge leaves the existing target untouched until it succeeds
+        if shards is not None:
+            remove_shards(target)
+        elif not incremental and os.path.exists(target):
+            try:
+                os.remove(target)
+            except:
+                pass
+        return False
+    if not success:
+        raise Exception("An error occurred during incremental deduplication." if incremental
+                        else "An error occurred during deduplication.")
+
+    if cleanup:
+        for src in sources:
+            try:
+                os.remove(src)
+            except OSError as e:
+                print(f"Warning: Could not delete {src}: {e}", file=sys.stderr)
+    if job_dir is not None:
+        discard_job(job_dir)
+    return True
+
+def _read_watch_state(target):
+    try:
+        with open(target + WATCH_STATE_SUFFIX) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state if isinstance(state, dict) and state.get('version') == 1 else None
+
+def _write_watch_state(target, state):
+    temp_path = target + WATCH_STATE_SUFFIX + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(temp_path, target + WATCH_STATE_SUFFIX)
+
+def _append_source(src, target, committed_size, active_check=None, stats_callback=None):
+    """
+    Appends src to target at committed_size, kernel-side where possible, and returns the bytes written.
+    Each append ends with a newline, so a file without one doesn't run into the next.
+    A cancelled or failed append is cut off again at committed_size; cancelling returns None.
+    """
+    telemetry = StageTelemetry(stats_callback, 'append', os.path.getsize(src))
+    # Not opened for appending: copy_file_range and sendfile refuse O_APPEND targets
+    with open(target, 'r+b' if os.path.exists(target) else 'w+b') as out:
+        try:
+            out.seek(committed_size)
+            if committed_size:
+                out.seek(committed_size - 1)
+                if out.read(1) != b'\n':
+                    out.write(b'\n')
+            for copied in copy_input_chunks(src, out):
+                if active_check and not active_check():
+                    out.truncate(committed_size)
+                    return None
+                telemetry.update(bytes_read=copied)
+            end = out.tell()
+            if end > committed_size:
+                out.seek(end - 1)
+                if out.read(1) != b'\n':
+                    out.write(b'\n')
+            written = out.tell() - committed_size
+            out.flush()
+            os.fsync(out.fileno())
+        except BaseException:
+            out.truncate(committed_size)
+            raise
+    telemetry.update(bytes_written=written)
+    telemetry.done()
+    return written
+
+def watch_sources(list_sources, target, active_check=None, poll_interval=5.0, settle_time=10.0, compact_size=None, compact_interval=None, cleanup=False, file_callback=None, stats_callback=None, **options):
+    """
+    Watch mode for ingest pipelines: every poll_interval seconds, list_sources() is called for the current
+    candidate files, and each one that kept the same size and mtime for settle_time seconds is appended to
+    target as it is (the concatenation path, decompressing compressed files), so new data lands within seconds.
+    Deduplication is left to compactions, which run deduplicate_in_place on target with options (engine,
+    memory_budget, key_spec, ...) once compact_size bytes were appended since the last one, or every
+    compact_interval seconds while there is new data.
+    What was appended, and the size of target it led to, is kept in target's watch state next to it: after a
+    restart, files are not appended twice (unless they change), and a half-done append is cut off again.
+    target belongs to the watch; it must be plain text. With cleanup, sources are deleted once appended.
+    file_callback(path, status, detail) is called with 'appended' or 'failed' for sources and 'compacted'
+    or 'failed' for target. Runs until active_check() returns False, then returns (files appended, compactions).
+    """
+    target_abs = os.path.abspath(target)
+    if os.path.exists(target) and detect_compression(target):
+        raise ValueError("Watch mode appends to an uncompressed target.")
+
+    size = os.path.getsize(target) if os.path.exists(target) else 0
+    state = _read_watch_state(target)
+    if state is None:
+        state = {'version': 1, 'size': size, 'appended': {}, 'pending_bytes': 0, 'compacted': time.time()}
+    elif size > state['size']:
+        # Crashed in the middle of an append, which will be done again
+        with open(target, 'r+b') as f:
+            f.truncate(state['size'])
+    else:
+        # A compaction got as far as replacing target
+        state['size'] = size
+    _write_watch_state(target, state)
+
+    ignored = {target_abs, target_abs + '.tmp', target_abs + WATCH_STATE_SUFFIX, target_abs + WATCH_STATE_SUFFIX + '.tmp'}
+    settling = {}
+    appended_count = 0
+    compactions = 0
+
+    def is_active():
+        return active_check is None or active_check()
+
+    def report(path, status, detail=""):
+        if file_callback:
+            file_callback(path, status, detail)
+
+    while is_active():
+        now = time.time()
+        try:
+            listed = [os.path.abspath(p) for p in list_sources()]
+        except OSError:
+            listed = []
+        current = {}
+        for src in listed:
+            if src in ignored:
+                continue
+            try:
+                st = os.stat(src)
+            except OSError:
+                continue
+            current[src] = [st.st_size, st.st_mtime_ns]
+
+        # Sources gone for good no longer need to be remembered
+        state['appended'] = {src: sig for src, sig in state['appended'].items()
+                             if src in current or os.path.exists(src)}
+        settling = {src: seen for src, seen in settling.items() if src in current}
+
+        for src, signature in current.items():
+            if not is_active():
+                break
+            if state['appended'].get(src) == signature:
+                continue
+            if src not in settling or settling[src][0] != signature:
+                # Still being written, or new: wait until it stays the same for settle_time
+                settling[src] = (signature, now)
+                continue
+            if now - settling[src][1] < settle_time:
+                continue
+            del settling[src]
+            try:
+                written = _append_source(src, target, state['size'], active_check, stats_callback)
+            except Exception as e:
+                report(src, 'failed', str(e))
+                continue
+            if written is None:
+                break
+            state['size'] += written
+            state['pending_bytes'] += written
+            state['appended'][src] = signature
+            _write_watch_state(target, state)
+            appended_count += 1
+            report(src, 'appended', f"{written} bytes")
+            if cleanup:
+                try:
+                    os.remove(src)
+                except OSError as e:
+                    print(f"Warning: Could not delete {src}: {e}", file=sys.stderr)
+
+        due = state['pending_bytes'] and (
+            (compact_size is not None and state['pending_bytes'] >= compact_size)
+            or (compact_interval is not None and time.time() - state['compacted'] >= compact_interval))
+        if due and is_active():
+            try:
+                success = deduplicate_in_place(target, active_check=active_check, stats_callback=stats_callback,
+                                               **options)
+            except Exception as e:
+                success = False
+                report(target, 'failed', str(e))
+            if success:
+                compacted_size = os.path.getsize(target)
+                report(target, 'compacted', f"{state['size']} -> {compacted_size} bytes")
+                state['size'] = compacted_size
+                state['pending_bytes'] = 0
+                compactions += 1
+            # A failed compaction is tried again after the next append, or compact_interval from now
+            state['compacted'] = time.time()
+            _write_watch_state(target, state)
+
+        deadline = time.time() + poll_interval
+        while is_active() and time.time() < deadline:
+            time.sleep(min(0.1, poll_interval))
+    return appended_count, compactions
+
+def combine_files(operation, sources, target, progress_callback=None, active_check=None, workers=1, run_codec=None, stats_callback=None, spill_dirs=None):
+    """
+    Writes a set operation ('union', 'intersection', 'difference' or 'symmetric_difference') over the
+    distinct lines of the sources to target, sorted and marked so it can be merged into incrementally.
+    'difference' keeps the lines of the first source found in no other. Returns False if cancelled.
+    """
+    target_abs = os.path.abspath(target)
+    if target_abs in [os.path.abspath(p) for p in sources]:
+        raise ValueError("Target file cannot be one of the source files.")
+
+    success = set_operation_files(
+        operation,
+        sources,
+        target,
+        progress_callback=progress_callback,
+        active_check=active_check,
+        stats_callback=stats_callback,
+        spill_dirs=spill_dirs,
+        mark_sorted=True,
+        workers=workers,
+        run_codec=run_codec
+    )
+
+    if active_check and not active_check():
+        if os.path.exists(target):
+            try:
+                os.remove(target)
+            except:
+                pass
+        return False
+    if not success:
+        raise Exception("An error occurred during the set operation.")
+    return True
+
+def open_index(path, active_check=None):
+    """
+    Opens the lookup index of a sorted, deduplicated file, building it first if it is missing, out of date
+    or doesn't match the file's contents. Raises ValueError if the file is not sorted and deduplicated;
+    returns None if cancelled.
+    """
+    try:
+        return SortedFileIndex(path)
+    except ValueError:
+        pass
+    if not build_sparse_index(path, active_check=active_check):
+        return None
+    # The index was just built from the file's contents, so there is no need to read them again
+    return SortedFileIndex(path, verify=False)
+
+def _file_pool_size(engine, memory_budget, job_count, file_workers=None):
+    if file_workers:
+        return max(1, min(file_workers, job_count))
+    limit = os.cpu_count() or 1
+    if engine in ('sort', 'auto'):
+        # Hash and memory jobs split the budget between them; sort jobs, which 'auto' may pick,
+        # each need their own chunk memory
+        limit = min(limit, memory_budget // _SORT_JOB_MEMORY)
+    return max(1, min(limit, job_count))
+
+def deduplicate_many(sources, progress_callback=None, active_check=None, file_callback=None, stats_callback=None, workers=1, file_workers=None, engine='sort', memory_budget=None, run_codec=None, spill_dirs=None, key_spec=None):
+    """
+    Deduplicates each source in place, several at a time on a process pool sized from the CPU count
+    and the memory budget (file_workers overrides it). Progress is aggregated by bytes across all files.
+    file_callback(path, status, detail) is called as each file ends with status 'succeeded', 'failed'
+    or 'skipped', and stats carry the 'file' they belong to. Returns {path: (status, detail)}.
+    """
+    memory_budget = memory_budget or DEFAULT_MEMORY_BUDGET
+    results = {}
+    file_progress = {}
+    sizes = {}
+    last_progress = [-1]
+
+    def update_progress(src, value):
+        # Overall progress is weighted by file size, so large files count for more
+        file_progress[src] = value
+        done = sum(sizes[path] * percent for path, percent in file_progress.items()) / 100
+        progress = int((done * 100) / total_size) if total_size > 0 else 100
+        if progress_callback and progress != last_progress[0]:
+            progress_callback(progress)
+            last_progress[0] = progress
+
+    def record(src, status, detail=""):
+        results[src] = (status, detail)
+        if status == 'succeeded':
+            update_progress(src, 100)
+        if file_callback:
+            file_callback(src, status, detail)
+
+    def is_active():
+        return active_check is None or active_check()
+
+    jobs = []
+    for src in sources:
+        try:
+            sizes[src] = os.path.getsize(src)
+            jobs.append(src)
+        except OSError as e:
+            record(src, 'failed', e.strerror or str(e))
+    total_size = sum(sizes.values())
+
+    pool_size = _file_pool_size(engine, memory_budget, len(jobs), file_workers)
+    options = {
+        'engine': engine,
+        'run_codec': run_codec,
+        'spill_dirs': spill_dirs,
+        'key_spec': key_spec,
+    }
+
+    if pool_size <= 1:
+        # One file at a time, each one using the run generation workers
+        for src in jobs:
+            if not is_active():
+                record(src, 'skipped')
+                continue
+            try:
+                success = deduplicate_in_place(
+                    src,
+                    progress_callback=lambda value, src=src: update_progress(src, value),
+                    active_check=active_check,
+                    workers=workers,
+                    memory_budget=memory_budget,
+                    stats_callback=stats_callback and (lambda stats, src=src: stats_callback({**stats, 'file': src})),
+                    **options
+                )
+                record(src, 'succeeded' if success else 'skipped')
+            except Exception as e:
+                record(src, 'failed', str(e))
+        return results
+
+    # Several files at once, one process per file
+    options['workers'] = 1
+    options['memory_budget'] = memory_budget // pool_size if engine != 'sort' else memory_budget
+    cancel_event = multiprocessing.Event()
+    job_events = multiprocessing.Queue()
+
+    def drain_events():
+        while not job_events.empty():
+            try:
+                kind, src, payload = job_events.get_nowait()
+            except Exception:
+                break
+            if kind == 'progress':
+                update_progress(src, payload)
+            elif stats_callback:
+                stats_callback({**payload, 'file': src})
+
+    with ProcessPoolExecutor(max_workers=pool_size, initializer=_init_job_process,
+                             initargs=(cancel_event, job_events)) as pool:
+        pending = {pool.submit(_deduplicate_job, src, options): src for src in jobs}
+        while pending:
+            done, _ = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            drain_events()
+
+            if not is_active() and not cancel_event.is_set():
+                # Running jobs see the event and stop; queued ones never start
+                cancel_event.set()
+                for future in pending:
+                    future.cancel()
+
+            for future in done:
+                src = pending.pop(future)
+                if future.cancelled():
+                    record(src, 'skipped')
+                elif future.exception() is not None:
+                    record(src, 'failed', str(future.exception()))
+                else:
+                    record(src, 'succeeded' if future.result() else 'skipped')
+    drain_events()
+    job_events.close()
+    return results
+
+def failure_message(results):
+    """
+    Summarizes the failed files of a deduplicate_many result, or returns "" if none failed.
+    """
+    failed = [(src, detail) for src, (status, detail) in results.items() if status == 'failed']
+    if not failed:
+        return ""
+    details = "\n".join(f"{os.path.basename(src)}: {detail}" for src, detail in failed[:10])
+    return f"{len(failed)} of {len(results)} file(s) could not be deduplicated:\n{details}"
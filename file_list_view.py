@@ -0,0 +1,298 @@
+import os
+import time
+from PyQt6.QtWidgets import QTableView, QAbstractItemView, QHeaderView
+from PyQt6.QtGui import QPainter, QFont, QColor
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex, pyqtSignal
+from list_order_thread import ListOrderThread
+
+def _format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+class FileListModel(QAbstractTableModel):
+    """
+    The source files, in merge order, with the size, line count estimate and modification time
+    filled in by a background scan. Rows are looked up through a path index instead of walking
+    the list, and sorting and filtering work on plain Python lists, not through per-row Qt calls,
+    in a ListOrderThread: the new order is swapped in with one layout change once it is ready.
+    """
+    COLUMNS = ("Name", "Size", "Lines", "Modified")
+
+    # Emitted when a sort or filter has been applied
+    reordered = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._paths = []
+        # path -> (size, mtime, lines, exact), or None until the file has been scanned
+        self._info = {}
+        # path -> (label, color) shown after the name, e.g. the result of deduplicating the file
+        self._status = {}
+        self._filter = ""
+        self._rows = []
+        self._row_index = {}
+        # The sort still to be applied as (column, descending), the latest reorder request and its worker,
+        # and a count of path list changes, which make a reorder computed before them stale
+        self._pending_sort = None
+        self._request = 0
+        self._worker = None
+        self._worker_changes = 0
+        self._workers = set()
+        self._changes = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        path = self._rows[index.row()]
+        column = index.column()
+        if role == Qt.ItemDataRole.DisplayRole:
+            info = self._info[path]
+            if column == 0:
+                status = self._status.get(path)
+                return f"{os.path.basename(path)} ({status[0]})" if status else os.path.basename(path)
+            if info is None:
+                return "..."
+            size, mtime, lines, exact = info
+            if size is None:
+                return "missing" if column == 1 else ""
+            if column == 1:
+                return _format_size(size)
+            if column == 2:
+                return f"{lines:,}" if exact else f"~{lines:,}"
+            return time.strftime('%Y-%m-%d %H:%M', time.localtime(mtime))
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return path
+        if role == Qt.ItemDataRole.ForegroundRole and column == 0 and path in self._status:
+            return self._status[path][1]
+        if role == Qt.ItemDataRole.TextAlignmentRole and column in (1, 2):
+            return Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+        return None
+
+    def count(self):
+        return len(self._paths)
+
+    def paths(self):
+        """
+        All paths in merge order, including a sort that is still being computed.
+        """
+        self.finish_ordering()
+        return list(self._paths)
+
+    def path(self, row):
+        return self._rows[row]
+
+    def unscanned(self):
+        return [path for path in self._paths if self._info[path] is None]
+
+    def _matches(self, path):
+        return not self._filter or self._filter in path.lower()
+
+    def _refresh_rows(self):
+        self._rows = [path for path in self._paths if self._matches(path)]
+        self._row_index = {path: row for row, path in enumerate(self._rows)}
+
+    def add_paths(self, paths):
+        """
+        Appends the paths not already in the list and returns them.
+        """
+        added = []
+        for path in paths:
+            if path not in self._info:
+                self._info[path] = None
+                added.append(path)
+        if not added:
+            return added
+        self._changes += 1
+        self._paths.extend(added)
+        visible = [path for path in added if self._matches(path)]
+        if visible:
+            first = len(self._rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(visible) - 1)
+            for row, path in enumerate(visible, first):
+                self._rows.append(path)
+                self._row_index[path] = row
+            self.endInsertRows()
+        return added
+
+    def remove_paths(self, paths):
+        removed = set(paths)
+        self._changes += 1
+        self.beginResetModel()
+        self._paths = [path for path in self._paths if path not in removed]
+        for path in removed:
+            self._info.pop(path, None)
+            self._status.pop(path, None)
+        self._refresh_rows()
+        self.endResetModel()
+
+    def clear(self):
+        self.remove_paths(self._paths)
+
+    def set_info(self, batch):
+        """
+        Stores a batch of scan results from FileScanThread and repaints the rows it touched at once.
+        """
+        rows = []
+        for path, size, mtime, lines, exact in batch:
+            if path in self._info:
+                self._info[path] = (size, mtime, lines, exact)
+                if path in self._row_index:
+                    rows.append(self._row_index[path])
+        if rows:
+            self.dataChanged.emit(self.index(min(rows), 1), self.index(max(rows), len(self.COLUMNS) - 1))
+
+    def set_status(self, path, label, color):
+        self._status[path] = (label, color)
+        row = self._row_index.get(path)
+        if row is not None:
+            self.dataChanged.emit(self.index(row, 0), self.index(row, 0))
+
+    def clear_status(self, paths=None):
+        if paths is None:
+            self._status.clear()
+        else:
+            for path in paths:
+                self._status.pop(path, None)
+        if self._rows:
+            self.dataChanged.emit(self.index(0, 0), self.index(len(self._rows) - 1, 0))
+
+    def set_filter(self, text):
+        self._filter = text.strip().lower()
+        self._reorder()
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        """
+        Reorders the whole list, which is also the merge order. Files not scanned yet sort first.
+        """
+        self._pending_sort = (column, order == Qt.SortOrder.DescendingOrder)
+        self._reorder()
+
+    def _reorder(self):
+        # A newer request supersedes any running one, whose result is then dropped
+        self._request += 1
+        worker = ListOrderThread(self._request, list(self._paths), dict(self._info), self._filter, self._pending_sort)
+        self._worker_changes = self._changes
+        worker.ordered.connect(self._apply_order)
+        worker.finished.connect(lambda worker=worker: self._workers.discard(worker))
+        self._workers.add(worker)
+        self._worker = worker
+        worker.start()
+
+    def _apply_order(self, request):
+        worker = self._worker
+        if worker is None or worker.request != request:
+            return
+        self._worker = None
+        if self._worker_changes != self._changes:
+            # Files were added or removed meanwhile: order the current list instead
+            self._reorder()
+            return
+        if worker.sort == self._pending_sort:
+            self._pending_sort = None
+        self.layoutAboutToBeChanged.emit()
+        old_rows = self._rows
+        self._paths, self._rows, self._row_index = worker.result
+        # Keep the selection and current item on the same files, and drop those filtered out
+        moved = self.persistentIndexList()
+        self.changePersistentIndexList(moved, [
+            self.index(self._row_index[old_rows[index.row()]], index.column())
+            if old_rows[index.row()] in self._row_index else QModelIndex() for index in moved])
+        self.layoutChanged.emit()
+        self.reordered.emit()
+
+    def finish_ordering(self):
+        """
+        Waits for a sort or filter still being computed and applies it.
+        """
+        for worker in list(self._workers):
+            worker.wait()
+        while self._worker is not None:
+            self._worker.wait()
+            self._apply_order(self._worker.request)
+
+class FileListView(QTableView):
+    """
+    A table rather than a tree: a tree view lays out every row again, through the model, after each
+    sort or filter, while the table only needs the row count since all rows have the same height.
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.file_model = FileListModel(self)
+        self.setModel(self.file_model)
+        self.setShowGrid(False)
+        self.setWordWrap(False)
+        self.setAlternatingRowColors(False)
+        self.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        self.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        rows = self.verticalHeader()
+        rows.hide()
+        rows.setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+
+        # Sorting is applied only when a header is clicked, so the list otherwise keeps the order files were added in
+        header = self.header()
+        header.setSectionsClickable(True)
+        header.setSortIndicatorShown(False)
+        header.setStretchLastSection(False)
+        header.setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        # Sized for their widest values up front: fitting them to the contents would query every row
+        # whenever the header changes, e.g. on each sort
+        metrics = header.fontMetrics()
+        for column, widest in enumerate(("1023.9 MB", "~999,999,999", "2000-12-31 23:59"), 1):
+            header.setSectionResizeMode(column, QHeaderView.ResizeMode.Interactive)
+            header.resizeSection(column, metrics.horizontalAdvance(widest) + 24)
+        header.sectionClicked.connect(self._sort_by)
+        
+        self._placeholder_font = QFont("Segoe UI", 11)
+        self._placeholder_color = QColor("#bdc3c7")
+        self._placeholder_text = "Drag and drop files here"
+
+    def header(self):
+        return self.horizontalHeader()
+
+    def showEvent(self, event):
+        # Rows are one line of the styled font plus the item padding; set once the style sheet has applied
+        self.verticalHeader().setDefaultSectionSize(self.fontMetrics().height() + 18)
+        super().showEvent(event)
+
+    def _sort_by(self, column):
+        header = self.header()
+        if header.isSortIndicatorShown() and header.sortIndicatorSection() == column:
+            order = (Qt.SortOrder.DescendingOrder if header.sortIndicatorOrder() == Qt.SortOrder.AscendingOrder
+                     else Qt.SortOrder.AscendingOrder)
+        else:
+            order = Qt.SortOrder.AscendingOrder
+        header.setSortIndicatorShown(True)
+        header.setSortIndicator(column, order)
+        self.file_model.sort(column, order)
+
+    def selected_paths(self):
+        """
+        The selected files in list order.
+        """
+        rows = sorted(index.row() for index in self.selectionModel().selectedRows())
+        return [self.file_model.path(row) for row in rows]
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.file_model.rowCount() == 0:
+            painter = QPainter(self.viewport())
+            painter.save()
+            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+            painter.setPen(self._placeholder_color)
+            painter.setFont(self._placeholder_font)
+            text = self._placeholder_text if self.file_model.count() == 0 else "No files match the filter"
+            painter.drawText(self.viewport().rect(), Qt.AlignmentFlag.AlignCenter, text)
+            painter.restore()
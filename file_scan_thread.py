@@ -0,0 +1,38 @@
+import os
+import time
+from PyQt6.QtCore import QThread, pyqtSignal
+
+class FileScanThread(QThread):
+    # Batches of (path, size, mtime, lines, exact); size is None if the file can't be read
+    scanned = pyqtSignal(list)
+
+    def __init__(self, paths, batch_interval=0.2):
+        super().__init__()
+        self.paths = paths
+        self.batch_interval = batch_interval
+        self._active = True
+
+    def stop(self):
+        self._active = False
+
+    def run(self):
+        from utils import estimate_line_count
+        batch = []
+        last_emit = time.monotonic()
+        for path in self.paths:
+            if not self._active:
+                return
+            try:
+                st = os.stat(path)
+                lines, exact = estimate_line_count(path, st.st_size)
+                batch.append((path, st.st_size, st.st_mtime, lines, exact))
+            except (OSError, ValueError):
+                # Unreadable, corrupt, or compressed with a codec whose package is missing
+                batch.append((path, None, None, None, False))
+            # Results are handed over in batches so the GUI repaints a few times a second, not per file
+            if time.monotonic() - last_emit >= self.batch_interval:
+                self.scanned.emit(batch)
+                batch = []
+                last_emit = time.monotonic()
+        if batch:
+            self.scanned.emit(batch)
@@ -0,0 +1,37 @@
+import os
+from PyQt6.QtCore import QThread, pyqtSignal
+
+class ListOrderThread(QThread):
+    # Emitted with the request number once result holds (paths, visible rows, row index)
+    ordered = pyqtSignal(int)
+
+    def __init__(self, request, paths, info, filter_text, sort=None):
+        super().__init__()
+        self.request = request
+        self.paths = paths
+        self.info = info
+        self.filter_text = filter_text
+        self.sort = sort
+        self.result = None
+
+    @staticmethod
+    def sort_key(column, info):
+        """
+        The sort key of a column for FileListModel rows. Files not scanned yet sort first.
+        """
+        if column == 0:
+            return lambda path: os.path.basename(path).lower()
+        index = {1: 0, 2: 2, 3: 1}[column]
+        return lambda path: (info[path] or (None,) * 4)[index] or -1
+
+    def run(self):
+        paths = self.paths
+        if self.sort is not None:
+            column, descending = self.sort
+            paths.sort(key=self.sort_key(column, self.info), reverse=descending)
+        if self.filter_text:
+            rows = [path for path in paths if self.filter_text in path.lower()]
+        else:
+            rows = list(paths)
+        self.result = (paths, rows, {path: row for row, path in enumerate(rows)})
+        self.ordered.emit(self.request)
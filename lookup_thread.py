@@ -0,0 +1,44 @@
+from PyQt6.QtCore import QThread, pyqtSignal
+
+class LookupThread(QThread):
+    progress = pyqtSignal(int)
+    finished = pyqtSignal(bool, str)
+
+    def __init__(self, path, query, prefix=False, limit=20):
+        super().__init__()
+        self.path = path
+        self.query = query
+        self.prefix = prefix
+        self.limit = limit
+        self._active = True
+
+    def stop(self):
+        self._active = False
+
+    def run(self):
+        try:
+            from engine import open_index
+            # Building a missing index is the only slow part; the lookup itself takes milliseconds
+            index = open_index(self.path, active_check=lambda: self._active)
+            if index is None:
+                self.finished.emit(False, "Lookup cancelled by user.")
+                return
+
+            with index:
+                if self.prefix:
+                    matches = index.prefix(self.query, self.limit + 1)
+                    if not matches:
+                        message = f"No line starts with '{self.query}'."
+                    else:
+                        shown = "\n".join(line.decode('utf-8', 'replace') for line in matches[:self.limit])
+                        more = "\n..." if len(matches) > self.limit else ""
+                        message = f"Lines starting with '{self.query}':\n{shown}{more}"
+                elif index.contains(self.query):
+                    message = f"'{self.query}' is in the file."
+                else:
+                    message = f"'{self.query}' is not in the file."
+
+            self.progress.emit(100)
+            self.finished.emit(True, message)
+        except Exception as e:
+            self.finished.emit(False, str(e))
@@ -1,13 +1,53 @@
 import os
 from PyQt6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-                             QPushButton, QListWidgetItem, QFileDialog, QMessageBox, QLabel, QCheckBox, QGroupBox)
-from PyQt6.QtCore import Qt
+                             QPushButton, QFileDialog, QMessageBox, QLabel, QCheckBox, QGroupBox,
+                             QLineEdit, QSpinBox, QComboBox, QInputDialog)
+from PyQt6.QtCore import Qt, QTimer
+from PyQt6.QtGui import QColor
 from merge_thread import MergeThread
 from deduplication_thread import DeduplicationThread
+from set_operation_thread import SetOperationThread
+from lookup_thread import LookupThread
+from file_scan_thread import FileScanThread
 from animated_progress_bar import AnimatedProgressBar
-from custom_list_widget import CustomListWidget
+from file_list_view import FileListView
+from engine import describe_job, discard_job, interrupted_jobs, job_arguments, new_job_dir, read_job
+from utils import (codec_for_path, describe_stage_stats, parse_size, read_checkpoint, KeySpec, ShardSpec, COMPRESSED_EXTENSIONS,
+                   DEFAULT_INDEX_INTERVAL)
 
 class FileMergerApp(QMainWindow):
+    # Compressed sources are read as they are, whatever codec their extension names
+    SOURCE_EXTENSIONS = ('.txt',) + tuple(COMPRESSED_EXTENSIONS)
+    SOURCE_FILTER = "Text Files (" + " ".join(f"*{ext}" for ext in SOURCE_EXTENSIONS) + ")"
+
+    OUTPUT_CODEC_LABELS = (
+        ("Plain text", None),
+        ("gzip (.gz)", 'gzip'),
+        ("zstd (.zst)", 'zstd'),
+        ("bzip2 (.bz2)", 'bz2'),
+        ("xz (.xz)", 'xz'),
+    )
+
+    SHARD_MODE_LABELS = (
+        ("One file", None, ""),
+        ("Shards of at most", 'size', "1G"),
+        ("Shards of at most (lines)", 'lines', "10000000"),
+        ("Shards split by line hash, count", 'hash', "16"),
+    )
+
+    DEDUP_ENGINE_LABELS = (
+        ("Automatic (fastest for the data)", 'auto'),
+        ("Sorting (sorted output)", 'sort'),
+        ("Hash partitions (original line order)", 'hash'),
+    )
+
+    SET_OPERATION_LABELS = (
+        ("Lines in the first file only (difference)", 'difference'),
+        ("Lines in every file (intersection)", 'intersection'),
+        ("Lines unique to one file (symmetric difference)", 'symmetric_difference'),
+        ("Lines in any file (union)", 'union'),
+    )
+
     MESSAGE_BOX_STYLE = """
         QMessageBox {
             background-color: #34495e;
@@ -92,22 +132,27 @@ class FileMergerApp(QMainWindow):
             QPushButton#dangerButton:hover {
                 background-color: #e67e22;
             }
-            QListWidget {
+            QTableView {
                 border: 2px solid #2c3e50;
                 border-radius: 5px;
                 background-color: #2c3e50;
                 padding: 5px;
                 font-size: 14px;
             }
-            QListWidget::item {
+            QTableView::item {
                 padding: 8px;
                 border-bottom: 1px solid #34495e;
                 color: #ecf0f1;
             }
-            QListWidget::item:selected {
+            QTableView::item:selected {
                 background-color: #3498db;
                 color: white;
-                border-radius: 4px;
+            }
+            QHeaderView::section {
+                background-color: #34495e;
+                color: #bdc3c7;
+                border: none;
+                padding: 4px 8px;
             }
             QProgressBar {
                 border: 1px solid #3498db;
@@ -163,9 +208,22 @@ class FileMergerApp(QMainWindow):
         source_layout = QVBoxLayout()
         source_group.setLayout(source_layout)
 
-        self.file_list = CustomListWidget()
+        self.filter_edit = QLineEdit()
+        self.filter_edit.setPlaceholderText("Filter by path...")
+        self.filter_edit.setClearButtonEnabled(True)
+        source_layout.addWidget(self.filter_edit)
+
+        self.file_list = FileListView()
+        self.file_model = self.file_list.file_model
         source_layout.addWidget(self.file_list)
 
+        # Refilter once typing pauses instead of on every keystroke
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(200)
+        self.filter_timer.timeout.connect(self.apply_filter)
+        self.filter_edit.textChanged.connect(self.filter_timer.start)
+
         file_actions_layout = QHBoxLayout()
         self.add_button = QPushButton("Add Files")
         self.add_button.clicked.connect(self.select_files)
@@ -199,6 +257,29 @@ class FileMergerApp(QMainWindow):
         self.dedup_selected_button.setToolTip("Removes duplicate lines from each selected file individually (overwrites originals)")
         self.dedup_selected_button.clicked.connect(self.deduplicate_selected)
         tools_layout.addWidget(self.dedup_selected_button)
+
+        self.set_operation_combo = QComboBox()
+        for label, operation in self.SET_OPERATION_LABELS:
+            self.set_operation_combo.addItem(label, operation)
+        self.set_operation_combo.setToolTip("Compares the distinct lines of the selected files, in list order, "
+                                            "and saves the result sorted to a new file")
+        tools_layout.addWidget(self.set_operation_combo)
+
+        self.set_operation_button = QPushButton("Compare Selected Files")
+        self.set_operation_button.setEnabled(False)
+        self.set_operation_button.clicked.connect(self.run_set_operation)
+        tools_layout.addWidget(self.set_operation_button)
+
+        self.lookup_button = QPushButton("Look Up Line")
+        self.lookup_button.setEnabled(False)
+        self.lookup_button.setToolTip("Searches the selected sorted, deduplicated file through its lookup index, "
+                                      "which is built first if needed")
+        self.lookup_button.clicked.connect(self.look_up_line)
+        tools_layout.addWidget(self.lookup_button)
+
+        self.lookup_prefix_checkbox = QCheckBox("List lines starting with the query")
+        self.lookup_prefix_checkbox.setToolTip("Looks up every line that begins with the text entered instead of that exact line")
+        tools_layout.addWidget(self.lookup_prefix_checkbox)
         
         options_row_layout.addWidget(tools_group)
 
@@ -212,6 +293,118 @@ class FileMergerApp(QMainWindow):
 
         self.dedup_checkbox = QCheckBox("Apply global deduplication to merged result")
         merge_options_layout.addWidget(self.dedup_checkbox)
+
+        dedup_engine_layout = QHBoxLayout()
+        dedup_engine_layout.addWidget(QLabel("Deduplicate by"))
+        self.dedup_engine_combo = QComboBox()
+        for label, engine in self.DEDUP_ENGINE_LABELS:
+            self.dedup_engine_combo.addItem(label, engine)
+        # Sorted output stays the default, as on the command line; the other engines keep the original line order
+        self.dedup_engine_combo.setCurrentIndex(self.dedup_engine_combo.findData('sort'))
+        self.dedup_engine_combo.setToolTip("Automatic samples the files first and keeps duplicates in memory when they "
+                                           "fit, using hash partitions or sorting when they don't; it keeps the original "
+                                           "line order unless it has to sort")
+        self.dedup_engine_combo.currentIndexChanged.connect(self.update_button_states)
+        dedup_engine_layout.addWidget(self.dedup_engine_combo)
+        dedup_engine_layout.addStretch()
+        merge_options_layout.addLayout(dedup_engine_layout)
+
+        self.incremental_checkbox = QCheckBox("Add to an existing deduplicated file (incremental)")
+        self.incremental_checkbox.setToolTip("Sorts only the new files and merges them into the chosen target, "
+                                             "which must have been produced by a deduplicated merge")
+        merge_options_layout.addWidget(self.incremental_checkbox)
+
+        self.resumable_checkbox = QCheckBox("Keep checkpoints so an interrupted merge can be resumed")
+        self.resumable_checkbox.setToolTip("Sorted runs are kept until a deduplicated merge completes, so after a "
+                                           "cancel, crash or reboot it picks up where it stopped. Only sorting keeps "
+                                           "checkpoints: Automatic then never picks hash partitions, and runs are kept "
+                                           "in the job folder unless temporary folders are set")
+        merge_options_layout.addWidget(self.resumable_checkbox)
+
+        self.compress_runs_checkbox = QCheckBox("Compress temporary files while deduplicating")
+        self.compress_runs_checkbox.setToolTip("Trades some CPU for much less temporary disk I/O")
+        merge_options_layout.addWidget(self.compress_runs_checkbox)
+
+        output_codec_layout = QHBoxLayout()
+        output_codec_layout.addWidget(QLabel("Save the merged file as"))
+        self.output_codec_combo = QComboBox()
+        for label, codec in self.OUTPUT_CODEC_LABELS:
+            self.output_codec_combo.addItem(label, codec)
+        self.output_codec_combo.setToolTip("Compresses the merged file on all CPU cores as it is written; "
+                                           "a target named .gz, .zst, .bz2 or .xz is compressed to match")
+        output_codec_layout.addWidget(self.output_codec_combo)
+        output_codec_layout.addStretch()
+        merge_options_layout.addLayout(output_codec_layout)
+
+        shard_layout = QHBoxLayout()
+        shard_layout.addWidget(QLabel("Write the merged file as"))
+        self.shard_mode_combo = QComboBox()
+        for label, mode, limit in self.SHARD_MODE_LABELS:
+            self.shard_mode_combo.addItem(label, mode)
+        self.shard_mode_combo.setToolTip("Shards are written side by side, with a .shards.json manifest listing each "
+                                         "one's lines and byte range; hash shards never share a line (or key)")
+        self.shard_mode_combo.currentIndexChanged.connect(self.on_shard_mode_changed)
+        shard_layout.addWidget(self.shard_mode_combo)
+        self.shard_limit_edit = QLineEdit()
+        self.shard_limit_edit.setMaximumWidth(90)
+        self.shard_limit_edit.setEnabled(False)
+        shard_layout.addWidget(self.shard_limit_edit)
+        shard_layout.addStretch()
+        merge_options_layout.addLayout(shard_layout)
+
+        self.index_checkbox = QCheckBox("Write a lookup index for the deduplicated result")
+        self.index_checkbox.setToolTip("Lets 'Look Up Line' search the sorted result in milliseconds; "
+                                       "only sorted results can have one")
+        merge_options_layout.addWidget(self.index_checkbox)
+
+        self.skip_identical_checkbox = QCheckBox("Skip source files identical to another one")
+        self.skip_identical_checkbox.setToolTip("Compares file sizes and content hashes before a deduplicated merge; "
+                                                "hashes are cached, so unchanged files are not read again")
+        self.skip_identical_checkbox.setChecked(True)
+        merge_options_layout.addWidget(self.skip_identical_checkbox)
+
+        key_layout = QHBoxLayout()
+        self.key_field_checkbox = QCheckBox("Deduplicate on field")
+        self.key_field_checkbox.setToolTip("Treats lines as duplicates when one field matches, "
+                                           "e.g. field 1 of 'user:value' lines split on ':'")
+        key_layout.addWidget(self.key_field_checkbox)
+        self.key_field_spin = QSpinBox()
+        self.key_field_spin.setRange(1, 999)
+        key_layout.addWidget(self.key_field_spin)
+        key_layout.addWidget(QLabel("split on"))
+        self.key_delimiter_edit = QLineEdit(":")
+        self.key_delimiter_edit.setMaximumWidth(40)
+        key_layout.addWidget(self.key_delimiter_edit)
+        self.key_ignore_case_checkbox = QCheckBox("Ignore case and spaces")
+        key_layout.addWidget(self.key_ignore_case_checkbox)
+        self.keep_last_checkbox = QCheckBox("Keep last")
+        self.keep_last_checkbox.setToolTip("Keeps the last record of each key instead of the first")
+        key_layout.addWidget(self.keep_last_checkbox)
+        key_layout.addStretch()
+        merge_options_layout.addLayout(key_layout)
+
+        spill_layout = QHBoxLayout()
+        self.spill_dirs_edit = QLineEdit()
+        self.spill_dirs_edit.setPlaceholderText("Temporary folders (system default)")
+        self.spill_dirs_edit.setToolTip(f"Folders for temporary files, separated by '{os.pathsep}'. "
+                                        "Temporary files are spread across all of them.")
+        spill_layout.addWidget(self.spill_dirs_edit)
+
+        self.spill_dirs_button = QPushButton("Add Folder")
+        self.spill_dirs_button.clicked.connect(self.add_spill_dir)
+        spill_layout.addWidget(self.spill_dirs_button)
+        merge_options_layout.addLayout(spill_layout)
+
+        stats_log_layout = QHBoxLayout()
+        self.stats_log_edit = QLineEdit()
+        self.stats_log_edit.setPlaceholderText("Performance log (off)")
+        self.stats_log_edit.setToolTip("JSON-lines file that per-stage throughput stats of every job are appended to")
+        stats_log_layout.addWidget(self.stats_log_edit)
+
+        self.stats_log_button = QPushButton("Choose Log")
+        self.stats_log_button.clicked.connect(self.choose_stats_log)
+        stats_log_layout.addWidget(self.stats_log_button)
+        merge_options_layout.addLayout(stats_log_layout)
         
         options_row_layout.addWidget(merge_options_group)
         main_layout.addLayout(options_row_layout)
@@ -246,8 +439,16 @@ class FileMergerApp(QMainWindow):
         
         main_layout.addLayout(execution_layout)
 
-        self.file_list.itemSelectionChanged.connect(self.update_button_states)
+        self.file_list.selectionModel().selectionChanged.connect(self.update_button_states)
+        self.file_model.modelReset.connect(self.update_button_states)
+        self.file_model.reordered.connect(self.update_button_states)
         self.active_worker = None
+        self.scan_workers = []
+        self.spill_totals = [0, 0]
+        self.dedup_results = {}
+
+        # Offered once the window is up
+        QTimer.singleShot(0, self.offer_interrupted_jobs)
 
     def dragEnterEvent(self, event):
         if event.mimeData().hasUrls():
@@ -255,81 +456,167 @@ class FileMergerApp(QMainWindow):
 
     def dropEvent(self, event):
         files = [u.toLocalFile() for u in event.mimeData().urls() 
-                 if u.toLocalFile().lower().endswith('.txt')]
+                 if u.toLocalFile().lower().endswith(self.SOURCE_EXTENSIONS)]
         self.import_files(files)
 
     def select_files(self):
-        files, _ = QFileDialog.getOpenFileNames(self, "Select Text Files", "", "Text Files (*.txt)")
+        files, _ = QFileDialog.getOpenFileNames(self, "Select Text Files", "", self.SOURCE_FILTER)
         if files:
             self.import_files(files)
 
     def deduplicate_selected(self):
-        selected_items = self.file_list.selectedItems()
-        if not selected_items:
+        sources = self.file_list.selected_paths()
+        if not sources:
+            return
+
+        try:
+            key_spec = self.key_spec()
+        except ValueError as e:
+            self.show_message("Deduplication Key", str(e), QMessageBox.Icon.Warning)
             return
             
         reply = QMessageBox.question(self, 'Confirm Deduplication',
-                                   f"This will remove duplicate lines from {len(selected_items)} file(s) and overwrite the originals. This action cannot be undone.\n\nDo you want to proceed?",
+                                   f"This will remove duplicate lines from {len(sources)} file(s) and overwrite the originals. This action cannot be undone.\n\nDo you want to proceed?",
                                    QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, 
                                    QMessageBox.StandardButton.No)
         
         if reply == QMessageBox.StandardButton.No:
             return
 
-        sources = [item.toolTip() for item in selected_items]
+        # Clear any result left over from a previous run
+        self.file_model.clear_status(sources)
+        self.dedup_results = {}
         
-        self.active_worker = DeduplicationThread(sources)
+        self.active_worker = DeduplicationThread(sources, workers=os.cpu_count() or 1, engine=self.dedup_engine(),
+                                                 run_codec=self.run_codec(), spill_dirs=self.spill_dirs(), key_spec=key_spec,
+                                                 stats_log=self.stats_log())
         self.active_worker.progress.connect(self.update_progress)
+        self.active_worker.stats.connect(self.update_stats)
+        self.active_worker.file_finished.connect(self.on_file_deduplicated)
         self.active_worker.finished.connect(self.on_process_complete)
         self.active_worker.start()
 
         self.set_ui_processing_state(True)
         self.status_label.setText("Deduplicating selected files...")
 
+    def run_set_operation(self):
+        sources = self.file_list.selected_paths()
+        if len(sources) < 2:
+            return
+
+        output_file, _ = QFileDialog.getSaveFileName(self, "Save Comparison Result", "", "Text File (*.txt)")
+        if not output_file:
+            return
+
+        # The first selected file in list order is the one 'difference' keeps lines from
+        operation = self.set_operation_combo.currentData()
+
+        self.active_worker = SetOperationThread(operation, sources, output_file, workers=os.cpu_count() or 1,
+                                                run_codec=self.run_codec(), spill_dirs=self.spill_dirs(),
+                                                stats_log=self.stats_log())
+        self.active_worker.progress.connect(self.update_progress)
+        self.active_worker.stats.connect(self.update_stats)
+        self.active_worker.finished.connect(self.on_process_complete)
+        self.active_worker.start()
+
+        self.set_ui_processing_state(True)
+        self.status_label.setText("Comparing selected files...")
+
+    def look_up_line(self):
+        selected = self.file_list.selected_paths()
+        if len(selected) != 1:
+            return
+
+        prefix = self.lookup_prefix_checkbox.isChecked()
+        label = "Start of the lines to list:" if prefix else "Line to find:"
+        query, ok = QInputDialog.getText(self, "Look Up Line", label)
+        if not ok or not query:
+            return
+
+        self.active_worker = LookupThread(selected[0], query, prefix)
+        self.active_worker.progress.connect(self.update_progress)
+        self.active_worker.finished.connect(self.on_lookup_complete)
+        self.active_worker.start()
+
+        self.set_ui_processing_state(True)
+        self.status_label.setText("Looking up line...")
+
+    def on_lookup_complete(self, success, message):
+        self.set_ui_processing_state(False)
+        self.progress_bar.setValue(0)
+        if success:
+            self.status_label.setText("Lookup completed.")
+            self.show_message("Look Up Line", message, QMessageBox.Icon.Information)
+        elif "cancelled" in message.lower():
+            self.status_label.setText("Lookup cancelled.")
+        else:
+            self.status_label.setText("An error occurred.")
+            self.show_message("Error", f"An error occurred: {message}", QMessageBox.Icon.Critical)
+
     def import_files(self, files):
         if not files:
             return
             
-        self.file_list.setUpdatesEnabled(False)
-        added_count = 0
-        try:
-            existing_files = {self.file_list.item(i).toolTip() for i in range(self.file_list.count())}
-            for file in files:
-                if file in existing_files:
-                    continue
-                item = QListWidgetItem(os.path.basename(file))
-                item.setToolTip(file)
-                self.file_list.addItem(item)
-                added_count += 1
-        finally:
-            self.file_list.setUpdatesEnabled(True)
-            
-        if added_count > 0:
-            self.status_label.setText(f"{added_count} file(s) added.")
+        added = self.file_model.add_paths(files)
+        if added:
+            self.status_label.setText(f"{len(added)} file(s) added.")
+            # Sizes, line counts and dates fill in as the scan gets to them
+            scanner = FileScanThread(added)
+            scanner.scanned.connect(self.file_model.set_info)
+            scanner.finished.connect(lambda scanner=scanner: self.scan_workers.remove(scanner))
+            self.scan_workers.append(scanner)
+            scanner.start()
         
         self.update_button_states()
 
     def remove_selected(self):
-        for item in self.file_list.selectedItems():
-            self.file_list.takeItem(self.file_list.row(item))
+        self.file_model.remove_paths(self.file_list.selected_paths())
         self.update_button_states()
 
+    def apply_filter(self):
+        self.file_model.set_filter(self.filter_edit.text())
+
     def update_button_states(self):
-        count = self.file_list.count()
-        selected_count = len(self.file_list.selectedItems())
+        count = self.file_model.count()
+        selected_count = len(self.file_list.selectionModel().selectedRows())
         is_merging = self.cancel_button.isEnabled()
 
         self.merge_button.setEnabled(count > 0 and not is_merging)
         self.remove_button.setEnabled(selected_count > 0 and not is_merging)
         self.dedup_selected_button.setEnabled(selected_count > 0 and not is_merging)
+        self.set_operation_button.setEnabled(selected_count > 1 and not is_merging)
+        self.set_operation_combo.setEnabled(not is_merging)
+        self.lookup_button.setEnabled(selected_count == 1 and not is_merging)
+        # Hash partitions keep the original line order, which a lookup index can't search
+        sorted_engine = self.dedup_engine() in ('auto', 'sort')
+        if not sorted_engine:
+            self.index_checkbox.setChecked(False)
+        self.index_checkbox.setEnabled(not is_merging and sorted_engine)
+        self.skip_identical_checkbox.setEnabled(not is_merging)
         self.add_button.setEnabled(not is_merging)
         self.cleanup_checkbox.setEnabled(not is_merging)
         self.dedup_checkbox.setEnabled(not is_merging)
+        self.dedup_engine_combo.setEnabled(not is_merging)
+        self.incremental_checkbox.setEnabled(not is_merging)
+        self.compress_runs_checkbox.setEnabled(not is_merging)
+        self.resumable_checkbox.setEnabled(not is_merging)
+        self.output_codec_combo.setEnabled(not is_merging)
+        self.shard_mode_combo.setEnabled(not is_merging)
+        self.shard_limit_edit.setEnabled(not is_merging and self.shard_mode_combo.currentData() is not None)
+        for widget in (self.key_field_checkbox, self.key_field_spin, self.key_delimiter_edit,
+                       self.key_ignore_case_checkbox, self.keep_last_checkbox):
+            widget.setEnabled(not is_merging)
+        self.spill_dirs_edit.setEnabled(not is_merging)
+        self.spill_dirs_button.setEnabled(not is_merging)
+        self.stats_log_edit.setEnabled(not is_merging)
+        self.stats_log_button.setEnabled(not is_merging)
         
-        self.file_info_label.setText(f"{count} files loaded | {selected_count} selected")
+        shown = self.file_model.rowCount()
+        filtered = f" | {shown} shown" if shown != count else ""
+        self.file_info_label.setText(f"{count} files loaded{filtered} | {selected_count} selected")
 
     def merge_files(self):
-        if self.file_list.count() == 0:
+        if self.file_model.count() == 0:
             return
 
         if self.cleanup_checkbox.isChecked():
@@ -340,24 +627,152 @@ class FileMergerApp(QMainWindow):
             if reply == QMessageBox.StandardButton.No:
                 return
 
-        output_file, _ = QFileDialog.getSaveFileName(self, "Save Combined File", "", "Text File (*.txt)")
+        try:
+            key_spec = self.key_spec()
+        except ValueError as e:
+            self.show_message("Deduplication Key", str(e), QMessageBox.Icon.Warning)
+            return
+        try:
+            shards = self.shard_spec()
+        except ValueError as e:
+            self.show_message("Shards", f"Invalid shard setting: {e}", QMessageBox.Icon.Warning)
+            return
+
+        incremental = self.incremental_checkbox.isChecked()
+        if incremental:
+            if shards is not None:
+                self.show_message("Incremental Merge", "Incremental merging adds to one existing file, so it can't "
+                                  "be combined with writing shards.", QMessageBox.Icon.Warning)
+                return
+            if key_spec is not None:
+                self.show_message("Incremental Merge", "Incremental merging deduplicates whole lines, so it can't "
+                                  "be combined with deduplicating on a field.", QMessageBox.Icon.Warning)
+                return
+            if self.dedup_engine() == 'hash':
+                self.show_message("Incremental Merge", "Incremental merging keeps the target sorted, so it can't "
+                                  "be combined with keeping the original line order.", QMessageBox.Icon.Warning)
+                return
+            output_file, _ = QFileDialog.getSaveFileName(self, "Select Deduplicated Target File", "", "Text File (*.txt)",
+                                                         options=QFileDialog.Option.DontConfirmOverwrite)
+        else:
+            codec = self.output_codec_combo.currentData()
+            extension = next((ext for ext, name in COMPRESSED_EXTENSIONS.items() if name == codec), None)
+            file_filter = f"Compressed File (*{extension})" if extension else "Text File (*.txt)"
+            output_file, _ = QFileDialog.getSaveFileName(self, "Save Combined File", "", file_filter)
         if not output_file:
             return
 
-        sources = [self.file_list.item(i).toolTip() for i in range(self.file_list.count())]
+        output_codec = None if incremental else self.output_codec_combo.currentData() or codec_for_path(output_file)
+        if output_codec and self.index_checkbox.isChecked():
+            self.show_message("Compressed Output", "A lookup index needs an uncompressed file, so it can't be "
+                              "combined with compressing the merged file.", QMessageBox.Icon.Warning)
+            return
+        if shards is not None and self.index_checkbox.isChecked():
+            self.show_message("Shards", "A lookup index needs a single file, so it can't be combined with "
+                              "writing shards.", QMessageBox.Icon.Warning)
+            return
+
+        # Every loaded file is merged, in list order, including those hidden by the filter
+        sources = self.file_model.paths()
         cleanup = self.cleanup_checkbox.isChecked()
         dedup = self.dedup_checkbox.isChecked()
-        
-        self.active_worker = MergeThread(sources, output_file, cleanup, dedup)
+        # Clear any result left over from a previous run
+        self.file_model.clear_status()
+        # Only sorting merges have checkpoints worth keeping
+        sorting = incremental or (dedup and self.dedup_engine() != 'hash')
+        job_dir = new_job_dir() if sorting and self.resumable_checkbox.isChecked() else None
+
+        self.start_merge(MergeThread(sources, output_file, cleanup, dedup, workers=os.cpu_count() or 1,
+                                     engine=self.dedup_engine(), run_codec=self.run_codec(),
+                                     spill_dirs=self.spill_dirs(), incremental=incremental, key_spec=key_spec,
+                                     index_interval=DEFAULT_INDEX_INTERVAL if self.index_checkbox.isChecked() else None,
+                                     skip_identical=self.skip_identical_checkbox.isChecked(),
+                                     stats_log=self.stats_log(), output_codec=output_codec, job_dir=job_dir,
+                                     shards=shards))
+        self.status_label.setText("Merging into existing file..." if incremental else "Merging files...")
+
+    def start_merge(self, worker):
+        self.active_worker = worker
         self.active_worker.progress.connect(self.update_progress)
+        self.active_worker.stats.connect(self.update_stats)
+        self.active_worker.file_skipped.connect(self.on_file_skipped)
         self.active_worker.finished.connect(self.on_process_complete)
         self.active_worker.start()
-
         self.set_ui_processing_state(True)
-        self.status_label.setText("Merging files...")
+
+    def offer_interrupted_jobs(self):
+        """
+        Offers to resume each merge a cancel, crash or reboot left unfinished, until one is resumed.
+        """
+        for job_dir, job in interrupted_jobs():
+            reply = QMessageBox.question(self, 'Resume Interrupted Merge',
+                                         f"A {describe_job(job_dir, job)} did not finish.\n\n"
+                                         "Resume it now? Discard throws its progress away; Ignore asks again next time.",
+                                         QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.Discard |
+                                         QMessageBox.StandardButton.Ignore,
+                                         QMessageBox.StandardButton.Yes)
+            if reply == QMessageBox.StandardButton.Discard:
+                discard_job(job_dir)
+            elif reply == QMessageBox.StandardButton.Yes:
+                sources, target, options = job_arguments(job)
+                missing = [path for path in sources if not os.path.exists(path)]
+                if missing:
+                    self.show_message("Resume Interrupted Merge", f"{len(missing)} source file(s) of this merge are "
+                                      f"gone, e.g. {missing[0]}, so it can't be resumed.", QMessageBox.Icon.Warning)
+                    continue
+                self.file_model.clear_status()
+                self.start_merge(MergeThread(sources, target, job_dir=job_dir, **options))
+                self.status_label.setText("Resuming interrupted merge...")
+                return
+
+    def dedup_engine(self):
+        return self.dedup_engine_combo.currentData()
+
+    def on_shard_mode_changed(self, index):
+        limit = self.SHARD_MODE_LABELS[index][2]
+        self.shard_limit_edit.setText(limit)
+        self.shard_limit_edit.setEnabled(bool(limit))
+
+    def shard_spec(self):
+        mode = self.shard_mode_combo.currentData()
+        if mode is None:
+            return None
+        text = self.shard_limit_edit.text()
+        return ShardSpec(mode, parse_size(text) if mode == 'size' else int(text))
+
+    def key_spec(self):
+        if not self.key_field_checkbox.isChecked():
+            return None
+        ignore_case = self.key_ignore_case_checkbox.isChecked()
+        return KeySpec(self.key_delimiter_edit.text(), self.key_field_spin.value() - 1, casefold=ignore_case,
+                       strip=ignore_case, keep='last' if self.keep_last_checkbox.isChecked() else 'first')
+
+    def run_codec(self):
+        return 'auto' if self.compress_runs_checkbox.isChecked() else None
+
+    def spill_dirs(self):
+        dirs = [d.strip() for d in self.spill_dirs_edit.text().split(os.pathsep) if d.strip()]
+        return dirs or None
+
+    def stats_log(self):
+        return self.stats_log_edit.text().strip() or None
+
+    def choose_stats_log(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Select Performance Log", "", "JSON Lines (*.jsonl)",
+                                              options=QFileDialog.Option.DontConfirmOverwrite)
+        if path:
+            self.stats_log_edit.setText(path)
+
+    def add_spill_dir(self):
+        folder = QFileDialog.getExistingDirectory(self, "Select Temporary Folder")
+        if folder:
+            self.spill_dirs_edit.setText(os.pathsep.join((self.spill_dirs() or []) + [folder]))
 
     def set_ui_processing_state(self, processing):
         self.cancel_button.setEnabled(processing)
+        if processing:
+            self.spill_totals = [0, 0]
+            self.status_label.setToolTip("")
         if not processing:
             self.update_button_states()
 
@@ -370,14 +785,49 @@ class FileMergerApp(QMainWindow):
     def update_progress(self, value):
         self.progress_bar.setValue(value)
 
+    def update_stats(self, stats):
+        if 'run' in stats:
+            self.spill_totals[0] += stats['raw_bytes']
+            self.spill_totals[1] += stats['stored_bytes']
+        elif 'mb_per_s' in stats:
+            text = describe_stage_stats(stats)
+            if 'plan' in stats:
+                # Kept as a tooltip, so the plan can still be checked once later stages replace the text
+                self.status_label.setToolTip(text)
+            if stats['stage'] == 'sort' and self.spill_totals[1]:
+                raw_mb, stored_mb = (size / (1024 * 1024) for size in self.spill_totals)
+                text += f", spilled as {stored_mb:.1f} MB ({raw_mb / stored_mb:.1f}x)"
+            if 'file' in stats:
+                text = f"{os.path.basename(stats['file'])} - {text}"
+            self.status_label.setText(text)
+
+    def on_file_deduplicated(self, path, status, detail):
+        self.dedup_results[path] = status
+        colors = {'succeeded': QColor('#2e7d32'), 'failed': QColor('#c62828'), 'skipped': QColor('#9e9e9e')}
+        self.file_model.set_status(path, status, colors[status])
+        done = len(self.dedup_results)
+        total = len(self.active_worker.sources)
+        self.status_label.setText(f"Deduplicating... {done} of {total} file(s) done.")
+
+    def on_file_skipped(self, path, original):
+        self.file_model.set_status(path, f"duplicate of {os.path.basename(original)}", QColor('#9e9e9e'))
+
     def on_process_complete(self, success, error_message):
         self.set_ui_processing_state(False)
         
         action = "Processing"
+        resumable = False
         if isinstance(self.active_worker, MergeThread):
             action = "Merging"
+            job_dir = self.active_worker.job_dir
+            # Refused merges and those that stopped before sorting anything (or never sorted) left nothing to resume
+            resumable = bool(job_dir) and read_job(job_dir) is not None and read_checkpoint(job_dir) is not None
+            if job_dir and not resumable:
+                discard_job(job_dir)
         elif isinstance(self.active_worker, DeduplicationThread):
             action = "Deduplication"
+        elif isinstance(self.active_worker, SetOperationThread):
+            action = "Comparison"
 
         if success:
             self.progress_bar.setValue(100)
@@ -385,11 +835,12 @@ class FileMergerApp(QMainWindow):
             self.status_label.setText(f"{action} completed successfully.")
             
             if action == "Merging" and self.cleanup_checkbox.isChecked():
-                self.file_list.clear()
+                self.file_model.clear()
                 self.update_button_states()
         else:
             if "cancelled" in error_message.lower():
-                self.status_label.setText(f"{action} cancelled.")
+                self.status_label.setText(f"{action} cancelled." + (" It can be resumed the next time File Merger "
+                                                                     "starts." if resumable else ""))
             else:
                 self.show_message("Error", f"An error occurred: {error_message}", QMessageBox.Icon.Critical)
                 self.status_label.setText("An error occurred.")
@@ -405,12 +856,20 @@ class FileMergerApp(QMainWindow):
             if reply == QMessageBox.StandardButton.Yes:
                 self.active_worker.stop()
                 self.active_worker.wait()
+                self.stop_scanning()
                 event.accept()
             else:
                 event.ignore()
         else:
+            self.stop_scanning()
             event.accept()
 
+    def stop_scanning(self):
+        for scanner in list(self.scan_workers):
+            scanner.stop()
+            scanner.wait()
+        self.file_model.finish_ordering()
+
     def show_message(self, title, message, icon):
         msg_box = QMessageBox(self)
         msg_box.setWindowTitle(title)
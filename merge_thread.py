@@ -1,83 +1,66 @@
-import os
-from PyQt6.QtCore import QThread, pyqtSignal
-
-class MergeThread(QThread):
-    progress = pyqtSignal(int)
-    finished = pyqtSignal(bool, str)
-
-    def __init__(self, sources, target, cleanup=False, deduplicate=False):
-        super().__init__()
-        self.sources = sources
-        self.target = target
-        self.cleanup = cleanup
-        self.deduplicate = deduplicate
-        self._active = True
-
-    def stop(self):
-        self._active = False
-
-    def run(self):
-        try:
-            target_abs = os.path.abspath(self.target)
-            sources_abs = [os.path.abspath(p) for p in self.sources]
-            
-            if target_abs in sources_abs:
-                raise ValueError("Target file cannot be one of the source files.")
-
-            total_size = sum(os.path.getsize(f) for f in self.sources)
-            processed_size = 0
-            last_progress = -1
-            
-            if self.deduplicate:
-                from utils import external_sort_deduplicate
-                success = external_sort_deduplicate(
-                    self.sources, 
-                    self.target, 
-                    progress_callback=self.progress.emit,
-                    active_check=lambda: self._active
-                )
-                if not success and self._active:
-                    raise Exception("An error occurred during deduplication.")
-            else:
-                processed_size = 0
-                last_progress = -1
-                total_size = sum(os.path.getsize(f) for f in self.sources)
-                
-                with open(self.target, 'wb') as outfile:
-                    for src in self.sources:
-                        if not self._active:
-                            break
-                        
-                        with open(src, 'rb') as infile:
-                            while self._active:
-                                chunk = infile.read(1024 * 1024)
-                                if not chunk:
-                                    break
-                                outfile.write(chunk)
-                                processed_size += len(chunk)
-                                progress = int((processed_size * 100) / total_size) if total_size > 0 else 100
-                                if progress != last_progress:
-                                    self.progress.emit(progress)
-                                    last_progress = progress
-                        
-
-
-            if not self._active:
-                if os.path.exists(self.target):
-                    try:
-                        os.remove(self.target)
-                    except:
-                        pass
-                self.finished.emit(False, "Merging cancelled by user.")
-                return
-            
-            if self.cleanup:
-                for src in self.sources:
-                    try:
-                        os.remove(src)
-                    except OSError as e:
-                        print(f"Warning: Could not delete {src}: {e}")
-            
-            self.finished.emit(True, "")
-        except Exception as e:
-            self.finished.emit(False, str(e))
\ No newline at end of file
+from PyQt6.QtCore import QThread, pyqtSignal
+
+class MergeThread(QThread):
+    progress = pyqtSignal(int)
+    stats = pyqtSignal(dict)
+    file_skipped = pyqtSignal(str, str)
+    finished = pyqtSignal(bool, str)
+
+    def __init__(self, sources, target, cleanup=False, deduplicate=False, workers=1, engine='sort', memory_budget=None, run_codec=None, spill_dirs=None, incremental=False, key_spec=None, index_interval=None, skip_identical=True, stats_log=None, output_codec=None, job_dir=None, shards=None):
+        super().__init__()
+        self.sources = sources
+        self.target = target
+        self.cleanup = cleanup
+        self.deduplicate = deduplicate
+        self.workers = workers
+        self.engine = engine
+        self.memory_budget = memory_budget
+        self.run_codec = run_codec
+        self.spill_dirs = spill_dirs
+        self.incremental = incremental
+        self.key_spec = key_spec
+        self.index_interval = index_interval
+        self.skip_identical = skip_identical
+        self.stats_log = stats_log
+        self.output_codec = output_codec
+        self.job_dir = job_dir
+        self.shards = shards
+        self._active = True
+
+    def stop(self):
+        self._active = False
+
+    def run(self):
+        try:
+            from engine import merge_files, stats_log
+            with stats_log(self.stats_log, self.stats.emit, 'merge') as stats_callback:
+                success = merge_files(
+                    self.sources,
+                    self.target,
+                    progress_callback=self.progress.emit,
+                    active_check=lambda: self._active,
+                    cleanup=self.cleanup,
+                    deduplicate=self.deduplicate,
+                    incremental=self.incremental,
+                    workers=self.workers,
+                    engine=self.engine,
+                    memory_budget=self.memory_budget,
+                    run_codec=self.run_codec,
+                    stats_callback=stats_callback,
+                    spill_dirs=self.spill_dirs,
+                    key_spec=self.key_spec,
+                    index_interval=self.index_interval,
+                    skip_identical=self.skip_identical,
+                    skipped_callback=self.file_skipped.emit,
+                    output_codec=self.output_codec,
+                    job_dir=self.job_dir,
+                    shards=self.shards
+                )
+
+            if not success:
+                self.finished.emit(False, "Merging cancelled by user.")
+                return
+
+            self.finished.emit(True, "")
+        except Exception as e:
+            self.finished.emit(False, str(e))
@@ -0,0 +1,44 @@
+from PyQt6.QtCore import QThread, pyqtSignal
+
+class SetOperationThread(QThread):
+    progress = pyqtSignal(int)
+    stats = pyqtSignal(dict)
+    finished = pyqtSignal(bool, str)
+
+    def __init__(self, operation, sources, target, workers=1, run_codec=None, spill_dirs=None, stats_log=None):
+        super().__init__()
+        self.operation = operation
+        self.sources = sources
+        self.target = target
+        self.workers = workers
+        self.run_codec = run_codec
+        self.spill_dirs = spill_dirs
+        self.stats_log = stats_log
+        self._active = True
+
+    def stop(self):
+        self._active = False
+
+    def run(self):
+        try:
+            from engine import combine_files, stats_log
+            with stats_log(self.stats_log, self.stats.emit, 'set') as stats_callback:
+                success = combine_files(
+                    self.operation,
+                    self.sources,
+                    self.target,
+                    progress_callback=self.progress.emit,
+                    active_check=lambda: self._active,
+                    workers=self.workers,
+                    run_codec=self.run_codec,
+                    stats_callback=stats_callback,
+                    spill_dirs=self.spill_dirs
+                )
+
+            if not success:
+                self.finished.emit(False, "Set operation cancelled by user.")
+                return
+
+            self.finished.emit(True, "")
+        except Exception as e:
+            self.finished.emit(False, str(e))
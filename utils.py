@@ -1,89 +1,2882 @@
 import os
+import bz2
+import errno
+import gzip
+import hashlib
 import heapq
+import io
+import json
+import lzma
+import math
+import mmap
+import re
+import shutil
+import signal
 import tempfile
-from PyQt6.QtCore import QObject
+import threading
+import time
+import zlib
+from bisect import bisect_left, bisect_right
+from collections import Counter, deque
+from itertools import accumulate
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
 
-def external_sort_deduplicate(input_files, output_file, progress_callback=None, active_check=None, chunk_size=64 * 1024 * 1024):
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+DEFAULT_MEMORY_BUDGET = 512 * 1024 * 1024
+DEFAULT_MAX_FAN_IN = 128
+
+# Read buffer per run during the merge phase, so each run is consumed in large sequential reads
+_MERGE_READ_BUFFER = 1024 * 1024
+
+# Sidecar sparse index of a sorted, unique file: a JSON header line, then every Nth line prefixed
+# with its byte offset in the same fixed-width hex as partitioned records
+SPARSE_INDEX_SUFFIX = '.index'
+DEFAULT_INDEX_INTERVAL = 1024
+
+# Pre-scan for byte-identical sources: files of equal size are compared by a hash of their first block,
+# then of their whole contents. Hashes are cached by path, size and mtime between runs
+_PRESCAN_HEAD_SIZE = 64 * 1024
+_HASH_CACHE_LIMIT = 100000
+
+# Seconds between two progress reports of one stage to stats_callback
+_STATS_INTERVAL = 0.5
+
+# Bytes read from the start of a file to estimate its line count from the average line length
+_LINE_SAMPLE_SIZE = 64 * 1024
+
+# Set operations over the distinct lines of several files
+SET_OPERATIONS = ('union', 'intersection', 'difference', 'symmetric_difference')
+
+# Sidecar written next to outputs known to be sorted and deduplicated
+SORTED_MARKER_SUFFIX = '.sorted.json'
+
+# Progress of a resumable external sort, kept in its job directory
+CHECKPOINT_FILE = 'checkpoint.json'
+
+# Input bytes merged per batch; each batch is written with one write() and checked for cancellation once
+_MERGE_BATCH_BYTES = 8 * 1024 * 1024
+_MERGE_MIN_BLOCK = 64 * 1024
+
+# Codecs for temporary runs, fastest first; 'zlib' is always available
+RUN_CODECS = ('zstd', 'lz4', 'zlib')
+
+# Compressed inputs are recognized by their magic bytes and decompressed as a stream
+_INPUT_MAGIC = (
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+)
+COMPRESSED_EXTENSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz', '.zst': 'zstd'}
+# Codecs for compressed output, written as independently compressed blocks on a thread pool
+OUTPUT_CODECS = ('gzip', 'bz2', 'xz', 'zstd')
+_OUTPUT_BLOCK_SIZE = 4 * 1024 * 1024
+# Assumed expansion of compressed inputs, for sizing spill space and hash partitions before they are read
+_COMPRESSED_INPUT_EXPANSION = 4
+
+# What the decompressors raise on corrupt or truncated data besides OSError (bz2 raises OSError itself)
+_DECOMPRESSION_ERRORS = (zlib.error, lzma.LZMAError, EOFError) + ((zstandard.ZstdError,) if zstandard else ())
+
+# Sharded output: how shards are cut, the manifest written next to them, the most hash shards
+# (each one an open file) and how many bytes may wait for the shard writers before producers block
+SHARD_MODES = ('size', 'lines', 'hash')
+SHARD_MANIFEST_SUFFIX = '.shards.json'
+_MAX_HASH_SHARDS = 256
+_SHARD_QUEUE_LIMIT = 64 * 1024 * 1024
+
+# Carriage returns at the end of a line, removed so CRLF and LF lines deduplicate together
+_TRAILING_CR = re.compile(rb'\r+(?=\n)|\r+\Z')
+# One line including its \n
+_LINE = re.compile(rb'[^\n]*\n')
+# Bytes scanned for newlines per step when indexing a chunk or scanning a mapped file
+_SCAN_BLOCK = 8 * 1024 * 1024
+# Lines joined per write() when writing a sorted run
+_WRITE_BLOCK_LINES = 65536
+
+# Copy granularity for plain concatenation: kernel-side copies can move much larger ranges per call
+_COPY_CHUNK_SIZE = 1024 * 1024
+_KERNEL_COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Spill estimates used by the free-space preflight: partitioned records carry a line index,
+# and compressed runs are assumed to shrink by at least half
+_PARTITION_SPILL_FACTOR = 1.5
+_COMPRESSED_SPILL_FACTOR = 0.5
+
+# Rough in-memory cost of a deduplication set relative to the raw line bytes it holds
+_SET_OVERHEAD = 3
+_MAX_PARTITIONS = 256
+# How many times a bucket still too large for the budget is split again. Past that, what keeps it large
+# is repeats of the same lines, which cost the set nothing extra
+_MAX_REPARTITION_DEPTH = 4
+
+# Engines deduplicate_files accepts; 'auto' lets plan_deduplication pick one of the others
+DEDUP_ENGINES = ('auto', 'sort', 'hash', 'memory')
+# Engine planning reads up to this much of the inputs, in windows spread over each file,
+# and counts its distinct lines in a HyperLogLog sketch of 2 ** _HLL_PRECISION registers
+_PLAN_SAMPLE_SIZE = 16 * 1024 * 1024
+_PLAN_SAMPLE_WINDOW = 1024 * 1024
+_HLL_PRECISION = 14
+# Memory held per line kept by the in-memory engine besides its bytes: the bytes object, its set slot
+# and allocator slack, as measured on CPython
+_MEMORY_ENTRY_OVERHEAD = 128
+# The in-memory engine hands over to the hash engine once it has used this much more than the budget
+_MEMORY_BUDGET_SLACK = 1.25
+
+# Fixed-width hex line index prefixed to partitioned records, so records sort by original position
+_INDEX_WIDTH = 16
+
+# Keyed records are stored as escaped key, separator, position and line, so they sort by key and then by
+# position. NUL bytes inside keys are escaped so the separator can't occur in them
+_KEY_SEPARATOR = b'\x00\x00'
+_KEY_NUL_ESCAPE = b'\x00\x01'
+# Lines without the key field are keyed on the whole line in a namespace no escaped key can start with
+_MISSING_FIELD_PREFIX = b'\x00\x02'
+_POSITION_WIDTH = 16
+_LAST_POSITION = 16 ** _POSITION_WIDTH - 1
+# Keyed records can repeat the line as their key, plus the separator and position
+_KEYED_SPILL_FACTOR = 2
+
+def parse_size(text):
+    """
+    Parses sizes like '512K', '64M' or '2G' (binary multiples) into bytes.
+    """
+    text = text.strip().upper().rstrip('B')
+    multipliers = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    if text and text[-1] in multipliers:
+        return int(float(text[:-1]) * multipliers[text[-1]])
+    return int(text)
+
+def estimate_line_count(path, size=None):
+    """
+    Estimates the number of lines in a file from the average line length of its first block.
+    Compressed files are estimated from the compressed bytes that block took up.
+    Returns (lines, exact), where exact is True when the whole file fit in that block.
+    Raises OSError for files that can't be read, including corrupt compressed files.
+    """
+    if size is None:
+        size = os.path.getsize(path)
+    codec = detect_compression(path)
+    if codec is None:
+        with open(path, 'rb') as f:
+            sample = f.read(_LINE_SAMPLE_SIZE)
+        complete = len(sample) >= size
+        consumed = len(sample)
+    else:
+        # Compressed bytes are fed in small steps, so it is known how many of them the sample took
+        if codec == 'zstd' and zstandard is None:
+            raise ValueError(f"{path} is zstd-compressed, but the zstandard package is not installed.")
+        decompressor = {
+            'gzip': lambda: zlib.decompressobj(zlib.MAX_WBITS | 16),
+            'bz2': bz2.BZ2Decompressor,
+            'xz': lzma.LZMADecompressor,
+            'zstd': lambda: zstandard.ZstdDecompressor().decompressobj(),
+        }[codec]()
+        sample = b''
+        consumed = 0
+        with open(path, 'rb') as f:
+            while len(sample) < _LINE_SAMPLE_SIZE:
+                data = f.read(16 * 1024)
+                if not data:
+                    break
+                consumed += len(data)
+                try:
+                    sample += decompressor.decompress(data)
+                except _DECOMPRESSION_ERRORS as e:
+                    raise OSError(f"{path} is not a valid {codec} file: {e}") from e
+        complete = consumed >= size
+        if complete and not decompressor.eof:
+            raise OSError(f"{path} is a truncated {codec} file.")
+    lines = sample.count(b'\n')
+    if complete:
+        # A last line without a newline still counts
+        return lines + (1 if sample and not sample.endswith(b'\n') else 0), True
+    if lines == 0:
+        return 1, False
+    return round(size * lines / max(consumed, 1)), False
+
+class KeySpec:
+    """
+    Deduplicates on one field instead of the whole line: field (counted from 0) of the line split on delimiter,
+    optionally stripped of surrounding whitespace and case-folded. Of the records sharing a key, keep='first'
+    keeps the earliest one in input order and keep='last' the latest one.
+    Lines with fewer fields are only deduplicated against identical lines.
+    """
+    def __init__(self, delimiter=':', field=0, casefold=False, strip=False, keep='first'):
+        if not delimiter:
+            raise ValueError("The key delimiter cannot be empty.")
+        if field < 0:
+            raise ValueError("The key field must be 0 or greater.")
+        if keep not in ('first', 'last'):
+            raise ValueError(f"Unknown keep policy: {keep}")
+        self.delimiter = delimiter.encode('utf-8', 'surrogateescape') if isinstance(delimiter, str) else delimiter
+        self.field = field
+        self.casefold = casefold
+        self.strip = strip
+        self.keep = keep
+
+    def to_dict(self):
+        """
+        Returns the spec as JSON-friendly options, which KeySpec(**options) turns back into it.
+        """
+        return {'delimiter': self.delimiter.decode('utf-8', 'surrogateescape'), 'field': self.field,
+                'casefold': self.casefold, 'strip': self.strip, 'keep': self.keep}
+
+    def extract(self, line):
+        """
+        Returns the escaped key of a line without its \n.
+        """
+        fields = line.split(self.delimiter, self.field + 1)
+        if len(fields) <= self.field:
+            return _MISSING_FIELD_PREFIX + line.replace(b'\x00', _KEY_NUL_ESCAPE)
+        key = fields[self.field]
+        if self.strip:
+            key = key.strip()
+        if self.casefold:
+            key = key.decode('utf-8', 'surrogateescape').casefold().encode('utf-8', 'surrogateescape')
+        if b'\x00' in key:
+            key = key.replace(b'\x00', _KEY_NUL_ESCAPE)
+        return key
+
+    def record(self, line, position):
+        """
+        Builds the stored record of a line: its key, then its position (inverted for keep='last',
+        so the record to keep always sorts first within its key), then the line itself.
+        """
+        if self.keep == 'last':
+            position = _LAST_POSITION - position
+        return b'%s%s%016x%s\n' % (self.extract(line), _KEY_SEPARATOR, position, line)
+
+def _record_key(record):
+    return record[:record.index(_KEY_SEPARATOR)]
+
+def _record_line(record):
+    return record[record.index(_KEY_SEPARATOR) + len(_KEY_SEPARATOR) + _POSITION_WIDTH:]
+
+def _ignore_interrupts():
+    # Pool processes leave Ctrl+C to the parent, which cancels through active_check
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def copy_input_chunks(path, outfile):
+    """
+    Appends a whole input file to outfile like copy_file_chunks, decompressing it if it is compressed,
+    and yields the input bytes consumed per chunk. Data is copied through Python when outfile is not
+    a plain file, e.g. compressed output.
+    """
+    codec = detect_compression(path)
+    if codec is not None:
+        for size, data in _stream_blocks(path, codec, _COPY_CHUNK_SIZE):
+            outfile.write(data)
+            yield size
+        return
+
+    with open(path, 'rb') as infile:
+        try:
+            outfile.fileno()
+        except (OSError, io.UnsupportedOperation):
+            while True:
+                data = infile.read(_COPY_CHUNK_SIZE)
+                if not data:
+                    return
+                outfile.write(data)
+                yield len(data)
+        yield from copy_file_chunks(infile, outfile)
+
+def _kernel_copy(copy_chunk, in_fd):
+    """
+    Drives a kernel-side copy primitive until the end of in_fd, yielding the bytes copied per call.
+    Stops quietly if the primitive is unsupported for these files, leaving the offsets where they are.
+    """
+    size = os.fstat(in_fd).st_size
+    while True:
+        try:
+            copied = copy_chunk()
+        except OSError as e:
+            if e.errno in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF):
+                return
+            raise
+        if copied == 0:
+            # Some filesystems report 0 before the real end of file; let the caller finish the copy
+            return
+        yield copied
+        if os.lseek(in_fd, 0, os.SEEK_CUR) >= size:
+            return
+
+def copy_file_chunks(infile, outfile):
+    """
+    Appends the rest of infile to outfile, yielding the number of bytes copied per chunk so the caller
+    can report progress and cancel between chunks. Uses os.copy_file_range (which can reflink on
+    filesystems like Btrfs and XFS) or os.sendfile so data stays in the kernel, and falls back to
+    buffered read()/write() when neither works for these files.
+    """
+    outfile.flush()
+    in_fd = infile.fileno()
+    out_fd = outfile.fileno()
+    infile.seek(0, os.SEEK_CUR)
+    outfile.seek(0, os.SEEK_CUR)
+
+    if hasattr(os, 'copy_file_range'):
+        yield from _kernel_copy(lambda: os.copy_file_range(in_fd, out_fd, _KERNEL_COPY_CHUNK_SIZE), in_fd)
+    if hasattr(os, 'sendfile'):
+        yield from _kernel_copy(lambda: os.sendfile(out_fd, in_fd, None, _KERNEL_COPY_CHUNK_SIZE), in_fd)
+
+    # Resync the buffered objects with whatever the kernel already copied
+    infile.seek(os.lseek(in_fd, 0, os.SEEK_CUR))
+    outfile.seek(os.lseek(out_fd, 0, os.SEEK_CUR))
+    while True:
+        chunk = infile.read(_COPY_CHUNK_SIZE)
+        if not chunk:
+            break
+        outfile.write(chunk)
+        yield len(chunk)
+
+def _split_line_ranges(path, chunk_size):
+    """
+    Splits a file into byte ranges of roughly chunk_size, each starting and ending on a line boundary.
+    """
+    size = os.path.getsize(path)
+    ranges = []
+    start = 0
+    with open(path, 'rb') as f:
+        while start < size:
+            end = start + chunk_size
+            if end >= size:
+                end = size
+            else:
+                # Move the boundary forward to the start of the next line
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def _normalize_chunk(data):
+    """
+    Normalizes a buffer of whole lines so every line ends with a bare \n, as one contiguous bytes object.
+    """
+    if b'\r' in data:
+        data = _TRAILING_CR.sub(b'', data)
+    if data and not data.endswith(b'\n'):
+        data += b'\n'
+    return data
+
+def _mapped_blocks(path, block_size=_SCAN_BLOCK):
+    """
+    Yields (raw size, block) over a whole file, each block holding whole lines normalized like _normalize_chunk.
+    The file is memory-mapped and cut at newlines with rfind, so lines are never read or copied one by one.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, 'madvise'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            start = 0
+            while start < size:
+                end = min(start + block_size, size)
+                if end < size:
+                    # Cut after the last newline in the block; a longer line extends it to its own end
+                    cut = mm.rfind(b'\n', start, end)
+                    if cut < 0:
+                        cut = mm.find(b'\n', end)
+                    end = size if cut < 0 else cut + 1
+                yield end - start, _normalize_chunk(mm[start:end])
+                start = end
+
+def detect_compression(path):
+    """
+    Returns the codec of a compressed file ('gzip', 'bz2', 'xz' or 'zstd') from its magic bytes, or None.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(6)
+    return next((codec for magic, codec in _INPUT_MAGIC if head.startswith(magic)), None)
+
+def _open_decompressed(path, codec):
+    """
+    Opens a compressed file as a stream of its decompressed bytes. Returns (stream, raw file);
+    the raw file's position tells how many compressed bytes have been consumed.
+    """
+    raw = open(path, 'rb')
+    try:
+        if codec == 'gzip':
+            return gzip.GzipFile(fileobj=raw, mode='rb'), raw
+        if codec == 'bz2':
+            return bz2.BZ2File(raw, 'rb'), raw
+        if codec == 'xz':
+            return lzma.LZMAFile(raw, 'rb'), raw
+        if zstandard is None:
+            raise ValueError(f"{path} is zstd-compressed, but the zstandard package is not installed.")
+        return zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True), raw
+    except BaseException:
+        raw.close()
+        raise
+
+def open_input(path):
+    """
+    Opens an input file for binary reading, decompressing it on the fly if it is compressed.
+    """
+    codec = detect_compression(path)
+    if codec is None:
+        return open(path, 'rb')
+    stream, _ = _open_decompressed(path, codec)
+    return io.BufferedReader(stream) if codec == 'zstd' else stream
+
+def _input_size_estimate(path):
+    size = os.path.getsize(path)
+    return size * _COMPRESSED_INPUT_EXPANSION if detect_compression(path) else size
+
+def _stream_blocks(path, codec, block_size=_SCAN_BLOCK):
+    """
+    Yields (compressed bytes consumed, block) over a compressed file, each block holding whole lines,
+    not yet normalized. Decompression runs in C, outside the GIL, so it overlaps with other threads.
+    """
+    stream, raw = _open_decompressed(path, codec)
+    with raw, stream:
+        carry = b''
+        consumed = 0
+        while True:
+            chunk = stream.read(block_size)
+            if not chunk:
+                if carry:
+                    yield raw.tell() - consumed, carry
+                return
+            data = carry + chunk
+            cut = data.rfind(b'\n') + 1
+            if cut == 0:
+                # No line ends in this block yet; keep reading until one does
+                carry = data
+                continue
+            carry = data[cut:]
+            position = raw.tell()
+            yield position - consumed, data[:cut]
+            consumed = position
+
+def _input_blocks(path, block_size=_SCAN_BLOCK):
+    """
+    Yields (input bytes consumed, block) like _mapped_blocks, decompressing compressed inputs as a stream;
+    their progress is counted in compressed bytes.
+    """
+    codec = detect_compression(path)
+    if codec is None:
+        yield from _mapped_blocks(path, block_size)
+        return
+    for size, data in _stream_blocks(path, codec, block_size):
+        yield size, _normalize_chunk(data)
+
+def _compress_block(codec, data):
+    if codec == 'gzip':
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    if codec == 'bz2':
+        return bz2.compress(data, 9)
+    if codec == 'xz':
+        return lzma.compress(data, preset=6)
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+class _ParallelCompressor(io.RawIOBase):
+    """
+    Raw writer compressing fixed-size blocks of its input independently on a thread pool, pigz-style,
+    and writing the compressed blocks in order. Concatenated gzip members, bzip2 and xz streams and
+    zstd frames all decompress as one file. At most two blocks per worker are in flight.
+    """
+    def __init__(self, path, codec, workers=None):
+        super().__init__()
+        self.codec = codec
+        self.file = open(path, 'wb')
+        self.pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        self.max_pending = 2 * self.pool._max_workers
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        while len(self.buffer) >= _OUTPUT_BLOCK_SIZE:
+            self._submit(bytes(self.buffer[:_OUTPUT_BLOCK_SIZE]))
+            del self.buffer[:_OUTPUT_BLOCK_SIZE]
+        return len(data)
+
+    def _submit(self, block):
+        while len(self.pending) >= self.max_pending:
+            self.file.write(self.pending.popleft().result())
+        self.pending.append(self.pool.submit(_compress_block, self.codec, block))
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.buffer or not self.position:
+                # An empty output still gets one (empty) block, so it is a valid compressed file
+                self._submit(bytes(self.buffer))
+                self.buffer = bytearray()
+            while self.pending:
+                self.file.write(self.pending.popleft().result())
+        finally:
+            for future in self.pending:
+                future.cancel()
+            self.pool.shutdown(wait=True)
+            self.file.close()
+            super().close()
+
+def open_output(path, codec=None, workers=None, shards=None, key_spec=None):
+    """
+    Opens an output file for binary writing, compressed with codec ('gzip', 'bz2', 'xz' or 'zstd') if given.
+    Compression is done in blocks on a thread pool of workers threads (the CPU count by default).
+    With shards (a ShardSpec), the output is split into shard files next to path instead, see ShardSpec;
+    hash shards are routed on key_spec's key if given.
+    """
+    if codec is not None and codec not in OUTPUT_CODECS:
+        raise ValueError(f"Unknown output codec: {codec}")
+    if codec == 'zstd' and zstandard is None:
+        raise ValueError("The 'zstd' output codec needs the zstandard package.")
+    if shards is not None:
+        return io.BufferedWriter(_ShardedWriter(path, shards, codec, workers, key_spec), _MERGE_READ_BUFFER)
+    if codec is None:
+        return open(path, 'wb')
+    return io.BufferedWriter(_ParallelCompressor(path, codec, workers), _MERGE_READ_BUFFER)
+
+def codec_for_path(path):
+    """
+    Returns the output codec implied by a file name's extension, e.g. 'gzip' for .gz, or None.
+    """
+    return COMPRESSED_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+class ShardSpec:
+    """
+    Splits an output into shard files written side by side instead of one file: by='size' starts a new shard
+    once one holds limit bytes, by='lines' once it holds limit lines, and by='hash' spreads the lines over
+    limit shards by a CRC-32 of each line (or of its key, when deduplicating on one), so that no line or key
+    is found in two shards. Shards only split between lines and each one ends with a newline, so size and
+    line shards of a sorted output cover consecutive key ranges.
+    Shard i of merged.txt.gz is merged-0000i.txt.gz, and shard_manifest_path(path) lists them all.
+    """
+    def __init__(self, by='size', limit=1024 * 1024 * 1024):
+        if by not in SHARD_MODES:
+            raise ValueError(f"Unknown shard mode: {by}")
+        if limit < 1:
+            raise ValueError("The shard limit must be 1 or greater.")
+        if by == 'hash' and limit > _MAX_HASH_SHARDS:
+            raise ValueError(f"At most {_MAX_HASH_SHARDS} hash shards are supported.")
+        self.by = by
+        self.limit = int(limit)
+
+    def to_dict(self):
+        """
+        Returns the spec as JSON-friendly options, which ShardSpec(**options) turns back into it.
+        """
+        return {'by': self.by, 'limit': self.limit}
+
+def shard_path(path, index):
+    """
+    Returns the path of shard index of the output path: its name with the shard number before the extension.
+    """
+    root, ext = os.path.splitext(path)
+    if ext.lower() in COMPRESSED_EXTENSIONS:
+        root, inner = os.path.splitext(root)
+        ext = inner + ext
+    return f"{root}-{index:05d}{ext}"
+
+def shard_manifest_path(path):
+    return path + SHARD_MANIFEST_SUFFIX
+
+def read_shard_manifest(path):
+    """
+    Returns the manifest of the shards written for the output path, or None if there is none.
+    Shard paths in it are made absolute again.
+    """
+    manifest_path = shard_manifest_path(path)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or manifest.get('format') != 'shards':
+        return None
+    folder = os.path.dirname(os.path.abspath(manifest_path))
+    for shard in manifest['shards']:
+        shard['path'] = os.path.join(folder, shard['path'])
+    return manifest
+
+def remove_shards(path):
+    """
+    Removes the shards listed in the manifest of the output path, then the manifest itself.
+    """
+    manifest = read_shard_manifest(path)
+    for shard in manifest['shards'] if manifest else ():
+        try:
+            os.remove(shard['path'])
+        except OSError:
+            pass
+    try:
+        os.remove(shard_manifest_path(path))
+    except OSError:
+        pass
+
+def _open_shard_stream(path, codec):
+    # Hash shards are all open at once, so they get one streaming compressor each rather than a block pool each
+    if codec == 'gzip':
+        return gzip.GzipFile(path, 'wb', compresslevel=6, mtime=0)
+    if codec == 'bz2':
+        return bz2.BZ2File(path, 'wb', compresslevel=9)
+    if codec == 'xz':
+        return lzma.LZMAFile(path, 'wb', preset=6)
+    return zstandard.ZstdCompressor(level=3).stream_writer(open(path, 'wb'), closefd=True)
+
+class _Shard:
+    def __init__(self, path, file):
+        self.path = path
+        self.file = file
+        self.lines = 0
+        self.bytes = 0
+        self.first = None
+        self.last = None
+        self.full = False
+        self.queue = deque()
+        self.writing = False
+        self.closing = False
+
+class _ShardedWriter(io.RawIOBase):
+    """
+    Raw writer splitting whole lines of its input into shards as described by a ShardSpec.
+    Each shard has its own queue, drained in order by one task at a time on a shared thread pool,
+    so shards are written (and compressed) concurrently while the producer routes the next lines;
+    it blocks once _SHARD_QUEUE_LIMIT bytes are queued. A shard that is full is closed in the background.
+    On close, the manifest is written next to path.
+    """
+    def __init__(self, path, spec, codec=None, workers=None, key_spec=None):
+        super().__init__()
+        # Shards of an earlier output at this path would otherwise mix with the new ones
+        remove_shards(path)
+        self.path = path
+        self.spec = spec
+        self.codec = codec
+        self.workers = workers
+        self.key_spec = key_spec if spec.by == 'hash' else None
+        self.pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        self.condition = threading.Condition()
+        self.queued = 0
+        self.error = None
+        self.carry = b''
+        self.position = 0
+        self.shards = []
+        if spec.by == 'hash':
+            for _ in range(spec.limit):
+                self._new_shard()
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def _new_shard(self):
+        path = shard_path(self.path, len(self.shards))
+        if self.spec.by == 'hash' and self.codec is not None:
+            file = _open_shard_stream(path, self.codec)
+        else:
+            file = open_output(path, self.codec, self.workers)
+        shard = _Shard(path, file)
+        self.shards.append(shard)
+        return shard
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def write(self, data):
+        self._check()
+        size = len(data)
+        self.position += size
+        data = self.carry + bytes(data) if self.carry else bytes(data)
+        cut = data.rfind(b'\n') + 1
+        self.carry = data[cut:]
+        if cut:
+            self._route(data if cut == len(data) else data[:cut])
+        return size
+
+    def _route(self, data):
+        if self.spec.by == 'hash':
+            self._route_hashed(data)
+            return
+
+        start = 0
+        while start < len(data):
+            shard = self.shards[-1] if self.shards else None
+            if shard is None or shard.full:
+                if shard is not None:
+                    self._enqueue(shard, None)
+                shard = self._new_shard()
+            if self.spec.by == 'size':
+                room = self.spec.limit - shard.bytes
+                if len(data) - start <= room:
+                    end = len(data)
+                else:
+                    end = data.rfind(b'\n', start, start + room) + 1
+                    if end <= start:
+                        if shard.bytes:
+                            # The next line doesn't fit: it starts the next shard
+                            shard.full = True
+                            continue
+                        # A line longer than a whole shard gets a shard of its own
+                        end = data.find(b'\n', start) + 1
+            else:
+                room = self.spec.limit - shard.lines
+                end = start
+                if data.count(b'\n', start) <= room:
+                    end = len(data)
+                else:
+                    for _ in range(room):
+                        end = data.find(b'\n', end) + 1
+            piece = data if start == 0 and end == len(data) else data[start:end]
+            if shard.first is None:
+                shard.first = piece[:piece.index(b'\n')]
+            shard.last = piece[piece.rfind(b'\n', 0, len(piece) - 1) + 1:-1]
+            shard.lines += piece.count(b'\n')
+            shard.bytes += len(piece)
+            shard.full = (shard.bytes if self.spec.by == 'size' else shard.lines) >= self.spec.limit
+            self._enqueue(shard, piece)
+            start = end
+
+    def _route_hashed(self, data):
+        lines = data.split(b'\n')
+        lines.pop()
+        count = len(self.shards)
+        buckets = [[] for _ in range(count)]
+        if self.key_spec is None:
+            for line in lines:
+                buckets[zlib.crc32(line) % count].append(line)
+        else:
+            extract = self.key_spec.extract
+            for line in lines:
+                buckets[zlib.crc32(extract(line)) % count].append(line)
+        del lines
+        for shard, bucket in zip(self.shards, buckets):
+            if not bucket:
+                continue
+            piece = b'\n'.join(bucket) + b'\n'
+            if shard.first is None:
+                shard.first = bucket[0]
+            shard.last = bucket[-1]
+            shard.lines += len(bucket)
+            shard.bytes += len(piece)
+            self._enqueue(shard, piece)
+
+    def _enqueue(self, shard, piece):
+        # None closes the shard once everything queued before it is written
+        with self.condition:
+            while self.queued > _SHARD_QUEUE_LIMIT and self.error is None:
+                self.condition.wait()
+            self._check()
+            if piece is None:
+                shard.closing = True
+            else:
+                self.queued += len(piece)
+            shard.queue.append(piece)
+            if shard.writing:
+                return
+            shard.writing = True
+        self.pool.submit(self._drain, shard)
+
+    def _drain(self, shard):
+        try:
+            while True:
+                with self.condition:
+                    if not shard.queue:
+                        shard.writing = False
+                        self.condition.notify_all()
+                        return
+                    piece = shard.queue.popleft()
+                if piece is None:
+                    shard.file.close()
+                    continue
+                shard.file.write(piece)
+                with self.condition:
+                    self.queued -= len(piece)
+                    self.condition.notify_all()
+        except BaseException as e:
+            with self.condition:
+                if self.error is None:
+                    self.error = e
+                shard.queue.clear()
+                shard.writing = False
+                self.condition.notify_all()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.error is None:
+                if self.carry:
+                    # The last line gets its newline, so shards never end halfway through a line
+                    self._route(self.carry + b'\n')
+                    self.carry = b''
+                if not self.shards:
+                    self._new_shard()
+                for shard in self.shards:
+                    if not shard.closing:
+                        self._enqueue(shard, None)
+                with self.condition:
+                    while any(shard.writing for shard in self.shards) and self.error is None:
+                        self.condition.wait()
+            self._check()
+            self._write_manifest()
+        finally:
+            self.pool.shutdown(wait=True)
+            for shard in self.shards:
+                try:
+                    shard.file.close()
+                except:
+                    pass
+            super().close()
+
+    def _write_manifest(self):
+        shards = []
+        offset = 0
+        for shard in self.shards:
+            shards.append({
+                'path': os.path.basename(shard.path),
+                'lines': shard.lines,
+                'offset': offset,
+                'bytes': shard.bytes,
+                'first': shard.first.decode('utf-8', 'surrogateescape') if shard.first is not None else None,
+                'last': shard.last.decode('utf-8', 'surrogateescape') if shard.last is not None else None,
+            })
+            offset += shard.bytes
+        manifest = {
+            'format': 'shards',
+            'by': self.spec.by,
+            'limit': self.spec.limit,
+            'key': self.key_spec.to_dict() if self.key_spec is not None else None,
+            'codec': self.codec,
+            'lines': sum(shard.lines for shard in self.shards),
+            'bytes': offset,
+            'shards': shards,
+        }
+        manifest_path = shard_manifest_path(self.path)
+        temp_path = manifest_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(temp_path, manifest_path)
+
+def _line_word(buf, starts, lengths, offset):
+    """
+    Packs bytes [offset, offset + 8) of each line, including its \n, into big-endian uint64 sort keys padded with zeros.
+    """
+    word = np.zeros(len(starts), dtype=np.uint64)
+    index = np.empty_like(starts)
+    last_index = len(buf) - 1
+    for i in range(offset, offset + 8):
+        np.add(starts, i, out=index)
+        np.minimum(index, last_index, out=index)
+        byte = buf.take(index)
+        byte[lengths < i] = 0
+        word <<= np.uint64(8)
+        word |= byte
+    return word
+
+def _unique_sorted_blocks(data):
+    """
+    Yields the sorted, deduplicated lines of a normalized buffer as blocks of bytes ready to be written.
+    With NumPy the chunk stays one contiguous buffer plus offset and sort-key arrays, so memory
+    stays close to the chunk size; otherwise the lines are sorted as a list of bytes objects.
+    """
+    if np is None:
+        lines = _LINE.findall(data)
+        lines.sort()
+
+        # Remove duplicates in-memory for this chunk to reduce disk usage
+        block = []
+        last_line = None
+        for line in lines:
+            if line != last_line:
+                block.append(line)
+                last_line = line
+                if len(block) >= _WRITE_BLOCK_LINES:
+                    yield b''.join(block)
+                    block = []
+        if block:
+            yield b''.join(block)
+        return
+
+    buf = np.frombuffer(data, dtype=np.uint8)
+
+    # Offsets fit in 32 bits for any realistic chunk size
+    offset_type = np.uint32 if len(data) < 2 ** 32 else np.uint64
+    # Scan for newlines in slices to avoid a full-size temporary mask
+    ends = np.concatenate([np.flatnonzero(buf[i:i + _SCAN_BLOCK] == 10).astype(offset_type) + offset_type(i)
+                           for i in range(0, len(buf), _SCAN_BLOCK)])
+    count = len(ends)
+    if count == 0:
+        return
+
+    starts = np.empty(count, dtype=offset_type)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    lengths = ends - starts
+    del ends
+
+    # Sort on the first 8 bytes of each line, then refine groups of equal prefixes 8 bytes at a time.
+    # Keys include the \n and are padded with zeros, so runs come out in the order the merge phase compares lines
+    word = _line_word(buf, starts, lengths, 0)
+    order = np.argsort(word, kind='stable').astype(offset_type)
+    sorted_word = word[order]
+    del word
+    # tie[p] is set while sorted lines p and p + 1 are equal as far as they have been compared
+    tie = sorted_word[1:] == sorted_word[:-1]
+    del sorted_word
+
+    offset = 8
+    while tie.any():
+        # Groups still to refine have more than one line and a line that continues past the compared prefix
+        group_starts = np.concatenate(([0], np.flatnonzero(~tie) + 1))
+        group_sizes = np.diff(np.append(group_starts, count))
+        unresolved = (group_sizes > 1) & (np.maximum.reduceat(lengths[order], group_starts) >= offset)
+        positions = np.flatnonzero(np.repeat(unresolved, group_sizes)).astype(offset_type)
+        del group_starts, group_sizes, unresolved
+        if len(positions) == 0:
+            break
+
+        # Consecutive positions belong to the same group unless the pair was not tied
+        same_group = (positions[1:] == positions[:-1] + 1) & tie[positions[:-1]]
+        member_groups = np.zeros(len(positions), dtype=offset_type)
+        np.cumsum(~same_group, out=member_groups[1:])
+
+        members = order[positions]
+        word = _line_word(buf, starts[members], lengths[members], offset)
+        refined = np.lexsort((word, member_groups))
+        order[positions] = members[refined]
+        word = word[refined]
+        del members, member_groups, refined
+
+        tie[positions[:-1][same_group]] = (word[1:] == word[:-1])[same_group]
+        del positions, same_group, word
+        offset += 8
+
+    # Lines still tied were compared through their \n, so they are identical
+    keep = np.ones(count, dtype=bool)
+    keep[1:] = ~tie
+    order = order[keep]
+    del tie, keep
+
+    for block_start in range(0, len(order), _WRITE_BLOCK_LINES):
+        block = order[block_start:block_start + _WRITE_BLOCK_LINES]
+        yield b''.join([data[s:s + n + 1] for s, n in zip(starts[block].tolist(), lengths[block].tolist())])
+
+def _keyed_sorted_blocks(data, key_spec, position):
+    """
+    Yields the keyed records of a normalized buffer, sorted and reduced to the record to keep per key,
+    as blocks of bytes ready to be written. position is where the buffer starts in the whole input.
+    """
+    lines = data.split(b'\n')
+    lines.pop()
+    records = []
+    for line in lines:
+        records.append(key_spec.record(line, position))
+        position += len(line) + 1
+    del lines
+    records.sort()
+
+    block = []
+    last_key = None
+    for record in records:
+        key = _record_key(record)
+        if key != last_key:
+            block.append(record)
+            last_key = key
+            if len(block) >= _WRITE_BLOCK_LINES:
+                yield b''.join(block)
+                block = []
+    if block:
+        yield b''.join(block)
+
+def _sorted_blocks(data, key_spec=None, position=0):
+    if key_spec is None:
+        return _unique_sorted_blocks(data)
+    return _keyed_sorted_blocks(data, key_spec, position)
+
+def _resolve_run_codec(codec):
+    """
+    Validates a run codec name. 'auto' picks the fastest codec installed, None disables compression.
+    """
+    available = {'zstd': zstandard is not None, 'lz4': lz4 is not None, 'zlib': True}
+    if codec == 'auto':
+        return next(name for name in RUN_CODECS if available[name])
+    if codec is not None and codec not in available:
+        raise ValueError(f"Unknown run codec: {codec}")
+    if codec is not None and not available[codec]:
+        raise ValueError(f"The '{codec}' run codec is not installed.")
+    return codec
+
+def _new_run_name(spill_dir=None):
+    fd, name = tempfile.mkstemp(suffix='.tmp', dir=spill_dir)
+    os.close(fd)
+    return name
+
+def _spill_dir_for(spill_dirs, index):
+    """
+    Picks spill directories round-robin, so runs are striped across all of them.
+    """
+    return spill_dirs[index % len(spill_dirs)] if spill_dirs else None
+
+def _check_spill_space(required, spill_dirs):
+    """
+    Refuses to start a job when the spill directories can't hold about `required` bytes,
+    spread evenly across them. Directories on the same filesystem share its free space.
+    """
+    dirs = spill_dirs or [tempfile.gettempdir()]
+    share = required / len(dirs)
+    needed = {}
+    for spill_dir in dirs:
+        device = os.stat(spill_dir).st_dev
+        first_dir, size = needed.get(device, (spill_dir, 0))
+        needed[device] = (first_dir, size + share)
+
+    for spill_dir, size in needed.values():
+        free = shutil.disk_usage(spill_dir).free
+        if free < size:
+            raise OSError(errno.ENOSPC, f"Not enough free space in {spill_dir}: about {size / (1024 * 1024):.0f} MB "
+                                        f"of temporary space is needed, {free / (1024 * 1024):.0f} MB is available.")
+
+def _open_run(name, mode, codec=None):
+    """
+    Opens a temporary run for writing ('wb') or buffered line reading ('rb'), compressing it with a fast streaming codec.
+    """
+    if codec is None:
+        return open(name, mode, buffering=_MERGE_READ_BUFFER)
+    if codec == 'zstd':
+        f = zstandard.open(name, mode, cctx=zstandard.ZstdCompressor(level=1))
+    elif codec == 'lz4':
+        f = lz4.frame.open(name, mode)
+    else:
+        f = gzip.open(name, mode, compresslevel=1)
+    if 'r' in mode:
+        return io.BufferedReader(f, _MERGE_READ_BUFFER)
+    return f
+
+def _read_range(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start)
+
+def _write_run(blocks, codec=None, spill_dir=None):
+    """
+    Writes blocks of sorted lines to a new temporary run.
+    Returns the run's file name, its uncompressed size, its size on disk and its line count.
+    """
+    name = _new_run_name(spill_dir)
+    raw_size = 0
+    lines = 0
+    try:
+        with _open_run(name, 'wb', codec) as tmp:
+            for block in blocks:
+                tmp.write(block)
+                raw_size += len(block)
+                lines += block.count(b'\n')
+    except BaseException:
+        # A failed run never reaches the caller, so remove it here
+        os.remove(name)
+        raise
+    return name, raw_size, os.path.getsize(name), lines
+
+def _input_chunks(input_files, chunk_size):
+    """
+    Yields the chunks the sort phase turns into runs, in input order, as (input bytes, position, task).
+    position is where the chunk starts in the concatenated inputs, so keyed records know their input order.
+    task is a line-aligned (path, start, end) byte range of an uncompressed input, read where it is sorted,
+    or the whole lines decompressed from a compressed input, whose input bytes are compressed bytes.
+    """
+    offset = 0
+    for path in input_files:
+        codec = detect_compression(path)
+        if codec is None:
+            for start, end in _split_line_ranges(path, chunk_size):
+                yield end - start, offset + start, (path, start, end)
+            offset += os.path.getsize(path)
+        else:
+            for size, data in _stream_blocks(path, codec, chunk_size):
+                yield size, offset, data
+                offset += len(data)
+
+def _load_chunk(task):
+    return _read_range(*task) if isinstance(task, tuple) else task
+
+def _chunk_extent(position, task):
+    """
+    Returns the (start, end) range a chunk from _input_chunks covers in the concatenated inputs.
+    """
+    return position, position + (task[2] - task[1] if isinstance(task, tuple) else len(task))
+
+def _unsorted_chunks(chunks, checkpoint):
+    """
+    Passes on the chunks from _input_chunks that a SortCheckpoint holds no run for yet.
+    """
+    try:
+        for size, position, task in chunks:
+            if not checkpoint.is_sorted(_chunk_extent(position, task)):
+                yield size, position, task
+    finally:
+        chunks.close()
+
+def _sort_chunk_to_run(task, codec=None, spill_dir=None, key_spec=None, position=0):
+    """
+    Sorts and deduplicates the lines of a chunk from _input_chunks and writes them to a temporary run.
+    With a key_spec the run holds keyed records instead, position being where the chunk starts in the whole input.
+    Returns the run's file name, its uncompressed size, its size on disk, its line count and the chunk's line count.
+    Runs in worker processes, so it must stay importable at module level.
+    """
+    data = _load_chunk(task)
+
+    # Normalize lines (ensure they end with \n) before sorting for consistent deduplication
+    data = _normalize_chunk(data)
+    lines_in = data.count(b'\n')
+
+    # Store sorted run in a temporary file
+    return _write_run(_sorted_blocks(data, key_spec, position), codec, spill_dir) + (lines_in,)
+
+def _pipelined_runs(chunks, codec=None, spill_dirs=None, active_check=None, key_spec=None):
+    """
+    Sorts each chunk from _input_chunks into a run like _sort_chunk_to_run, overlapping I/O with sorting:
+    a reader thread fetches (and decompresses) the next chunk and a writer thread writes the previous run
+    while the current chunk is sorted. With one buffer on each side, about four chunk sizes are in memory at once.
+    Yields (input bytes, extent, run) in input order, extent being the chunk's range from _chunk_extent,
+    and stops early once active_check fails.
+    """
+    def fetch():
+        item = next(chunks, None)
+        if item is None:
+            return None
+        size, position, task = item
+        return size, _chunk_extent(position, task), _load_chunk(task)
+
+    try:
+        with ThreadPoolExecutor(max_workers=1) as reader, ThreadPoolExecutor(max_workers=1) as writer:
+            reads = deque()
+            writes = deque()
+            try:
+                reads.append(reader.submit(fetch))
+                i = 0
+                while True:
+                    if active_check and not active_check():
+                        return
+                    item = reads.popleft().result()
+                    if item is None:
+                        break
+                    reads.append(reader.submit(fetch))
+                    size, extent, data = item
+                    position = extent[0]
+
+                    # The sorted blocks are taken out of the chunk before handing them over, so it can be freed
+                    data = _normalize_chunk(data)
+                    lines_in = data.count(b'\n')
+                    blocks = list(_sorted_blocks(data, key_spec, position))
+                    del data, item
+
+                    # Wait for the previous run before queueing this one, so only one run waits for the disk
+                    while writes:
+                        size_done, extent_done, lines, future = writes.popleft()
+                        yield size_done, extent_done, future.result() + (lines,)
+                    writes.append((size, extent, lines_in,
+                                   writer.submit(_write_run, blocks, codec, _spill_dir_for(spill_dirs, i))))
+                    del blocks
+                    i += 1
+
+                while writes:
+                    size_done, extent_done, lines, future = writes.popleft()
+                    yield size_done, extent_done, future.result() + (lines,)
+            finally:
+                # Stopped early or failed: discard read-ahead data and remove runs nobody will report
+                for future in reads:
+                    future.cancel()
+                for _, _, _, future in writes:
+                    try:
+                        os.remove(future.result()[0])
+                    except:
+                        pass
+    finally:
+        # Only once the reader thread is done with it, close the input (and any decompressor) it was reading
+        chunks.close()
+
+def _aligned_blocks(sorted_files):
+    """
+    Lazily walks sorted, deduplicated line files side by side, yielding for consecutive ranges of lines
+    one list per file with its lines in that range. Each round reads a block of lines from every file
+    and cuts everything at the smallest block's last line, which no later line can precede,
+    so all copies of a line always arrive in the same round.
+    """
+    block_hint = max(_MERGE_MIN_BLOCK, _MERGE_BATCH_BYTES // max(1, len(sorted_files)))
+    blocks = [[] for _ in sorted_files]
+    active = list(range(len(sorted_files)))
+    while True:
+        for i in list(active):
+            if not blocks[i]:
+                blocks[i] = sorted_files[i].readlines(block_hint)
+                if not blocks[i]:
+                    active.remove(i)
+        if not active:
+            return
+
+        bound = min(blocks[i][-1] for i in active)
+        parts = [[] for _ in sorted_files]
+        for i in active:
+            block = blocks[i]
+            cut = bisect_right(block, bound)
+            if cut == len(block):
+                parts[i] = block
+                blocks[i] = []
+            elif cut:
+                parts[i] = block[:cut]
+                blocks[i] = block[cut:]
+        yield parts
+
+def _merged_batches(sorted_files):
+    """
+    Lazily merges sorted line files, yielding sorted batches of lines.
+    Sorting the concatenation of the aligned sorted blocks is a C-level merge,
+    far cheaper than pulling lines one at a time through heapq.merge.
+    """
+    for parts in _aligned_blocks(sorted_files):
+        batch = []
+        for part in parts:
+            batch += part
+        batch.sort()
+        yield batch
+
+def _merge_runs(run_names, out_f, active_check=None, codec=None, presorted_files=(), consumed_callback=None, keyed=False, strip_keys=False, index_builder=None):
+    """
+    Merges sorted runs, plus any uncompressed presorted files, into out_f, dropping duplicate lines.
+    With keyed runs, only the first record of each key is kept, and strip_keys writes just its line.
+    An index_builder is fed every written batch, to index the output as it is written.
+    Works in batches of lines: each batch is deduplicated, written in one call and followed by a single
+    cancellation check, and consumed_callback receives the bytes and lines it consumed and the bytes and
+    lines it wrote. Returns False if cancelled.
+    """
+    opened_runs = [_open_run(name, 'rb', codec) for name in run_names]
+    opened_runs += [_open_run(name, 'rb') for name in presorted_files]
+    try:
+        last_written_line = None
+        last_key = None
+        for lines in _merged_batches(opened_runs):
+            if keyed:
+                # Records sort by key and then by preference, so the first record of each key is the one to keep
+                unique_lines = []
+                for record in lines:
+                    key = _record_key(record)
+                    if key != last_key:
+                        unique_lines.append(_record_line(record) if strip_keys else record)
+                        last_key = key
+            else:
+                # Duplicates are adjacent in merged order, so dict.fromkeys drops them in one C-level pass
+                unique_lines = list(dict.fromkeys(lines))
+                if unique_lines[0] == last_written_line:
+                    del unique_lines[0]
+            written = 0
+            if unique_lines:
+                data = b''.join(unique_lines)
+                out_f.write(data)
+                written = len(data)
+                if index_builder:
+                    index_builder.add(unique_lines, data)
+                last_written_line = unique_lines[-1]
+
+            if consumed_callback:
+                consumed_callback(sum(map(len, lines)), len(lines), written, len(unique_lines))
+            if active_check and not active_check():
+                return False
+    finally:
+        for f in opened_runs:
+            f.close()
+    return True
+
+class StageTelemetry:
+    """
+    Counts what one stage of a job reads and writes and reports it to stats_callback as a dict, at most
+    every interval seconds: bytes_read, bytes_written, lines_in, lines_out, duplicates (lines_in - lines_out),
+    any other counter or value given to update() or set() (runs, fan_in...), elapsed seconds, mb_per_s read,
+    and the eta in seconds of the stage from the bytes left to read out of total_bytes (None until known).
+    done() reports the final figures with 'done': True and the stage's 'seconds'.
+    """
+    def __init__(self, stats_callback, stage, total_bytes=0, interval=_STATS_INTERVAL):
+        self.stats_callback = stats_callback
+        self.stage = stage
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.counters = {'bytes_read': 0, 'bytes_written': 0, 'lines_in': 0, 'lines_out': 0}
+        self.values = {}
+
+    def update(self, **counts):
+        for name, count in counts.items():
+            self.counters[name] = self.counters.get(name, 0) + count
+        now = time.monotonic()
+        if self.stats_callback and now - self.last_report >= self.interval:
+            self.last_report = now
+            self.stats_callback(self.snapshot(now))
+
+    def set(self, **values):
+        self.values.update(values)
+
+    def snapshot(self, now=None):
+        elapsed = (now or time.monotonic()) - self.started
+        bytes_read = self.counters['bytes_read']
+        rate = bytes_read / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if rate > 0 and self.total_bytes:
+            eta = max(0.0, (self.total_bytes - bytes_read) / rate)
+        return {
+            'stage': self.stage,
+            **self.counters,
+            **self.values,
+            'duplicates': max(0, self.counters['lines_in'] - self.counters['lines_out']),
+            'total_bytes': self.total_bytes,
+            'elapsed': elapsed,
+            'mb_per_s': rate / (1024 * 1024),
+            'eta': eta,
+        }
+
+    def done(self):
+        if self.stats_callback:
+            stats = self.snapshot()
+            stats.update({'done': True, 'seconds': stats['elapsed'], 'eta': 0.0})
+            self.stats_callback(stats)
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+def describe_stage_stats(stats):
+    """
+    Summarizes a StageTelemetry report in one line for a status bar.
+    """
+    if 'plan' in stats:
+        return (f"Plan: {stats['plan']} engine for about {stats['estimated_lines']:,} lines, "
+                f"{stats['estimated_distinct']:,} distinct - {stats['reason']}")
+    parts = [f"{stats['bytes_read'] / (1024 * 1024):,.1f} MB read at {stats['mb_per_s']:.1f} MB/s"]
+    if stats['duplicates']:
+        parts.append(f"{stats['duplicates']:,} duplicates removed")
+    if stats.get('runs'):
+        parts.append(f"{stats['runs']} run{'s' if stats['runs'] != 1 else ''}")
+    if stats.get('resumed_runs'):
+        parts.append(f"{stats['resumed_runs']} resumed from a checkpoint")
+    if stats.get('fan_in'):
+        parts.append(f"fan-in {stats['fan_in']}")
+    if stats.get('done'):
+        parts.append(f"done in {_format_duration(stats['seconds'])}")
+    elif stats['eta'] is not None:
+        parts.append(f"ETA {_format_duration(stats['eta'])}")
+    return f"{stats['stage'].capitalize()}: " + ", ".join(parts)
+
+def _sorted_marker_path(path):
+    return path + SORTED_MARKER_SUFFIX
+
+def write_sorted_marker(path):
+    """
+    Writes a sidecar marker recording that path is sorted and free of duplicates, as of its current size and mtime.
+    """
+    st = os.stat(path)
+    with open(_sorted_marker_path(path), 'w') as f:
+        json.dump({'format': 'sorted-unique', 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}, f)
+
+def is_sorted_unique(path):
+    """
+    Returns True if path has a sorted marker that still matches the file, i.e. it was not modified since.
+    """
+    try:
+        with open(_sorted_marker_path(path)) as f:
+            marker = json.load(f)
+        st = os.stat(path)
+    except (OSError, ValueError):
+        return False
+    return (isinstance(marker, dict) and marker.get('format') == 'sorted-unique'
+            and marker.get('size') == st.st_size and marker.get('mtime_ns') == st.st_mtime_ns)
+
+def sparse_index_path(path):
+    return path + SPARSE_INDEX_SUFFIX
+
+class SparseIndexBuilder:
+    """
+    Collects every interval-th line of a sorted, unique file and its byte offset as the file is written,
+    along with the line count and a CRC-32 of the contents, then writes them as the file's sparse index.
+    """
+    def __init__(self, interval=DEFAULT_INDEX_INTERVAL):
+        if interval < 1:
+            raise ValueError("The index interval must be at least 1.")
+        self.interval = interval
+        self.entries = []
+        self.line_count = 0
+        self.size = 0
+        self.checksum = 0
+
+    def add(self, lines, data):
+        """
+        Records a batch of lines written to the file; data is their concatenation.
+        """
+        first = -self.line_count % self.interval
+        if first < len(lines):
+            ends = list(accumulate(map(len, lines[:-1])))
+            for k in range(first, len(lines), self.interval):
+                self.entries.append(b'%016x%s' % (self.size + (ends[k - 1] if k else 0), lines[k]))
+        self.line_count += len(lines)
+        self.size += len(data)
+        self.checksum = zlib.crc32(data, self.checksum)
+
+    def write(self, path):
+        """
+        Writes the index for path, which must be the complete file the lines were added from.
+        """
+        st = os.stat(path)
+        header = {'format': 'sparse-index', 'interval': self.interval, 'lines': self.line_count,
+                  'checksum': f'{self.checksum:08x}', 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        with open(sparse_index_path(path), 'wb') as f:
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            for block_start in range(0, len(self.entries), _WRITE_BLOCK_LINES):
+                f.write(b''.join(self.entries[block_start:block_start + _WRITE_BLOCK_LINES]))
+
+def build_sparse_index(path, interval=DEFAULT_INDEX_INTERVAL, active_check=None):
+    """
+    Writes the sparse index of an existing file in one sequential pass, checking on the way that it is sorted
+    and free of duplicates; raises ValueError if it isn't. Returns False if cancelled.
+    """
+    if detect_compression(path):
+        raise ValueError(f"{path} is compressed; lookups need an uncompressed file.")
+    builder = SparseIndexBuilder(interval)
+    last_line = None
+    with open(path, 'rb') as f:
+        while True:
+            if active_check and not active_check():
+                return False
+            lines = f.readlines(_MERGE_BATCH_BYTES)
+            if not lines:
+                break
+            if not lines[-1].endswith(b'\n') or any(line.endswith(b'\r\n') for line in lines):
+                raise ValueError(f"{os.path.basename(path)} is not normalized: only files written by the sorted engine can be indexed.")
+            if (last_line is not None and lines[0] <= last_line) or any(a >= b for a, b in zip(lines, lines[1:])):
+                raise ValueError(f"{os.path.basename(path)} is not sorted and deduplicated.")
+            builder.add(lines, b''.join(lines))
+            last_line = lines[-1]
+    builder.write(path)
+    return True
+
+def _normalize_query(line):
+    if isinstance(line, str):
+        line = line.encode('utf-8')
+    return line.rstrip(b'\r\n') + b'\n'
+
+class SortedFileIndex:
+    """
+    Answers membership and prefix queries on a sorted, unique file through its sparse index: a binary search
+    over the indexed lines picks the one block that can hold the answer, which is then searched in the
+    memory-mapped file. Raises ValueError if the index is missing, damaged or older than the file; unless verify
+    is False, the file is also read once to check it against the index's CRC-32, which catches a file rewritten
+    with the same size and mtime. Use as a context manager, or call close().
+    """
+    def __init__(self, path, verify=True):
+        self.path = path
+        try:
+            with open(sparse_index_path(path), 'rb') as f:
+                header = json.loads(f.readline())
+                entries = f.read().splitlines(keepends=True)
+            st = os.stat(path)
+        except FileNotFoundError:
+            raise ValueError(f"{os.path.basename(path)} has no lookup index.")
+        except ValueError:
+            raise ValueError(f"The lookup index of {os.path.basename(path)} is damaged.")
+        if not (isinstance(header, dict) and header.get('format') == 'sparse-index'):
+            raise ValueError(f"The lookup index of {os.path.basename(path)} is damaged.")
+        if header.get('size') != st.st_size or header.get('mtime_ns') != st.st_mtime_ns:
+            raise ValueError(f"The lookup index of {os.path.basename(path)} is out of date.")
+
+        self.line_count = header['lines']
+        self.interval = header['interval']
+        self.checksum = header['checksum']
+        self.size = st.st_size
+        self._offsets = [int(entry[:_INDEX_WIDTH], 16) for entry in entries]
+        self._keys = [entry[_INDEX_WIDTH:] for entry in entries]
+        del entries
+
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+        if verify and self._checksum() != self.checksum:
+            self.close()
+            raise ValueError(f"The lookup index of {os.path.basename(path)} does not match the file.")
+
+    def _checksum(self):
+        checksum = 0
+        if self._map is not None:
+            with memoryview(self._map) as view:
+                for start in range(0, self.size, _COPY_CHUNK_SIZE):
+                    checksum = zlib.crc32(view[start:start + _COPY_CHUNK_SIZE], checksum)
+        return f'{checksum:08x}'
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _block(self, i):
+        """
+        Returns the byte range of the file between indexed lines i and i + 1.
+        """
+        end = self._offsets[i + 1] if i + 1 < len(self._offsets) else self.size
+        return self._offsets[i], end
+
+    def _find(self, line, start_block=0):
+        """
+        Returns the block that holds line if present and whether it is there; blocks before start_block are skipped.
+        """
+        if self._map is None:
+            return 0, False
+        i = bisect_right(self._keys, line, start_block) - 1
+        if i < 0:
+            return 0, False
+        if self._keys[i] == line:
+            return i, True
+        start, end = self._block(i)
+        # The line can only appear whole: right after a newline, never at the block start (that is the indexed line)
+        return i, self._map.find(b'\n' + line, start, end) >= 0
+
+    def contains(self, line):
+        """
+        Returns True if line (with or without its newline) is in the file.
+        """
+        return self._find(_normalize_query(line))[1]
+
+    def prefix(self, prefix, limit=None):
+        """
+        Returns the lines starting with prefix, in sorted order and without their newlines, at most limit of them.
+        """
+        if self._map is None:
+            return []
+        if isinstance(prefix, str):
+            prefix = prefix.encode('utf-8')
+        # Matching lines are contiguous and start in the block holding the first line >= prefix
+        i = max(bisect_left(self._keys, prefix) - 1, 0)
+        self._map.seek(self._block(i)[0])
+        matches = []
+        while limit is None or len(matches) < limit:
+            line = self._map.readline()
+            if not line:
+                break
+            if line.startswith(prefix):
+                matches.append(line[:-1])
+            elif line > prefix:
+                break
+        return matches
+
+def probe_file(path, probe_path, output_file, missing=False, progress_callback=None, active_check=None, **options):
+    """
+    Looks up every distinct line of probe_path in the indexed sorted file path, writing the lines found
+    (or with missing=True, the lines not found) to output_file in sorted order. The probe file is sorted
+    first with external_sort_deduplicate (other options go there), then walked as a merge-probe.
+    Returns (lines written, distinct probe lines), or None if cancelled.
+    """
+    with SortedFileIndex(path) as index:
+        sorted_probe = _new_run_name(_spill_dir_for(options.get('spill_dirs'), 0))
+        try:
+            def report_sort(value):
+                # Report up to 50% for sorting the probe file
+                if progress_callback:
+                    progress_callback(value // 2)
+
+            if not external_sort_deduplicate([probe_path], sorted_probe, progress_callback=report_sort,
+                                             active_check=active_check, **options):
+                return None
+
+            total_size = os.path.getsize(sorted_probe)
+            probed_size = 0
+            written = 0
+            probed = 0
+            # Probes arrive sorted, so each lookup starts from the block of the previous one, like a merge-join
+            block = 0
+            with open(sorted_probe, 'rb') as f, open(output_file, 'wb') as out_f:
+                while True:
+                    if active_check and not active_check():
+                        return None
+                    lines = f.readlines(_MERGE_BATCH_BYTES)
+                    if not lines:
+                        break
+                    kept = []
+                    for line in lines:
+                        block, found = index._find(line, block)
+                        if found != missing:
+                            kept.append(line)
+                    out_f.write(b''.join(kept))
+                    written += len(kept)
+                    probed += len(lines)
+
+                    probed_size += sum(map(len, lines))
+                    if progress_callback:
+                        progress_callback(min(50 + int((probed_size * 50) / total_size), 99))
+        finally:
+            if os.path.exists(sorted_probe):
+                try:
+                    os.remove(sorted_probe)
+                except:
+                    pass
+
+    if progress_callback:
+        progress_callback(100)
+    return written, probed
+
+def _file_signature(path):
+    st = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+def _sync_file(name):
+    fd = os.open(name, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class SortCheckpoint:
+    """
+    Records the progress of a resumable external_sort_deduplicate job in job_dir/checkpoint.json: its inputs and
+    presorted files (path, size and mtime), the options its runs depend on, the input ranges already sorted
+    and the runs holding them, and once the merge phase started, the runs left to merge.
+    Runs are flushed to disk before they are recorded, and the manifest is replaced atomically, so it survives
+    a crash or reboot. A checkpoint left by another job, or by inputs that changed since, is discarded
+    along with its runs; so are stray runs in job_dir that never got recorded.
+    """
+    def __init__(self, job_dir, input_files, presorted_files=(), options=None):
+        self.job_dir = os.path.abspath(job_dir)
+        self.path = os.path.join(self.job_dir, CHECKPOINT_FILE)
+        os.makedirs(self.job_dir, exist_ok=True)
+        job = {
+            'inputs': [_file_signature(path) for path in input_files],
+            'presorted': [_file_signature(path) for path in presorted_files],
+            'options': options or {},
+        }
+        state = read_checkpoint(self.job_dir)
+        if state is not None and any(state.get(key) != value for key, value in job.items()):
+            discard_checkpoint(self.job_dir)
+            state = None
+        if state is not None:
+            intact = [run for run in state['runs'] if _run_intact(run)]
+            if state['phase'] == 'sort':
+                # A lost sort run only costs its range being sorted again
+                state['runs'] = intact
+            elif len(intact) != len(state['runs']):
+                discard_checkpoint(self.job_dir)
+                state = None
+        self.resumed = state is not None and bool(state['runs'])
+        self.state = state or {'version': 1, **job, 'phase': 'sort', 'runs': []}
+        self._extents = {tuple(run['extent']) for run in self.state['runs'] if 'extent' in run}
+
+        recorded = {run['name'] for run in self.state['runs']}
+        for name in os.listdir(self.job_dir):
+            path = os.path.join(self.job_dir, name)
+            if name.startswith('tmp') and name.endswith('.tmp') and path not in recorded:
+                try:
+                    os.remove(path)
+                except:
+                    pass
+        self.save()
+
+    @property
+    def phase(self):
+        return self.state['phase']
+
+    @property
+    def runs(self):
+        return self.state['runs']
+
+    def names(self):
+        return {run['name'] for run in self.state['runs']}
+
+    def is_sorted(self, extent):
+        return tuple(extent) in self._extents
+
+    def add_run(self, size, extent, run):
+        """
+        Records a sort run from _sort_chunk_to_run, holding the input range extent that took size input bytes.
+        """
+        name, raw_size, stored_size, lines_out, lines_in = run
+        _sync_file(name)
+        self.state['runs'].append({'name': name, 'raw': raw_size, 'stored': stored_size, 'lines_out': lines_out,
+                                   'lines_in': lines_in, 'size': size, 'extent': list(extent)})
+        self._extents.add(tuple(extent))
+        self.save()
+
+    def start_merge(self):
+        self.state['phase'] = 'merge'
+        self.save()
+
+    def replace_runs(self, group, name):
+        """
+        Records that the runs of group were merged into the run name, which replaces them.
+        """
+        _sync_file(name)
+        merged = set(group)
+        raw_size = sum(run['raw'] for run in self.state['runs'] if run['name'] in merged)
+        self.state['runs'] = [run for run in self.state['runs'] if run['name'] not in merged]
+        self.state['runs'].append({'name': name, 'raw': raw_size, 'stored': os.path.getsize(name)})
+        self.save()
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    def finish(self):
+        """
+        Forgets the checkpoint once the job is complete; its runs are removed by the job itself.
+        """
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+def _run_intact(run):
+    try:
+        return os.path.getsize(run['name']) == run['stored']
+    except OSError:
+        return False
+
+def read_checkpoint(job_dir):
+    """
+    Returns the state a SortCheckpoint recorded in job_dir, or None if there is none (or it can't be read).
+    """
+    try:
+        with open(os.path.join(job_dir, CHECKPOINT_FILE)) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(state, dict) or state.get('version') != 1:
+        return None
+    return state
+
+def discard_checkpoint(job_dir):
+    """
+    Removes the checkpoint in job_dir and the runs it recorded.
+    """
+    state = read_checkpoint(job_dir)
+    for run in state['runs'] if state else ():
+        try:
+            os.remove(run['name'])
+        except OSError:
+            pass
+    try:
+        os.remove(os.path.join(job_dir, CHECKPOINT_FILE))
+    except OSError:
+        pass
+
+def external_sort_deduplicate(input_files, output_file, progress_callback=None, active_check=None, chunk_size=64 * 1024 * 1024, workers=1, max_fan_in=DEFAULT_MAX_FAN_IN, run_codec=None, stats_callback=None, spill_dirs=None, presorted_files=(), mark_sorted=False, key_spec=None, index_interval=None, output_codec=None, job_dir=None, shards=None):
     """
     Deduplicates and merges multiple text files using External Sort-Merge algorithm.
-    This ensures minimal RAM usage (approx. chunk_size) even for massive files.
+    This ensures minimal RAM usage (approx. chunk_size per worker) even for massive files.
+    With one worker, reading, sorting and writing runs overlap in a pipeline;
+    with workers > 1, sorted runs are generated in parallel by a pool of worker processes.
+    When there are more than max_fan_in runs, they are merged in several deduplicating passes.
+    With run_codec ('zstd', 'lz4', 'zlib' or 'auto'), temporary runs are compressed and
+    stats_callback receives each run's uncompressed and on-disk size, and StageTelemetry reports of the
+    sort and merge phases: bytes and lines read and written, duplicates removed, runs, merge fan-in, MB/s and ETA.
+    Runs are striped round-robin across spill_dirs (the system temp folder by default),
+    and the job refuses to start if they don't have enough free space.
+    presorted_files are already sorted and deduplicated: they skip run generation and join the final merge.
+    With mark_sorted, a sidecar marker is written next to the output so it can be merged into incrementally.
+    With a key_spec, lines are deduplicated on their key and the output is sorted by key; it gets no marker.
+    With index_interval, a sparse index of every index_interval-th line is written next to the output for lookups.
+    Compressed inputs are decompressed as they are read. With output_codec ('gzip', 'bz2', 'xz' or 'zstd') the output
+    is compressed on a thread pool; it then gets neither a marker nor an index, which need plain text.
+    With job_dir, progress is checkpointed there (see SortCheckpoint), and runs are kept there unless spill_dirs
+    are given: run again with the same job_dir after being cancelled, crashing or a reboot, the job skips the input
+    ranges it already sorted and the merge groups it already merged. Only the final merge pass starts over.
+    With shards (a ShardSpec), the output is written as shards with a manifest instead of one file; it then
+    gets neither a marker nor an index, which describe a single file.
     """
+    if max_fan_in < 2 + len(presorted_files):
+        raise ValueError("max_fan_in must be at least 2 plus the number of presorted files.")
+    if output_codec is not None and index_interval:
+        raise ValueError("A lookup index needs uncompressed output.")
+    if shards is not None and index_interval:
+        raise ValueError("A lookup index needs a single output file.")
+    if key_spec is not None and presorted_files:
+        raise ValueError("Presorted files cannot be merged when deduplicating on a key.")
+    run_codec = _resolve_run_codec(run_codec)
+
     temp_files = []
-    
+    checkpoint = None
+    if job_dir is not None:
+        # Runs that must outlive a reboot can't stay in the system temp folder, which may be cleared
+        checkpoint = SortCheckpoint(job_dir, input_files, presorted_files, {
+            'chunk_size': chunk_size,
+            'run_codec': run_codec,
+            'key_spec': key_spec.to_dict() if key_spec is not None else None,
+        })
+        spill_dirs = spill_dirs or [checkpoint.job_dir]
+        temp_files += checkpoint.names()
+
     try:
         # Step 1: Split and Sort Phase
+        # Progress is counted in input bytes, which for compressed inputs are compressed bytes
         total_size = sum(os.path.getsize(f) for f in input_files)
-        processed_size = 0
-        
-        for input_path in input_files:
+        resumed_size = sum(run['size'] for run in checkpoint.runs if 'size' in run) if checkpoint else 0
+        processed_size = resumed_size
+        telemetry = StageTelemetry(stats_callback, 'sort', total_size - resumed_size)
+        # Each chunk of the inputs becomes one sorted run
+        expected_size = sum(_input_size_estimate(f) for f in input_files)
+        chunk_count = math.ceil(expected_size / chunk_size)
+
+        # Sorted runs hold about the whole input; a cascading merge pass briefly adds one merged group on top
+        required = expected_size + (chunk_size * max_fan_in if chunk_count > max_fan_in else 0)
+        if key_spec is not None:
+            required *= _KEYED_SPILL_FACTOR
+        if total_size > 0:
+            # Runs kept from an interrupted attempt already take their share
+            required *= 1 - resumed_size / total_size
+        _check_spill_space(required * (_COMPRESSED_SPILL_FACTOR if run_codec else 1), spill_dirs)
+
+        # Uncompressed bytes the merge phase will read, used for its progress
+        merge_size = sum(os.path.getsize(name) for name in presorted_files)
+        if checkpoint is not None:
+            merge_size += sum(run['raw'] for run in checkpoint.runs)
+            telemetry.set(resumed_runs=len(checkpoint.runs))
+            if progress_callback and checkpoint.resumed:
+                progress_callback(50 if checkpoint.phase == 'merge' or total_size == 0
+                                  else min(int((resumed_size * 50) / total_size), 50))
+
+        def report(size, run, extent=None):
+            nonlocal processed_size, merge_size
+            processed_size += size
+            name, raw_size, stored_size, lines_out, lines_in = run
+            temp_files.append(name)
+            if checkpoint is not None:
+                checkpoint.add_run(size, extent, run)
+            merge_size += raw_size
+            telemetry.update(bytes_read=size, bytes_written=stored_size, lines_in=lines_in, lines_out=lines_out,
+                             runs=1)
+            if stats_callback:
+                stats_callback({
+                    'stage': 'sort',
+                    'run': name,
+                    'raw_bytes': raw_size,
+                    'stored_bytes': stored_size,
+                    'ratio': raw_size / stored_size if stored_size else 1.0,
+                })
+            if progress_callback:
+                # Report up to 50% for this phase
+                progress = int((processed_size * 50) / total_size) if total_size > 0 else 50
+                progress_callback(min(progress, 50))
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        chunks = _input_chunks(input_files, chunk_size)
+        if checkpoint is not None:
+            chunks = _unsorted_chunks(chunks, checkpoint)
+        if checkpoint is not None and checkpoint.phase == 'merge':
+            # The sort phase was complete; the runs left to merge are all in the checkpoint
+            chunks.close()
+        elif workers <= 1 or chunk_count <= 1:
+            runs = _pipelined_runs(chunks, run_codec, spill_dirs, active_check, key_spec)
+            try:
+                for size, extent, run in runs:
+                    report(size, run, extent)
+            finally:
+                runs.close()
             if active_check and not active_check():
                 return False
-                
-            with open(input_path, 'rb') as f:
-                while True:
+        else:
+            workers = min(workers, chunk_count)
+            with ProcessPoolExecutor(max_workers=workers, initializer=_ignore_interrupts) as pool:
+                # Chunks are submitted as workers free up, so decompressed chunks never pile up in memory
+                pending = {}
+                submitted = 0
+                exhausted = False
+                try:
+                    while pending or not exhausted:
+                        while not exhausted and len(pending) < 2 * workers:
+                            item = next(chunks, None)
+                            if item is None:
+                                exhausted = True
+                                break
+                            size, position, task = item
+                            future = pool.submit(_sort_chunk_to_run, task, run_codec,
+                                                 _spill_dir_for(spill_dirs, submitted), key_spec, position)
+                            pending[future] = size, _chunk_extent(position, task)
+                            submitted += 1
+                        done, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            size, extent = pending.pop(future)
+                            report(size, future.result(), extent)
+                        if active_check and not active_check():
+                            return False
+                finally:
+                    chunks.close()
+                    # On cancellation or error, drop queued tasks and collect runs already written so they get
+                    # cleaned up, or kept for a resumed job
+                    for future in pending:
+                        future.cancel()
+                    pool.shutdown(wait=True)
+                    for future, (size, extent) in pending.items():
+                        if not future.cancelled() and future.exception() is None:
+                            temp_files.append(future.result()[0])
+                            if checkpoint is not None:
+                                checkpoint.add_run(size, extent, future.result())
+        telemetry.done()
+        if checkpoint is not None and checkpoint.phase == 'sort':
+            checkpoint.start_merge()
+
+        # Step 2: Merge Phase
+        runs = list(temp_files)
+
+        # Every cascading pass reads about all of the data again, so progress spans all passes
+        passes = 1
+        run_count = len(runs)
+        while run_count + len(presorted_files) > max_fan_in:
+            run_count = math.ceil(run_count / max_fan_in)
+            passes += 1
+        merged_size = 0
+        telemetry = StageTelemetry(stats_callback, 'merge', merge_size * passes)
+        telemetry.set(passes=passes)
+
+        def report_merge(size, lines_in, written, lines_out):
+            nonlocal merged_size
+            merged_size += size
+            telemetry.update(bytes_read=size, lines_in=lines_in, bytes_written=written, lines_out=lines_out)
+            if progress_callback:
+                # Report from 50% up to 99% for this phase; 100% is reported once the output is complete
+                progress = 50 + int((merged_size * 50) / (merge_size * passes)) if merge_size > 0 else 50
+                progress_callback(min(progress, 99))
+
+        # Merge at most max_fan_in runs at a time, so huge inputs don't exhaust file handles
+        while len(runs) + len(presorted_files) > max_fan_in:
+            merged_runs = []
+            for i in range(0, len(runs), max_fan_in):
+                if active_check and not active_check():
+                    return False
+
+                group = runs[i:i + max_fan_in]
+                if len(group) == 1:
+                    merged_runs.append(group[0])
+                    continue
+
+                name = _new_run_name(_spill_dir_for(spill_dirs, i // max_fan_in))
+                temp_files.append(name)
+                telemetry.set(fan_in=len(group))
+                with _open_run(name, 'wb', run_codec) as tmp:
+                    if not _merge_runs(group, tmp, active_check, run_codec, consumed_callback=report_merge,
+                                       keyed=key_spec is not None):
+                        return False
+                merged_runs.append(name)
+                if checkpoint is not None:
+                    checkpoint.replace_runs(group, name)
+
+                # Intermediate runs are no longer needed once merged
+                for name in group:
+                    os.remove(name)
+            runs = merged_runs
+
+        if active_check and not active_check():
+            return False
+
+        # Keyed output is sorted by key rather than by line, so it can't be searched by line
+        index_builder = SparseIndexBuilder(index_interval) if index_interval and key_spec is None else None
+        telemetry.set(fan_in=len(runs) + len(presorted_files))
+        with open_output(output_file, output_codec, workers, shards, key_spec) as out_f:
+            if not _merge_runs(runs, out_f, active_check, run_codec, presorted_files, report_merge,
+                               keyed=key_spec is not None, strip_keys=True, index_builder=index_builder):
+                return False
+        telemetry.done()
+        if checkpoint is not None:
+            checkpoint.finish()
+            checkpoint = None
+
+        if mark_sorted and key_spec is None and output_codec is None and shards is None:
+            write_sorted_marker(output_file)
+        if index_builder:
+            index_builder.write(output_file)
+
+        if progress_callback:
+            progress_callback(100)
+
+        return True
+
+    finally:
+        # Cleanup temporary files, except the runs a resumed job will pick up
+        kept = checkpoint.names() if checkpoint is not None else ()
+        for name in temp_files:
+            try:
+                if name not in kept and os.path.exists(name):
+                    os.remove(name)
+            except:
+                pass
+
+def _split_bucket(name, parts, seed, key_spec, spill_dirs):
+    """
+    Splits a bucket of index-tagged records into parts by a hash of their line (or key) seeded with seed,
+    so records that share a line still end up together. Each part keeps the records in index order.
+    """
+    part_names = []
+    outputs = []
+    try:
+        for j in range(parts):
+            part_name = _new_run_name(_spill_dir_for(spill_dirs, j))
+            part_names.append(part_name)
+            outputs.append(open(part_name, 'wb'))
+        writes = [f.write for f in outputs]
+        with open(name, 'rb') as f:
+            if key_spec is None:
+                for record in f:
+                    writes[hash((seed, record[_INDEX_WIDTH:])) % parts](record)
+            else:
+                for record in f:
+                    key = record[_INDEX_WIDTH:record.index(_KEY_SEPARATOR, _INDEX_WIDTH)]
+                    writes[hash((seed, key)) % parts](record)
+    except BaseException:
+        for f in outputs:
+            f.close()
+        for part_name in part_names:
+            try:
+                os.remove(part_name)
+            except:
+                pass
+        raise
+    for f in outputs:
+        f.close()
+    return part_names
+
+def _deduplicate_bucket(name, kept_name, key_spec, memory_budget, spill_dirs, telemetry, active_check=None, depth=0):
+    """
+    Writes the first record of each line (or key; the last with keep='last') of a hash bucket to kept_name,
+    as index-tagged lines in index order. A bucket too large to deduplicate in memory_budget with a set,
+    e.g. because the partition count hit its cap or the keys are skewed, is split again by a differently
+    seeded hash and its parts are deduplicated one at a time, then merged back by index.
+    Returns False if cancelled.
+    """
+    size = os.path.getsize(name)
+    if size * _SET_OVERHEAD > memory_budget and depth < _MAX_REPARTITION_DEPTH:
+        parts = min(max(2, math.ceil(size * _SET_OVERHEAD / memory_budget)), _MAX_PARTITIONS)
+        part_names = _split_bucket(name, parts, depth + 1, key_spec, spill_dirs)
+        kept_parts = []
+        try:
+            for j, part_name in enumerate(part_names):
+                if active_check and not active_check():
+                    return False
+                kept_part = _new_run_name(_spill_dir_for(spill_dirs, j))
+                kept_parts.append(kept_part)
+                if not _deduplicate_bucket(part_name, kept_part, key_spec, memory_budget, spill_dirs, telemetry,
+                                           active_check, depth + 1):
+                    return False
+                os.remove(part_name)
+
+            opened = [open(kept_part, 'rb') for kept_part in kept_parts]
+            try:
+                with open(kept_name, 'wb') as tmp:
+                    tmp.writelines(heapq.merge(*opened))
+            finally:
+                for f in opened:
+                    f.close()
+            return True
+        finally:
+            for part_name in part_names + kept_parts:
+                try:
+                    if os.path.exists(part_name):
+                        os.remove(part_name)
+                except:
+                    pass
+
+    tmp = open(kept_name, 'wb')
+    records_in = 0
+    try:
+        if key_spec is None:
+            seen = set()
+            with open(name, 'rb') as f:
+                for records_in, record in enumerate(f, 1):
+                    line = record[_INDEX_WIDTH:]
+                    if line not in seen:
+                        seen.add(line)
+                        tmp.write(record)
+            records_out = len(seen)
+            del seen
+        else:
+            # Keeping the last record means replacing earlier ones, so kept records are sorted back by index
+            kept = {}
+            keep_last = key_spec.keep == 'last'
+            with open(name, 'rb') as f:
+                for records_in, record in enumerate(f, 1):
+                    separator = record.index(_KEY_SEPARATOR, _INDEX_WIDTH)
+                    key = record[_INDEX_WIDTH:separator]
+                    if keep_last or key not in kept:
+                        kept[key] = record[:_INDEX_WIDTH] + record[separator + len(_KEY_SEPARATOR):]
+            tmp.write(b''.join(sorted(kept.values()) if keep_last else kept.values()))
+            records_out = len(kept)
+            del kept
+        telemetry.update(bytes_read=size, bytes_written=tmp.tell(), lines_in=records_in, lines_out=records_out)
+    finally:
+        tmp.close()
+    return True
+
+def hash_partition_deduplicate(input_files, output_file, progress_callback=None, active_check=None, memory_budget=DEFAULT_MEMORY_BUDGET, spill_dirs=None, stats_callback=None, key_spec=None, output_codec=None, shards=None):
+    """
+    Deduplicates and merges multiple text files while keeping the first occurrence of each line in its original order.
+    Lines are hash-partitioned into spill buckets small enough to deduplicate in memory_budget with a set
+    (buckets that still come out too large are split again, see _deduplicate_bucket), then the surviving lines of all buckets are merged back by their original position.
+    Buckets are striped round-robin across spill_dirs (the system temp folder by default).
+    stats_callback receives StageTelemetry reports of the partition, dedup and rebuild phases.
+    With a key_spec, lines are deduplicated on their key and the kept record of each key stays at its own position.
+    Compressed inputs are decompressed as they are read, and output_codec compresses the output on a thread pool.
+    shards (a ShardSpec) splits the output into shards with a manifest.
+    """
+    bucket_files = []
+    kept_files = []
+
+    try:
+        # Progress is counted in input bytes; partitions and spill space are sized for the decompressed inputs
+        total_size = sum(os.path.getsize(f) for f in input_files)
+        expected_size = sum(_input_size_estimate(f) for f in input_files)
+        partitions = min(max(1, math.ceil(expected_size * _SET_OVERHEAD / memory_budget)), _MAX_PARTITIONS)
+        _check_spill_space(expected_size * _PARTITION_SPILL_FACTOR * (_KEYED_SPILL_FACTOR if key_spec else 1),
+                           spill_dirs)
+
+        # Step 1: Partition Phase
+        # Every line is tagged with its global index and routed to a bucket by its hash,
+        # so identical lines always land in the same bucket
+        telemetry = StageTelemetry(stats_callback, 'partition', total_size)
+        buckets = []
+        try:
+            for i in range(partitions):
+                name = _new_run_name(_spill_dir_for(spill_dirs, i))
+                bucket_files.append(name)
+                buckets.append(open(name, 'wb'))
+
+            index = 0
+            processed_size = 0
+            last_progress = -1
+            for input_path in input_files:
+                if active_check and not active_check():
+                    return False
+
+                for size, block in _input_blocks(input_path):
                     if active_check and not active_check():
                         return False
-                        
-                    lines = f.readlines(chunk_size)
-                    if not lines:
-                        break
-                        
-                    # Normalize lines (ensure they end with \n) before sorting for consistent deduplication
-                    lines = [line.rstrip(b'\r\n') + b'\n' for line in lines]
-                    
-                    # Sort lines in memory
-                    lines.sort()
-                    
-                    # Store sorted run in a temporary file
-                    tmp = tempfile.NamedTemporaryFile(delete=False, suffix='.tmp')
-                    # Remove duplicates in-memory for this chunk to reduce disk usage
-                    last_line = None
-                    for line in lines:
-                        if line != last_line:
-                            tmp.write(line)
-                            last_line = line
-                    
-                    tmp.close()
-                    temp_files.append(tmp.name)
-                    
-                    processed_size += sum(len(line) for line in lines)
+
+                    # Lines come from one split of the normalized block; the bucket writes are batched per block
+                    lines = block.split(b'\n')
+                    lines.pop()
+                    del block
+                    records = [[] for _ in range(partitions)]
+                    if key_spec is None:
+                        for line_index, line in enumerate(lines, index):
+                            records[hash(line) % partitions].append(b'%016x%s\n' % (line_index, line))
+                    else:
+                        # The key is computed once here and travels with the record to the deduplication phase
+                        for line_index, line in enumerate(lines, index):
+                            key = key_spec.extract(line)
+                            record = b'%016x%s%s%s\n' % (line_index, key, _KEY_SEPARATOR, line)
+                            records[hash(key) % partitions].append(record)
+                    index += len(lines)
+                    written = 0
+                    for bucket, batch in zip(buckets, records):
+                        if batch:
+                            data = b''.join(batch)
+                            bucket.write(data)
+                            written += len(data)
+                    del records
+                    telemetry.update(bytes_read=size, bytes_written=written, lines_in=len(lines), lines_out=len(lines))
+                    del lines
+
+                    processed_size += size
                     if progress_callback:
                         # Report up to 50% for this phase
                         progress = int((processed_size * 50) / total_size) if total_size > 0 else 50
-                        progress_callback(min(progress, 50))
-        
-        # Step 2: Merge Phase
+                        if progress != last_progress:
+                            progress_callback(min(progress, 50))
+                            last_progress = progress
+        finally:
+            for tmp in buckets:
+                tmp.close()
+        telemetry.done()
+
+        # Step 2: Bucket Deduplication Phase
+        # Records in a bucket are already in index order, so the first record seen for a line is its first occurrence
+        telemetry = StageTelemetry(stats_callback, 'dedup', sum(os.path.getsize(name) for name in bucket_files))
+        for i, name in enumerate(bucket_files):
+            if active_check and not active_check():
+                return False
+
+            kept_name = _new_run_name(_spill_dir_for(spill_dirs, i))
+            kept_files.append(kept_name)
+            if not _deduplicate_bucket(name, kept_name, key_spec, memory_budget, spill_dirs, telemetry, active_check):
+                return False
+
+            os.remove(name)
+
+            if progress_callback:
+                progress_callback(50 + int(((i + 1) * 40) / partitions))
+
+        telemetry.done()
+
+        # Step 3: Rebuild Phase
         if active_check and not active_check():
             return False
-            
-        # Open all temp files
-        opened_temps = [open(name, 'rb') for name in temp_files]
+        rebuild_size = sum(os.path.getsize(name) for name in kept_files)
+        telemetry = StageTelemetry(stats_callback, 'rebuild', rebuild_size)
+
+        def report_rebuild(records, written):
+            # Counted in bulk: each record is its line plus the fixed-width index
+            reported = telemetry.counters
+            telemetry.update(bytes_read=written + records * _INDEX_WIDTH - reported['bytes_read'],
+                             bytes_written=written - reported['bytes_written'],
+                             lines_in=records - reported['lines_in'], lines_out=records - reported['lines_out'])
+            if progress_callback and rebuild_size > 0:
+                # Report from 90% up to 99% for this phase
+                progress_callback(min(90 + int((reported['bytes_read'] * 10) / rebuild_size), 99))
+
+        opened_kept = [open(name, 'rb') for name in kept_files]
+        try:
+            # Indices are unique and fixed-width, so records compare by original position
+            with open_output(output_file, output_codec, shards=shards, key_spec=key_spec) as out_f:
+                records = 0
+                for records, record in enumerate(heapq.merge(*opened_kept), 1):
+                    if active_check and not active_check():
+                        return False
+                    out_f.write(record[_INDEX_WIDTH:])
+                    if not records & 0xFFFF:
+                        report_rebuild(records, out_f.tell())
+                report_rebuild(records, out_f.tell())
+        finally:
+            for f in opened_kept:
+                f.close()
+        telemetry.done()
+
+        if progress_callback:
+            progress_callback(100)
+
+        return True
+
+    finally:
+        # Cleanup temporary files
+        for name in bucket_files + kept_files:
+            try:
+                if os.path.exists(name):
+                    os.remove(name)
+            except:
+                pass
+
+class HyperLogLog:
+    """
+    Estimates how many distinct items were added, in 2 ** precision one-byte registers
+    (a standard error of about 0.8% at the default precision). Items are hashed with the built-in
+    hash, so a sketch only means something within the process that filled it.
+    """
+    def __init__(self, precision=_HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add_many(self, items):
+        registers = self.registers
+        shift = 64 - self.precision
+        low_mask = (1 << shift) - 1
+        for item in items:
+            # The top bits pick the register, which keeps the longest run of leading zeros of the others
+            h = hash(item) & 0xFFFFFFFFFFFFFFFF
+            rank = shift - (h & low_mask).bit_length() + 1
+            index = h >> shift
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def count(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -rank for rank in self.registers)
+        empty = self.registers.count(0)
+        if estimate <= 2.5 * m and empty:
+            # Linear counting is more accurate while many registers are still empty
+            estimate = m * math.log(m / empty)
+        return int(round(estimate))
+
+def _sample_windows(path, sample_size, window=_PLAN_SAMPLE_WINDOW):
+    """
+    Reads about sample_size bytes of a file as (raw size, normalized lines) windows: spread evenly over
+    a plain file larger than that, or read from the start otherwise. Returns (windows, size, exact), where
+    size is the decompressed size (estimated for a compressed file not read to its end) and exact is True
+    when the whole file was read.
+    """
+    windows = []
+    size = os.path.getsize(path)
+    if detect_compression(path) is None and size > sample_size:
+        with open(path, 'rb') as f:
+            count = max(1, sample_size // window)
+            step = (size - window) / max(count - 1, 1)
+            for i in range(count):
+                f.seek(int(i * step))
+                data = f.read(window)
+                # Drop the partial lines at both ends of the window
+                start = data.find(b'\n') + 1 if i else 0
+                end = data.rfind(b'\n') + 1
+                if end > start:
+                    windows.append((end - start, _normalize_chunk(data[start:end])))
+        return windows, size, False
+
+    with open_input(path) as f:
+        carry = b''
+        read = 0
+        while True:
+            data = f.read(window) if read < sample_size else f.read(1)
+            if not data:
+                if carry:
+                    windows.append((len(carry), _normalize_chunk(carry)))
+                return windows, read, True
+            if read >= sample_size:
+                # The sample ended before the file did
+                return windows, max(_input_size_estimate(path), read), False
+            read += len(data)
+            data = carry + data
+            cut = data.rfind(b'\n') + 1
+            carry = data[cut:]
+            if cut:
+                windows.append((cut, _normalize_chunk(data[:cut])))
+
+def _format_megabytes(size):
+    return f"{size / (1024 * 1024):,.0f} MB"
+
+def plan_deduplication(input_files, memory_budget=DEFAULT_MEMORY_BUDGET, key_spec=None, index_interval=None, active_check=None, stats_callback=None, resumable=False):
+    """
+    Picks the engine of deduplicate_files(engine='auto') from a sample of up to _PLAN_SAMPLE_SIZE bytes:
+    lines per byte give the total line count, and a HyperLogLog sketch of the sampled lines (or keys)
+    their distinct count, extrapolated by how fast it grew between the two halves of the sample.
+    The 'memory' engine is picked when the distinct lines fit in memory_budget, then 'hash' while its
+    partitions fit in it, and 'sort' beyond that or when a lookup index (index_interval) is wanted.
+    With resumable, 'sort' also replaces 'hash', whose progress can't be checkpointed.
+    Returns the plan as a dict ('plan', 'reason', 'estimated_lines', 'estimated_distinct', 'estimated_memory',
+    'memory_budget' and 'sample_fraction'), which is also the final report of a 'plan' stage to stats_callback.
+    Returns None if cancelled.
+    """
+    # Step 1: Sampling Phase
+    # With many files only some are sampled, so the sample stays short; each gets a share by size
+    stride = max(1, math.ceil(len(input_files) * _LINE_SAMPLE_SIZE / _PLAN_SAMPLE_SIZE))
+    sampled_files = input_files[::stride]
+    sampled_size = sum(os.path.getsize(f) for f in sampled_files)
+    telemetry = StageTelemetry(stats_callback, 'plan', min(sampled_size, _PLAN_SAMPLE_SIZE))
+    expected_sizes = {f: _input_size_estimate(f) for f in input_files}
+    exact = stride == 1
+    file_windows = []
+    for path in sampled_files:
+        if active_check and not active_check():
+            return None
+        share = _PLAN_SAMPLE_SIZE * os.path.getsize(path) // sampled_size if sampled_size else 0
+        windows, expected_sizes[path], complete = _sample_windows(path, max(share, _LINE_SAMPLE_SIZE))
+        exact = exact and complete
+        file_windows.append(windows)
+        telemetry.update(bytes_read=sum(size for size, _ in windows))
+
+    # Step 2: Counting Phase
+    # Every other window of each file goes in first, so the distinct count is also known at half the sample
+    sketch = HyperLogLog()
+    sampled = lines = key_bytes = 0
+    half_lines = half_distinct = 0
+    for half in (0, 1):
+        for windows in file_windows:
+            for size, data in windows[half::2]:
+                if active_check and not active_check():
+                    return None
+                window_lines = data.split(b'\n')
+                window_lines.pop()
+                if key_spec is not None:
+                    keys = [key_spec.extract(line) for line in window_lines]
+                    key_bytes += sum(map(len, keys))
+                    sketch.add_many(keys)
+                else:
+                    sketch.add_many(window_lines)
+                sampled += size
+                lines += len(window_lines)
+                telemetry.update(lines_in=len(window_lines))
+        if not half:
+            half_lines, half_distinct = lines, sketch.count()
+    distinct = min(sketch.count(), lines)
+    telemetry.update(lines_out=distinct)
+
+    # Step 3: Estimates
+    # Distinct lines grow between linearly (all unique) and not at all (a few lines repeated) with the
+    # input; the growth seen across the sample sets the exponent they are extrapolated with
+    expected_total = sum(expected_sizes.values())
+    fraction = 1.0 if exact else min(1.0, sampled / expected_total) if expected_total else 1.0
+    if lines == 0:
+        estimated_lines = estimated_distinct = 0
+        estimated_memory = 0 if exact else expected_total * _SET_OVERHEAD
+    else:
+        estimated_lines = lines if fraction >= 1 else round(lines / fraction)
+        growth = 1.0
+        if half_distinct and half_lines < lines:
+            growth = min(1.0, max(0.0, math.log(distinct / half_distinct) / math.log(lines / half_lines)))
+        estimated_distinct = min(estimated_lines, max(distinct, round(distinct * (1 / fraction) ** growth)))
+        if key_spec is None:
+            entry = sampled / lines
+        elif key_spec.keep == 'first':
+            # Only the keys are kept; the lines are written out as they are first seen
+            entry = key_bytes / lines
+        else:
+            entry = (key_bytes + sampled) / lines + _MEMORY_ENTRY_OVERHEAD
+        estimated_memory = round(estimated_distinct * (entry + _MEMORY_ENTRY_OVERHEAD))
+
+    # Step 4: Engine Choice
+    partitions = max(1, math.ceil(expected_total * _SET_OVERHEAD / memory_budget))
+    needed, budget = _format_megabytes(estimated_memory), _format_megabytes(memory_budget)
+    if index_interval is not None:
+        engine, reason = 'sort', "a lookup index needs sorted output"
+    elif estimated_memory <= memory_budget:
+        engine, reason = 'memory', f"the distinct lines need about {needed} of the {budget} budget"
+    elif resumable:
+        engine, reason = 'sort', (f"the distinct lines need about {needed}, more than the {budget} budget, "
+                                  f"and only sorted runs can be checkpointed")
+    elif partitions <= _MAX_PARTITIONS:
+        engine, reason = 'hash', (f"the distinct lines need about {needed}, more than the {budget} budget, "
+                                  f"but {partitions} hash partitions fit in it")
+    else:
+        engine, reason = 'sort', (f"{partitions} hash partitions would be needed to fit the {budget} budget, "
+                                  f"more than {_MAX_PARTITIONS}")
+
+    plan = {
+        'plan': engine,
+        'reason': reason,
+        'estimated_lines': estimated_lines,
+        'estimated_distinct': estimated_distinct,
+        'estimated_memory': estimated_memory,
+        'memory_budget': memory_budget,
+        'sample_fraction': round(fraction, 4),
+    }
+    telemetry.set(**plan)
+    telemetry.done()
+    return plan
+
+def memory_deduplicate(input_files, output_file, progress_callback=None, active_check=None, stats_callback=None, key_spec=None, output_codec=None, memory_limit=None, shards=None):
+    """
+    Deduplicates and merges multiple text files in a single pass with an in-memory set, keeping the first
+    occurrence of each line in its original order, without any temporary files. Meant for inputs whose
+    distinct lines fit in memory: with memory_limit, it stops and returns None once the lines it keeps are
+    estimated to take more than that many bytes. With a key_spec, lines are deduplicated on their key and
+    keep='last' keeps the latest record of each key at its own position.
+    Compressed inputs are decompressed as they are read, output_codec compresses the output and shards
+    (a ShardSpec) splits it into shards with a manifest. Returns False if cancelled.
+    """
+    total_size = sum(os.path.getsize(f) for f in input_files)
+    telemetry = StageTelemetry(stats_callback, 'dedup', total_size)
+    keep_last = key_spec is not None and key_spec.keep == 'last'
+    seen = set()
+    seen_add = seen.add
+    kept = {}
+    used = 0
+    processed_size = 0
+    last_progress = -1
+
+    with open_output(output_file, output_codec, shards=shards, key_spec=key_spec) as out_f:
+        for input_path in input_files:
+            if active_check and not active_check():
+                return False
+
+            for size, block in _input_blocks(input_path):
+                if active_check and not active_check():
+                    return False
+
+                lines = block.split(b'\n')
+                lines.pop()
+                del block
+                written = 0
+                if keep_last:
+                    # A record replacing an earlier one moves to the end, so the dict stays in kept position order
+                    for line in lines:
+                        key = key_spec.extract(line)
+                        previous = kept.pop(key, None)
+                        if previous is None:
+                            used += len(key) + len(line) + 2 * _MEMORY_ENTRY_OVERHEAD
+                        else:
+                            used += len(line) - len(previous)
+                        kept[key] = line
+                    lines_out = 0
+                else:
+                    if key_spec is None:
+                        new = [line for line in lines if not (line in seen or seen_add(line))]
+                        used += sum(map(len, new)) + len(new) * _MEMORY_ENTRY_OVERHEAD
+                    else:
+                        new = []
+                        for line in lines:
+                            key = key_spec.extract(line)
+                            if key not in seen:
+                                seen_add(key)
+                                new.append(line)
+                                used += len(key) + _MEMORY_ENTRY_OVERHEAD
+                    if new:
+                        data = b'\n'.join(new) + b'\n'
+                        out_f.write(data)
+                        written = len(data)
+                    lines_out = len(new)
+                    del new
+                telemetry.update(bytes_read=size, bytes_written=written, lines_in=len(lines), lines_out=lines_out)
+                del lines
+
+                if memory_limit is not None and used > memory_limit:
+                    return None
+
+                processed_size += size
+                if progress_callback:
+                    # Keeping the last records leaves their writing for the end
+                    progress = int((processed_size * (90 if keep_last else 99)) / total_size) if total_size > 0 else 0
+                    if progress != last_progress:
+                        progress_callback(progress)
+                        last_progress = progress
+
+        if keep_last:
+            records = list(kept.values())
+            kept.clear()
+            for start in range(0, len(records), _WRITE_BLOCK_LINES):
+                if active_check and not active_check():
+                    return False
+                data = b'\n'.join(records[start:start + _WRITE_BLOCK_LINES]) + b'\n'
+                out_f.write(data)
+                telemetry.update(bytes_written=len(data), lines_out=min(_WRITE_BLOCK_LINES, len(records) - start))
+    telemetry.done()
+
+    if progress_callback:
+        progress_callback(100)
+    return True
+
+def deduplicate_files(input_files, output_file, engine='sort', progress_callback=None, active_check=None, workers=1, memory_budget=DEFAULT_MEMORY_BUDGET, run_codec=None, stats_callback=None, spill_dirs=None, mark_sorted=False, key_spec=None, index_interval=None, output_codec=None, job_dir=None, shards=None):
+    """
+    Runs the selected deduplication engine: 'sort' (external sort-merge, sorted output),
+    'hash' (hash-partitioned, keeps the original order of first occurrences), 'memory' (a single in-memory set,
+    same order as 'hash') or 'auto', which lets plan_deduplication pick one of them for memory_budget.
+    'auto' keeps the original order unless it picks 'sort', for a lookup index or very large inputs, and moves
+    on to 'hash' if the distinct lines outgrow the budget in memory after all.
+    With a key_spec, all engines deduplicate on a field instead of the whole line.
+    index_interval needs sorted output: 'auto' then always picks 'sort', and 'hash' or 'memory' raise ValueError.
+    All engines read compressed inputs, output_codec compresses the output and shards (a ShardSpec) splits it
+    into shard files listed in a manifest.
+    job_dir makes the 'sort' engine resumable (see external_sort_deduplicate); 'auto' then never picks 'hash',
+    and goes straight back to 'sort' when job_dir holds a checkpoint.
+    """
+    if index_interval and engine in ('hash', 'memory'):
+        raise ValueError("A lookup index needs sorted output, which the 'hash' and 'memory' engines don't write.")
+    if engine == 'auto' and job_dir is not None and read_checkpoint(job_dir) is not None:
+        engine = 'sort'
+    if engine == 'auto':
+        plan = plan_deduplication(input_files, memory_budget, key_spec=key_spec, index_interval=index_interval,
+                                  active_check=active_check, stats_callback=stats_callback,
+                                  resumable=job_dir is not None)
+        if plan is None:
+            return False
+        engine = plan['plan']
+        if engine == 'memory':
+            success = memory_deduplicate(input_files, output_file, progress_callback=progress_callback,
+                                         active_check=active_check, stats_callback=stats_callback, key_spec=key_spec,
+                                         output_codec=output_codec, memory_limit=memory_budget * _MEMORY_BUDGET_SLACK,
+                                         shards=shards)
+            if success is not None:
+                return success
+            # The sample underestimated the distinct lines: start over with partitions, or runs for a resumable job
+            engine = 'sort' if job_dir is not None else 'hash'
+            telemetry = StageTelemetry(stats_callback, 'plan')
+            telemetry.set(**{**plan, 'plan': engine, 'reason': "the distinct lines outgrew the memory budget"})
+            telemetry.done()
+    if engine == 'memory':
+        return memory_deduplicate(input_files, output_file, progress_callback=progress_callback,
+                                  active_check=active_check, stats_callback=stats_callback, key_spec=key_spec,
+                                  output_codec=output_codec, shards=shards)
+    if engine == 'hash':
+        return hash_partition_deduplicate(input_files, output_file, progress_callback=progress_callback,
+                                          active_check=active_check, memory_budget=memory_budget, spill_dirs=spill_dirs,
+                                          stats_callback=stats_callback, key_spec=key_spec, output_codec=output_codec,
+                                          shards=shards)
+    if engine == 'sort':
+        return external_sort_deduplicate(input_files, output_file, progress_callback=progress_callback,
+                                         active_check=active_check, workers=workers, run_codec=run_codec,
+                                         stats_callback=stats_callback, spill_dirs=spill_dirs, mark_sorted=mark_sorted,
+                                         key_spec=key_spec, index_interval=index_interval, output_codec=output_codec,
+                                         job_dir=job_dir, shards=shards)
+    raise ValueError(f"Unknown deduplication engine: {engine}")
+
+def incremental_deduplicate(master_file, input_files, progress_callback=None, active_check=None, **options):
+    """
+    Merges new input files into a master file previously deduplicated by external_sort_deduplicate.
+    While the master's sorted marker is valid, only the new inputs are sorted and a single merge-join
+    streams them against the master; otherwise the master is re-sorted along with them.
+    The master is replaced, and its marker rewritten, only when the job succeeds.
+    Other options are passed to external_sort_deduplicate.
+    """
+    if options.get('key_spec') is not None:
+        raise ValueError("Incremental merging deduplicates whole lines and cannot use a key.")
+    temp_output = master_file + '.tmp'
+    if is_sorted_unique(master_file):
+        inputs, presorted = list(input_files), [master_file]
+    elif os.path.exists(master_file):
+        inputs, presorted = [master_file] + list(input_files), []
+    else:
+        inputs, presorted = list(input_files), []
+
+    try:
+        success = external_sort_deduplicate(inputs, temp_output, progress_callback=progress_callback,
+                                            active_check=active_check, presorted_files=presorted, **options)
+        if success:
+            os.replace(temp_output, master_file)
+            write_sorted_marker(master_file)
+            if os.path.exists(sparse_index_path(temp_output)):
+                os.replace(sparse_index_path(temp_output), sparse_index_path(master_file))
+        return success
+    finally:
+        for name in (temp_output, sparse_index_path(temp_output)):
+            if os.path.exists(name):
+                try:
+                    os.remove(name)
+                except:
+                    pass
+
+def default_hash_cache_path():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'file_merger', 'source_hashes.json')
+
+class SourceHashCache:
+    """
+    Remembers the head and full-content hashes of source files, keyed by absolute path (so a relative path
+    means the same file whatever the working directory) and valid while the file keeps the same size and mtime.
+    Stored as JSON at path (default_hash_cache_path() by default).
+    """
+    def __init__(self, path=None):
+        self.path = path or default_hash_cache_path()
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+            if not isinstance(self.entries, dict):
+                self.entries = {}
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, path, st, kind):
+        entry = self.entries.get(os.path.abspath(path))
+        if entry and entry.get('size') == st.st_size and entry.get('mtime_ns') == st.st_mtime_ns:
+            return entry.get(kind)
+        return None
+
+    def put(self, path, st, kind, digest):
+        path = os.path.abspath(path)
+        entry = self.entries.get(path)
+        if not entry or entry.get('size') != st.st_size or entry.get('mtime_ns') != st.st_mtime_ns:
+            entry = self.entries[path] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        entry[kind] = digest
+
+    def save(self):
+        # Forget files that are gone, relative keys written by older versions, and the oldest entries beyond the limit
+        entries = {path: entry for path, entry in self.entries.items() if os.path.isabs(path) and os.path.exists(path)}
+        entries = dict(list(entries.items())[-_HASH_CACHE_LIMIT:])
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(entries, f)
+        os.replace(temp_path, self.path)
+
+def _hash_file(path, limit=None):
+    digest = hashlib.blake2b()
+    remaining = limit
+    with open(path, 'rb') as f:
+        while remaining is None or remaining > 0:
+            chunk = f.read(_COPY_CHUNK_SIZE if remaining is None else min(_COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return digest.hexdigest()
+
+def find_identical_sources(paths, active_check=None, workers=None, cache=None, keep='first'):
+    """
+    Finds byte-identical files among paths without reading most of them: only files sharing a size are hashed,
+    first by their first block and then, if that matches too, by their whole contents with BLAKE2, on a thread pool.
+    Returns (kept paths in their original order, {skipped path: identical kept path}); of each group of identical
+    files the first one is kept, or the last one with keep='last'. Hashes are looked up in and added to a
+    SourceHashCache if one is given. Returns None if cancelled.
+    """
+    stats = {path: os.stat(path) for path in paths}
+    by_size = {}
+    for path in dict.fromkeys(paths):
+        by_size.setdefault(stats[path].st_size, []).append(path)
+
+    def digests(candidates, kind, limit):
+        # Cached hashes are reused; the rest are computed in parallel
+        result = {}
+        missing = []
+        for path in candidates:
+            cached = cache.get(path, stats[path], kind) if cache else None
+            if cached:
+                result[path] = cached
+            else:
+                missing.append(path)
+        if missing:
+            with ThreadPoolExecutor(max_workers=workers or min(8, len(missing))) as pool:
+                pending = {pool.submit(_hash_file, path, limit): path for path in missing}
+                try:
+                    for future in pending:
+                        if active_check and not active_check():
+                            return None
+                        path = pending[future]
+                        result[path] = future.result()
+                        if cache:
+                            cache.put(path, stats[path], kind, result[path])
+                finally:
+                    for future in pending:
+                        future.cancel()
+        return result
+
+    # Step 1: Only files with the same size can be identical
+    groups = [group for group in by_size.values() if len(group) > 1]
+
+    # Step 2: Narrow the groups down by the hash of their first block, then by the full hash.
+    # Files no larger than the first block go straight to the full hash
+    for kind, limit in (('head', _PRESCAN_HEAD_SIZE), ('full', None)):
+        narrowed = []
+        for group in groups:
+            if kind == 'head' and stats[group[0]].st_size <= _PRESCAN_HEAD_SIZE:
+                narrowed.append(group)
+                continue
+            hashes = digests(group, kind, limit)
+            if hashes is None:
+                return None
+            by_hash = {}
+            for path in group:
+                by_hash.setdefault(hashes[path], []).append(path)
+            narrowed += [same for same in by_hash.values() if len(same) > 1]
+        groups = narrowed
+
+    skipped = {}
+    for group in groups:
+        kept = group[-1] if keep == 'last' else group[0]
+        for path in group:
+            if path != kept:
+                skipped[path] = kept
+    return [path for path in dict.fromkeys(paths) if path not in skipped], skipped
+
+def _combine_parts(operation, parts):
+    """
+    Applies a set operation to aligned blocks of sorted, deduplicated lines, returning the result sorted.
+    """
+    if operation == 'union':
+        batch = []
+        for part in parts:
+            batch += part
+        batch.sort()
+        return list(dict.fromkeys(batch))
+    if operation == 'intersection':
+        common = set(parts[0]).intersection(*parts[1:])
+        return [line for line in parts[0] if line in common]
+    if operation == 'difference':
+        others = set().union(*parts[1:])
+        return [line for line in parts[0] if line not in others]
+    # Each input holds a line at most once, so a count of one means exactly one input has it
+    counts = Counter()
+    for part in parts:
+        counts.update(part)
+    return sorted(line for line, count in counts.items() if count == 1)
+
+def set_operation_files(operation, input_files, output_file, progress_callback=None, active_check=None, stats_callback=None, spill_dirs=None, mark_sorted=False, **options):
+    """
+    Writes a set operation over the distinct lines of the input files to output_file, in sorted order:
+    'union' (lines in any input), 'intersection' (in every input), 'difference' (in the first input
+    but in no other) or 'symmetric_difference' (in exactly one input).
+    Each input is sorted and deduplicated on its own first, unless its sorted marker shows it already is,
+    and one merge-join pass then combines them, so memory stays bounded whatever the input sizes.
+    Other options are passed to external_sort_deduplicate. Returns False if cancelled.
+    """
+    if operation not in SET_OPERATIONS:
+        raise ValueError(f"Unknown set operation: {operation}")
+    if len(input_files) < 2:
+        raise ValueError("Set operations need at least two input files.")
+
+    temp_files = []
+
+    try:
+        # Step 1: Sort Phase, one sorted and deduplicated file per input
+        total_size = sum(os.path.getsize(f) for f in input_files)
+        processed_size = 0
+        sorted_inputs = []
+        for i, input_path in enumerate(input_files):
+            if active_check and not active_check():
+                return False
+
+            size = os.path.getsize(input_path)
+            if is_sorted_unique(input_path):
+                sorted_inputs.append(input_path)
+            else:
+                name = _new_run_name(_spill_dir_for(spill_dirs, i))
+                temp_files.append(name)
+
+                def report_sort(value, done=processed_size, size=size):
+                    # Report up to 80% for this phase
+                    if progress_callback and total_size > 0:
+                        progress_callback(int(((done + size * value / 100) * 80) / total_size))
+
+                if not external_sort_deduplicate([input_path], name, progress_callback=report_sort,
+                                                 active_check=active_check, stats_callback=stats_callback,
+                                                 spill_dirs=spill_dirs, **options):
+                    return False
+                sorted_inputs.append(name)
+            processed_size += size
+
+        # Step 2: Merge-Join Phase
+        join_size = sum(os.path.getsize(name) for name in sorted_inputs)
+        telemetry = StageTelemetry(stats_callback, 'join', join_size)
+        joined_size = 0
+        opened_inputs = [_open_run(name, 'rb') for name in sorted_inputs]
+        telemetry.set(fan_in=len(opened_inputs))
         try:
-            # Use heapq.merge to lazily merge all sorted files
-            merged_iter = heapq.merge(*opened_temps)
-            
             with open(output_file, 'wb') as out_f:
-                last_written_line = None
-                for line in merged_iter:
+                for parts in _aligned_blocks(opened_inputs):
+                    lines = _combine_parts(operation, parts)
+                    data = b''.join(lines)
+                    if data:
+                        out_f.write(data)
+
+                    size = sum(sum(map(len, part)) for part in parts)
+                    joined_size += size
+                    telemetry.update(bytes_read=size, bytes_written=len(data),
+                                     lines_in=sum(map(len, parts)), lines_out=len(lines))
+                    if progress_callback:
+                        # Report from 80% up to 99% for this phase
+                        progress = 80 + int((joined_size * 20) / join_size) if join_size > 0 else 80
+                        progress_callback(min(progress, 99))
                     if active_check and not active_check():
                         return False
-                        
-                    if line != last_written_line:
-                        out_f.write(line)
-                        last_written_line = line
-                    
-                    # We can't easily track exact progress here without more complexity,
-                    # so we just move from 50% to 100%.
-                    # Simplified progress reporting for merge phase.
         finally:
-            for f in opened_temps:
+            for f in opened_inputs:
                 f.close()
-                
+        telemetry.done()
+
+        if mark_sorted:
+            write_sorted_marker(output_file)
+
         if progress_callback:
             progress_callback(100)
-            
+
         return True
-        
+
     finally:
         # Cleanup temporary files
         for name in temp_files:
@@ -92,3 +2885,28 @@ def external_sort_deduplicate(input_files, output_file, progress_callback=None,
                     os.remove(name)
             except:
                 pass
+
+def deduplicate_in_place(path, progress_callback=None, active_check=None, **options):
+    """
+    Deduplicates a single file in place. The result goes to a temporary file next to it,
+    which replaces the original only once deduplication has fully succeeded.
+    A compressed file is written back compressed with the same codec.
+    Returns False if cancelled. Other options are passed to deduplicate_files.
+    """
+    # Use a hidden temp file in the same directory for safety
+    target = path + ".tmp"
+    try:
+        success = deduplicate_files([path], target, progress_callback=progress_callback,
+                                    active_check=active_check, output_codec=detect_compression(path), **options)
+        if success and (active_check is None or active_check()):
+            # Success: Swap temp file for original
+            os.replace(target, path)
+            return True
+        return False
+    finally:
+        # Cancelled or Error: Remove partial temp file
+        if os.path.exists(target):
+            try:
+                os.remove(target)
+            except:
+                pass